@@ -0,0 +1,240 @@
+"""
+Cache of chatbot answers keyed by document and normalized question.
+
+Keys combine the document ID, the document's content hash and the question
+reduced to its index terms, so questions that differ only in case,
+punctuation or stopwords share an entry. Entries expire after a TTL and the
+in-process backend evicts the least recently used entry once it is full.
+Documents are invalidated when they are re-extracted.
+
+Setting ANSWER_CACHE_URL to a Redis URL shares answers between worker
+processes; Redis then enforces the size bound through its own maxmemory
+eviction policy.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from retrieval import tokenize
+
+Answer = Tuple[str, float]
+
+
+def normalize_question(question: str) -> str:
+    """Reduce a question to the index terms retrieval actually sees."""
+    return ' '.join(tokenize(question))
+
+
+class AnswerCache:
+    """Base class for answer cache backends, counting hits and misses."""
+
+    backend = None
+
+    def __init__(self, ttl: float = 3600):
+        """Initialize the cache.
+
+        Args:
+            ttl: Seconds an answer stays valid; 0 disables expiry.
+        """
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._stats_lock = threading.Lock()
+
+    def get(self, pdf_id, content_hash: Optional[str], question: str) -> Optional[Answer]:
+        """Look up a cached answer.
+
+        Args:
+            pdf_id: ID of the PDF document.
+            content_hash: Content hash of the document.
+            question: Question text as asked.
+
+        Returns:
+            Tuple of (response text, confidence), or None on a miss.
+        """
+        answer = self._get(str(pdf_id), self._key(content_hash, question))
+        with self._stats_lock:
+            if answer is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return answer
+
+    def set(self, pdf_id, content_hash: Optional[str], question: str, answer: Answer) -> None:
+        """Store an answer.
+
+        Args:
+            pdf_id: ID of the PDF document.
+            content_hash: Content hash of the document.
+            question: Question text as asked.
+            answer: Tuple of (response text, confidence).
+        """
+        self._set(str(pdf_id), self._key(content_hash, question), answer)
+
+    def invalidate(self, pdf_id) -> int:
+        """Drop every cached answer about a document.
+
+        Returns:
+            Number of entries removed.
+        """
+        return self._invalidate(str(pdf_id))
+
+    def stats(self) -> Dict:
+        """Return the hit, miss and eviction counters and the current size."""
+        with self._stats_lock:
+            return {
+                'backend': self.backend,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self)
+            }
+
+    @staticmethod
+    def _key(content_hash: Optional[str], question: str) -> str:
+        return f"{content_hash or ''}:{normalize_question(question)}"
+
+    def _count_evictions(self, count: int) -> None:
+        with self._stats_lock:
+            self.evictions += count
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def _get(self, pdf_id: str, key: str) -> Optional[Answer]:
+        raise NotImplementedError
+
+    def _set(self, pdf_id: str, key: str, answer: Answer) -> None:
+        raise NotImplementedError
+
+    def _invalidate(self, pdf_id: str) -> int:
+        raise NotImplementedError
+
+
+class LocalAnswerCache(AnswerCache):
+    """In-process LRU answer cache with a maximum number of entries."""
+
+    backend = 'local'
+
+    def __init__(self, max_size: int = 1024, ttl: float = 3600):
+        """Initialize the cache.
+
+        Args:
+            max_size: Maximum number of cached answers.
+            ttl: Seconds an answer stays valid; 0 disables expiry.
+        """
+        super().__init__(ttl)
+        self.max_size = max_size
+        self._entries = OrderedDict()  # (pdf_id, key) -> (expires_at, answer)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _get(self, pdf_id, key):
+        with self._lock:
+            entry = self._entries.get((pdf_id, key))
+            if entry is None:
+                return None
+            expires_at, answer = entry
+            if expires_at and expires_at <= time.monotonic():
+                del self._entries[(pdf_id, key)]
+                self._count_evictions(1)
+                return None
+            self._entries.move_to_end((pdf_id, key))
+            return answer
+
+    def _set(self, pdf_id, key, answer):
+        if self.max_size <= 0:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._entries[(pdf_id, key)] = (expires_at, tuple(answer))
+            self._entries.move_to_end((pdf_id, key))
+            evicted = 0
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                evicted += 1
+        if evicted:
+            self._count_evictions(evicted)
+
+    def _invalidate(self, pdf_id):
+        with self._lock:
+            stale = [entry for entry in self._entries if entry[0] == pdf_id]
+            for entry in stale:
+                del self._entries[entry]
+        return len(stale)
+
+
+class RedisAnswerCache(AnswerCache):
+    """Answer cache shared between processes through Redis.
+
+    Counters are per process; expiry is delegated to Redis key TTLs.
+    """
+
+    backend = 'redis'
+    PREFIX = 'pdf-chatbot:answers'
+
+    def __init__(self, url: str, ttl: float = 3600, client=None):
+        """Connect to Redis.
+
+        Args:
+            url: Redis connection URL.
+            ttl: Seconds an answer stays valid; 0 disables expiry.
+            client: Optional preconfigured Redis client.
+        """
+        super().__init__(ttl)
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url)
+        self.client = client
+
+    def __len__(self):
+        return sum(1 for _ in self.client.scan_iter(match=f"{self.PREFIX}:*", count=1000))
+
+    def _redis_key(self, pdf_id, key):
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return f"{self.PREFIX}:{pdf_id}:{digest}"
+
+    def _get(self, pdf_id, key):
+        value = self.client.get(self._redis_key(pdf_id, key))
+        if value is None:
+            return None
+        response, confidence = json.loads(value)
+        return response, confidence
+
+    def _set(self, pdf_id, key, answer):
+        value = json.dumps(list(answer))
+        if self.ttl:
+            self.client.set(self._redis_key(pdf_id, key), value, ex=int(self.ttl))
+        else:
+            self.client.set(self._redis_key(pdf_id, key), value)
+
+    def _invalidate(self, pdf_id):
+        keys = list(self.client.scan_iter(match=f"{self.PREFIX}:{pdf_id}:*", count=1000))
+        if keys:
+            self.client.delete(*keys)
+        return len(keys)
+
+
+def create_answer_cache(config) -> Optional[AnswerCache]:
+    """Create the answer cache configured for an application.
+
+    Args:
+        config: Application config mapping.
+
+    Returns:
+        A RedisAnswerCache if ANSWER_CACHE_URL is set, a LocalAnswerCache if
+        ANSWER_CACHE_SIZE is positive, else None.
+    """
+    ttl = config.get('ANSWER_CACHE_TTL', 3600)
+    url = config.get('ANSWER_CACHE_URL')
+    if url:
+        return RedisAnswerCache(url, ttl=ttl)
+    size = config.get('ANSWER_CACHE_SIZE', 1024)
+    if size <= 0:
+        return None
+    return LocalAnswerCache(max_size=size, ttl=ttl)
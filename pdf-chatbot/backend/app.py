@@ -1,14 +1,25 @@
+import atexit
+import hashlib
+import json
 import os
+import threading
+import uuid
 from datetime import datetime
-from flask import Flask, jsonify, request
+from flask import Flask, current_app, jsonify, request, stream_with_context
 from flask_cors import CORS
 from flask_socketio import SocketIO, emit, join_room
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.exc import SQLAlchemyError
 from werkzeug.exceptions import RequestEntityTooLarge
 from config import get_config
-from models import db, ChatMessage
+from models import db, ChatMessage, ExtractionJob, PDFDocument
 from pdf_handler import PDFHandler
+from jobs import JobDispatchError, JobQueueFull, LocalDispatcher, create_dispatcher
+from answer_cache import create_answer_cache
+from message_writer import create_message_writer
+from chat_workers import ChatQueueFull, create_chat_worker_pool
+import metrics
+import migrations
 from chatbot import ChatbotService
 
 # Initialize SocketIO at module level for proper registration
@@ -33,15 +44,14 @@ def create_app(config_class=None):
     # Initialize extensions
     CORS(app)
     db.init_app(app)
-    socketio.init_app(app)
+    socketio.init_app(
+        app,
+        async_mode=app.config.get('SOCKETIO_ASYNC_MODE'),
+        message_queue=app.config.get('SOCKETIO_MESSAGE_QUEUE')
+    )
     
-    # Create database tables
-    with app.app_context():
-        try:
-            db.create_all()
-        except SQLAlchemyError as e:
-            app.logger.error(f"Failed to create database tables: {str(e)}")
-            raise
+    # The schema is migrated by `flask --app app schema upgrade`, not on start-up
+    migrations.register_commands(app)
     
     @app.route('/api/health')
     def health_check():
@@ -64,14 +74,77 @@ def create_app(config_class=None):
     os.makedirs(upload_folder, exist_ok=True)
     pdf_handler = PDFHandler(upload_folder)
     
+    # Dispatch extraction to Celery or to local worker threads
+    job_dispatcher = create_dispatcher(app, pdf_handler)
+    app.extensions['job_dispatcher'] = job_dispatcher
+    if isinstance(job_dispatcher, LocalDispatcher) and job_dispatcher.workers > 0:
+        recovery_lock = threading.Lock()
+        jobs_recovered = False
+        
+        # Only a process that serves requests resumes jobs. CLI commands such
+        # as `flask --app app schema upgrade` and Celery workers build the
+        # application too, and would claim jobs they never finish.
+        @app.before_request
+        def recover_jobs_on_first_request():
+            """Resume jobs left behind by a previous process, once."""
+            nonlocal jobs_recovered
+            if jobs_recovered:
+                return
+            with recovery_lock:
+                if jobs_recovered:
+                    return
+                jobs_recovered = True
+                try:
+                    job_dispatcher.recover(app.config['EXTRACTION_STALE_AFTER'])
+                except SQLAlchemyError as e:
+                    db.session.rollback()
+                    app.logger.error(
+                        f"Could not resume extraction jobs; is the schema up to date "
+                        f"(flask --app app schema upgrade)? {str(e)}"
+                    )
+    
+    def queue_extraction(pdf_doc):
+        """Start extraction for a new upload unless its results were reused.
+        
+        Jobs are scheduled fairly between the tenants named by the optional
+        ``X-Tenant-ID`` header.
+        
+        Returns:
+            tuple: (ExtractionJob or None, warning message or None)
+        """
+        if pdf_doc.processing_status == 'completed':
+            return None, None
+        try:
+            return job_dispatcher.submit(
+                pdf_doc.id, tenant=request.headers.get('X-Tenant-ID', '')[:64] or None
+            ), None
+        except JobQueueFull as e:
+            # The job remains queued in the job table until a worker frees a slot
+            app.logger.warning(f"Extraction for {pdf_doc.id} deferred: {str(e)}")
+            return e.job, 'File uploaded; extraction is queued and starts when a worker is free'
+        except JobDispatchError as e:
+            # The file is stored; the job and document are marked failed
+            app.logger.error(f"Extraction for {pdf_doc.id} could not be queued: {str(e)}")
+            return e.job, (
+                'File uploaded, but extraction could not be started; upload it again to retry'
+            )
+    
     @app.route('/api/upload', methods=['POST'])
     def upload_pdf():
         """Handle PDF file upload.
         
+        Accepts either a multipart form with a ``file`` part, or a raw
+        ``application/pdf`` request body with the filename given in the
+        ``filename`` query parameter or ``X-Filename`` header. Raw bodies are
+        streamed to disk in a single pass.
+        
         Returns:
             JSON response with upload status and file details or error message.
         """
         try:
+            if request.mimetype == 'application/pdf':
+                return upload_pdf_stream()
+            
             # Validate request
             if 'file' not in request.files:
                 app.logger.warning("Upload attempt without file")
@@ -106,16 +179,7 @@ def create_app(config_class=None):
                     'message': error
                 }), 500
             
-            return jsonify({
-                'status': 'success',
-                'message': 'File uploaded successfully',
-                'file': {
-                    'id': str(pdf_doc.id),
-                    'filename': pdf_doc.filename,
-                    'size': pdf_doc.file_size,
-                    'upload_date': pdf_doc.upload_date.isoformat()
-                }
-            }), 201
+            return upload_response(pdf_doc)
             
         except RequestEntityTooLarge:
             return jsonify({
@@ -129,8 +193,112 @@ def create_app(config_class=None):
                 'message': 'Internal server error'
             }), 500
     
-    # Initialize chatbot service
-    chatbot_service = ChatbotService()
+    def upload_pdf_stream():
+        """Stream a raw PDF request body to storage."""
+        filename = request.args.get('filename') or request.headers.get('X-Filename', '')
+        if not filename:
+            app.logger.warning("Streamed upload attempt without filename")
+            return jsonify({
+                'status': 'error',
+                'message': 'No filename provided'
+            }), 400
+        
+        staged, error = pdf_handler.stage_stream(request.stream)
+        if error:
+            app.logger.warning(f"Invalid file upload attempt: {error}")
+            return jsonify({
+                'status': 'error',
+                'message': error
+            }), 400
+        
+        pdf_doc, error = pdf_handler.save_staged(staged, filename)
+        if error:
+            app.logger.error(f"Failed to save uploaded file: {error}")
+            return jsonify({
+                'status': 'error',
+                'message': error
+            }), 500
+        
+        return upload_response(pdf_doc)
+    
+    def upload_response(pdf_doc):
+        """Queue extraction and build the response for a stored upload.
+        
+        The status is 'warning' if the file was stored but extraction could
+        not be queued.
+        """
+        job, warning = queue_extraction(pdf_doc)
+        return jsonify({
+            'status': 'warning' if warning else 'success',
+            'message': warning or 'File uploaded successfully',
+            'file': {
+                'id': str(pdf_doc.id),
+                'filename': pdf_doc.filename,
+                'size': pdf_doc.file_size,
+                'content_hash': pdf_doc.content_hash,
+                'page_count': pdf_doc.page_count,
+                'title': pdf_doc.title,
+                'author': pdf_doc.author,
+                'processing_status': pdf_doc.processing_status,
+                'upload_date': pdf_doc.upload_date.isoformat()
+            },
+            'job_id': str(job.id) if job else None
+        }), 201
+    
+    @app.route('/api/documents/<pdf_id>/status', methods=['GET'])
+    def document_status(pdf_id):
+        """Report the processing status of a document and its latest job.
+        
+        Args:
+            pdf_id: ID of the PDF document.
+            
+        Returns:
+            JSON response with processing status, progress and job details.
+        """
+        try:
+            pdf_doc = db.session.get(PDFDocument, uuid.UUID(pdf_id))
+        except ValueError:
+            pdf_doc = None
+        if not pdf_doc:
+            return jsonify({
+                'status': 'error',
+                'message': 'Document not found'
+            }), 404
+        
+        job = ExtractionJob.query.filter_by(pdf_document_id=pdf_doc.id).order_by(
+            ExtractionJob.enqueued_at.desc()
+        ).first()
+        return jsonify({
+            'status': 'success',
+            'document': {
+                'id': str(pdf_doc.id),
+                'processing_status': pdf_doc.processing_status,
+                'processing_progress': pdf_doc.processing_progress,
+                'processing_error': pdf_doc.processing_error,
+                'page_count': pdf_doc.page_count,
+                'skipped_pages': pdf_doc.skipped_pages or []
+            },
+            'job': job_dispatcher.get_status(job) if job else None
+        })
+    
+    # Initialize chatbot service with the answer cache invalidated on extraction
+    answer_cache = create_answer_cache(app.config)
+    app.extensions['answer_cache'] = answer_cache
+    message_writer = create_message_writer(app)
+    if message_writer is not None:
+        app.extensions['message_writer'] = message_writer
+        # Flush buffered messages before the process exits
+        atexit.register(message_writer.close)
+    chatbot_service = ChatbotService(
+        retrieval_mode=app.config['RETRIEVAL_MODE'],
+        answer_cache=answer_cache,
+        message_writer=message_writer,
+        embedding_dim=app.config['RETRIEVAL_EMBEDDING_DIM']
+    )
+    # Shared by the Socket.IO handlers, so indexes and caches outlive a message
+    app.extensions['chatbot_service'] = chatbot_service
+    chat_workers = create_chat_worker_pool(app, socketio)
+    app.extensions['chat_workers'] = chat_workers
     
     @app.route('/api/chat/<pdf_id>', methods=['POST'])
     def chat_message(pdf_id):
@@ -140,7 +308,8 @@ def create_app(config_class=None):
             pdf_id: ID of the PDF document being discussed.
             
         Returns:
-            JSON response with chatbot's reply and confidence score.
+            JSON response with chatbot's reply, confidence score and the
+            page coverage of the answer.
         """
         try:
             data = request.get_json()
@@ -153,16 +322,18 @@ def create_app(config_class=None):
             # TODO: Replace with actual user ID from authentication
             user_id = 1
             
-            response, confidence = chatbot_service.process_message(
+            response, confidence, coverage = chatbot_service.process_message(
                 user_id=user_id,
                 pdf_id=pdf_id,
-                message=data['message']
+                message=data['message'],
+                with_coverage=True
             )
             
             return jsonify({
                 'status': 'success',
                 'response': response,
-                'confidence': confidence
+                'confidence': confidence,
+                'coverage': serialize_coverage(coverage)
             })
             
         except Exception as e:
@@ -172,84 +343,345 @@ def create_app(config_class=None):
                 'message': 'Internal server error'
             }), 500
     
-    @app.route('/api/chat/<pdf_id>/history', methods=['GET'])
-    def chat_history(pdf_id):
-        """Retrieve chat history for a specific PDF.
+    @app.route('/api/chat/<pdf_id>/batch', methods=['POST'])
+    def chat_message_batch(pdf_id):
+        """Answer several chat messages about a PDF in one request.
+        
+        Expects a JSON body of the form {"messages": ["...", ...]}.
         
         Args:
-            pdf_id: ID of the PDF document.
+            pdf_id: ID of the PDF document being discussed.
             
         Returns:
-            JSON response with chat history.
+            JSON response with one result per message, in request order.
         """
+        data = request.get_json(silent=True)
+        messages = data.get('messages') if isinstance(data, dict) else None
+        if (not isinstance(messages, list) or not messages
+                or not all(isinstance(message, str) and message for message in messages)):
+            return jsonify({
+                'status': 'error',
+                'message': 'messages must be a non-empty list of strings'
+            }), 400
+        
+        max_messages = app.config['CHAT_BATCH_MAX_MESSAGES']
+        if len(messages) > max_messages:
+            return jsonify({
+                'status': 'error',
+                'message': f'At most {max_messages} messages per batch'
+            }), 400
+        
         try:
             # TODO: Replace with actual user ID from authentication
             user_id = 1
             
-            history = chatbot_service.get_chat_history(user_id, pdf_id)
+            answers, coverage = chatbot_service.process_messages(
+                user_id, pdf_id, messages, with_coverage=True
+            )
             return jsonify({
                 'status': 'success',
-                'history': history
+                'results': [
+                    {'message': message, 'response': response, 'confidence': confidence}
+                    for message, (response, confidence) in zip(messages, answers)
+                ],
+                'coverage': serialize_coverage(coverage)
             })
             
+        except Exception as e:
+            app.logger.error(f"Error processing chat batch: {str(e)}")
+            return jsonify({
+                'status': 'error',
+                'message': 'Internal server error'
+            }), 500
+    
+    @app.route('/api/chat/<pdf_id>/stream', methods=['GET', 'POST'])
+    def chat_message_stream(pdf_id):
+        """Stream the reply to a chat message as Server-Sent Events.
+        
+        The message is read from a JSON body ({"message": ...}) or, for
+        EventSource clients, from the ``message`` query parameter. Each piece
+        of the reply is sent as a ``chunk`` event, followed by a ``done``
+        event carrying the full response, its confidence score and its page
+        coverage.
+        
+        Args:
+            pdf_id: ID of the PDF document being discussed.
+            
+        Returns:
+            A text/event-stream response.
+        """
+        data = request.get_json(silent=True) or {}
+        message = data.get('message') or request.args.get('message')
+        if not message:
+            return jsonify({
+                'status': 'error',
+                'message': 'No message provided'
+            }), 400
+        
+        # TODO: Replace with actual user ID from authentication
+        user_id = 1
+        
+        def events():
+            parts = []
+            confidence, coverage = 0.0, None
+            try:
+                for chunk in chatbot_service.stream_message(user_id, pdf_id, message):
+                    parts.append(chunk.text)
+                    confidence, coverage = chunk.confidence, chunk.coverage
+                    yield sse_event('chunk', {'text': chunk.text})
+                yield sse_event('done', {
+                    'status': 'success',
+                    'response': ''.join(parts),
+                    'confidence': confidence,
+                    'coverage': serialize_coverage(coverage)
+                })
+            except Exception as e:
+                app.logger.error(f"Error streaming chat message: {str(e)}")
+                yield sse_event('error', {
+                    'status': 'error',
+                    'message': 'Internal server error'
+                })
+        
+        response = app.response_class(
+            stream_with_context(events()), mimetype='text/event-stream'
+        )
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no'  # Disable proxy buffering
+        return response
+    
+    @app.route('/api/chat/cache', methods=['GET'])
+    def answer_cache_stats():
+        """Report answer cache hit, miss and eviction counters.
+        
+        Returns:
+            JSON response with the cache statistics, or null if disabled.
+        """
+        return jsonify({
+            'status': 'success',
+            'cache': answer_cache.stats() if answer_cache is not None else None
+        })
+    
+    @app.route('/api/chat/writer', methods=['GET'])
+    def message_writer_stats():
+        """Report write-behind buffer depth and flush latency.
+        
+        Returns:
+            JSON response with the writer statistics, or null if disabled.
+        """
+        return jsonify({
+            'status': 'success',
+            'writer': message_writer.stats() if message_writer is not None else None
+        })
+    
+    @app.route('/api/chat/workers', methods=['GET'])
+    def chat_worker_stats():
+        """Report the Socket.IO chat worker queue depth and task counters.
+        
+        Returns:
+            JSON response with the worker pool statistics.
+        """
+        return jsonify({
+            'status': 'success',
+            'workers': chat_workers.stats()
+        })
+    
+    def pool_stat(name):
+        """Read a connection pool counter; pools without one report nothing."""
+        read = getattr(db.engine.pool, name, None)
+        return read() if callable(read) else None
+    
+    gauges = [
+        metrics.Gauge('sqlalchemy_pool_size', 'Configured size of the database connection pool.',
+                      lambda: pool_stat('size')),
+        metrics.Gauge('sqlalchemy_pool_checked_out', 'Database connections currently checked out.',
+                      lambda: pool_stat('checkedout')),
+        metrics.Gauge('sqlalchemy_pool_overflow', 'Database connections open beyond the pool size.',
+                      lambda: pool_stat('overflow')),
+        metrics.Gauge('extraction_queue_depth', 'Extraction jobs waiting to start.',
+                      job_dispatcher.queue_depth),
+        metrics.Gauge('chat_worker_queue_depth', 'Socket.IO chat messages waiting for a worker.',
+                      chat_workers.queue_depth)
+    ]
+    if message_writer is not None:
+        gauges.append(metrics.Gauge(
+            'chat_message_writer_pending', 'Chat messages buffered for write-behind.',
+            lambda: message_writer.stats()['pending']
+        ))
+    
+    @app.route('/metrics', methods=['GET'])
+    def prometheus_metrics():
+        """Expose latency histograms and resource gauges for Prometheus.
+        
+        Returns:
+            Metrics in the Prometheus text exposition format.
+        """
+        return app.response_class(metrics.render(gauges), content_type=metrics.CONTENT_TYPE)
+    
+    @app.route('/api/chat/<pdf_id>/history', methods=['GET'])
+    def chat_history(pdf_id):
+        """Retrieve a page of chat history for a specific PDF.
+        
+        Query parameters:
+            limit: Maximum number of messages (default HISTORY_PAGE_SIZE).
+            before: Cursor to page backwards through older messages.
+            since: Cursor to fetch only messages newer than it.
+        
+        Responses carry an ETag; a matching If-None-Match yields 304.
+        
+        Args:
+            pdf_id: ID of the PDF document.
+            
+        Returns:
+            JSON response with chat history and the cursors of the page.
+        """
+        limit = request.args.get('limit', app.config['HISTORY_PAGE_SIZE'], type=int)
+        if limit < 1:
+            return jsonify({
+                'status': 'error',
+                'message': 'limit must be a positive integer'
+            }), 400
+        limit = min(limit, app.config['HISTORY_MAX_PAGE_SIZE'])
+        
+        try:
+            # TODO: Replace with actual user ID from authentication
+            user_id = 1
+            
+            page = chatbot_service.get_history_page(
+                user_id, pdf_id, limit,
+                before=request.args.get('before'),
+                since=request.args.get('since')
+            )
+        except ValueError as e:
+            return jsonify({
+                'status': 'error',
+                'message': str(e)
+            }), 400
         except Exception as e:
             app.logger.error(f"Error retrieving chat history: {str(e)}")
             return jsonify({
                 'status': 'error',
                 'message': 'Internal server error'
             }), 500
+        
+        # Messages are never edited, so a page is identified by its bounds
+        etag = hashlib.sha1(
+            f"{pdf_id}|{limit}|{request.query_string.decode()}|{page['before']}|"
+            f"{page['since']}|{len(page['messages'])}|{page['has_more']}".encode('utf-8')
+        ).hexdigest()
+        if request.if_none_match.contains(etag):
+            response = app.response_class(status=304)
+        else:
+            response = jsonify({
+                'status': 'success',
+                'history': page['messages'],
+                'has_more': page['has_more'],
+                'cursors': {'before': page['before'], 'since': page['since']}
+            })
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
 
     return app
 
-# Create the application instance with default configuration
-app = create_app()
+def sse_event(event, data):
+    """Format one Server-Sent Event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def serialize_coverage(coverage):
+    """Serialize the PageCoverage returned with an answer.
+    
+    Answers about documents that are still being extracted only cover the
+    pages extracted so far.
+    """
+    return coverage._asdict() if coverage else None
 
 @socketio.on('connect')
 def handle_connect():
     """Handle WebSocket connection."""
-    app.logger.info('Client connected')
+    current_app.logger.info('Client connected')
     emit('connection_status', {'status': 'connected'})
 
 @socketio.on('disconnect')
 def handle_disconnect():
     """Handle WebSocket disconnection."""
-    app.logger.info('Client disconnected')
+    current_app.logger.info('Client disconnected')
 
 @socketio.on('chat_message')
 def handle_chat_message(data):
     """Handle incoming chat messages via WebSocket.
     
+    The answer is computed on the chat worker pool, so the handler returns
+    without waiting for retrieval or the database.
+    
     Args:
         data: Dictionary containing message data (pdf_id, message)
     """
-    try:
-        pdf_id = data.get('pdf_id')
-        message = data.get('message')
-        user_id = 1  # TODO: Replace with actual user ID from authentication
+    pdf_id = data.get('pdf_id')
+    message = data.get('message')
+    user_id = 1  # TODO: Replace with actual user ID from authentication
 
-        if not pdf_id or not message:
-            emit('error', {'message': 'Invalid message data'})
-            return
+    if not pdf_id or not message:
+        emit('error', {'message': 'Invalid message data'})
+        return
 
-        chatbot_service = ChatbotService()
-        response, confidence = chatbot_service.process_message(
+    try:
+        current_app.extensions['chat_workers'].submit(
+            answer_chat_message,
+            current_app.extensions['chatbot_service'],
+            request.sid,
+            user_id,
+            pdf_id,
+            message
+        )
+    except ChatQueueFull as e:
+        current_app.logger.warning(str(e))
+        emit('error', {'message': 'Chat server is busy, please retry'})
+
+def answer_chat_message(chatbot_service, sid, user_id, pdf_id, message):
+    """Answer a WebSocket chat message and stream the reply to its PDF room.
+    
+    Runs on a chat worker inside an application context.
+    
+    Args:
+        chatbot_service: Shared ChatbotService instance.
+        sid: Session ID of the client that sent the message.
+        user_id: ID of the user asking.
+        pdf_id: ID of the PDF document being discussed.
+        message: The question text.
+    """
+    room = str(pdf_id)
+    try:
+        # Stream the reply to all clients viewing the same PDF
+        parts = []
+        confidence, coverage = 0.0, None
+        for index, chunk in enumerate(chatbot_service.stream_message(
             user_id=user_id,
             pdf_id=pdf_id,
             message=message
-        )
+        )):
+            parts.append(chunk.text)
+            confidence, coverage = chunk.confidence, chunk.coverage
+            socketio.emit('chat_response_chunk', {
+                'pdf_id': pdf_id,
+                'message': message,
+                'index': index,
+                'chunk': chunk.text
+            }, to=room)
+            socketio.sleep(0)  # Let cooperative async modes send the chunk now
 
-        # Emit the response to all clients viewing the same PDF
-        emit('chat_response', {
+        # Emit the complete response once the exchange is stored
+        socketio.emit('chat_response', {
             'pdf_id': pdf_id,
             'message': message,
-            'response': response,
+            'response': ''.join(parts),
             'confidence': confidence,
+            'coverage': serialize_coverage(coverage),
             'timestamp': datetime.now().isoformat()
-        }, room=str(pdf_id))
+        }, to=room)
 
     except Exception as e:
-        app.logger.error(f"Error processing WebSocket message: {str(e)}")
-        emit('error', {'message': 'Internal server error'})
+        current_app.logger.error(f"Error processing WebSocket message: {str(e)}")
+        socketio.emit('error', {'message': 'Internal server error'}, to=sid)
 
 @socketio.on('join')
 def handle_join(data):
@@ -264,4 +696,6 @@ def handle_join(data):
         emit('room_joined', {'pdf_id': pdf_id})
 
 if __name__ == '__main__':
-    socketio.run(app, debug=True)
+    # Applications are only built through the factory, e.g.
+    # `flask --app app run` or `gunicorn "app:create_app()"`
+    socketio.run(create_app(), debug=True)
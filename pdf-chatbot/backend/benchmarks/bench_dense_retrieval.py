@@ -0,0 +1,69 @@
+"""
+Benchmark dense passage search at 10k and 100k passages.
+
+Builds a DenseIndex over synthetic passages drawn from a fixed vocabulary and
+times query embedding plus the matrix-vector product. Run from the backend
+directory:
+
+    python benchmarks/bench_dense_retrieval.py --passages 10000 100000
+"""
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from retrieval import DenseIndex  # noqa: E402
+
+
+def synthetic_passages(count, words_per_passage=120, vocabulary=20000, seed=0):
+    """Generate passages with a Zipf-like word distribution."""
+    rng = np.random.default_rng(seed)
+    words = np.array([f"term{i}" for i in range(vocabulary)])
+    ranks = np.minimum(rng.zipf(1.2, size=(count, words_per_passage)), vocabulary) - 1
+    return [" ".join(words[row]) for row in ranks]
+
+
+def percentile_ms(samples, q):
+    return float(np.percentile(samples, q) * 1000)
+
+
+def run(count, dim, queries):
+    passages = synthetic_passages(count)
+
+    started = time.perf_counter()
+    index = DenseIndex.build(passages, dim=dim)
+    build_seconds = time.perf_counter() - started
+
+    rng = np.random.default_rng(1)
+    timings = []
+    for passage_id in rng.integers(0, count, size=queries):
+        query = " ".join(passages[passage_id].split()[:8])
+        started = time.perf_counter()
+        index.search(query, k=3)
+        timings.append(time.perf_counter() - started)
+
+    print(
+        f"{count:>7} passages  dim={dim}  build={build_seconds:.2f}s  "
+        f"matrix={index.matrix.nbytes / 2**20:.1f}MiB  "
+        f"search p50={percentile_ms(timings, 50):.2f}ms "
+        f"p95={percentile_ms(timings, 95):.2f}ms "
+        f"p99={percentile_ms(timings, 99):.2f}ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--passages', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--dim', type=int, default=256)
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+
+    for count in args.passages:
+        run(count, args.dim, args.queries)
+
+
+if __name__ == '__main__':
+    main()
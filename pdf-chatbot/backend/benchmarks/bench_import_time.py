@@ -0,0 +1,96 @@
+"""
+Measure cold-start cost of the backend against a time budget.
+
+Each run starts a fresh interpreter with ``-X importtime`` that imports
+``app`` and calls ``create_app()``, the work every web process, Celery
+worker and serverless-style container does before serving anything. The
+median wall time over the runs, minus the interpreter's own start-up, is
+compared with --budget-ms, and modules that should only be imported on
+first use (--deferred) must not show up at all. The slowest imports are
+listed to show where the time goes. Run from the backend directory:
+
+    python benchmarks/bench_import_time.py --budget-ms 1000
+
+Exits non-zero if the budget is exceeded or a deferred module is imported.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List, Tuple
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STARTUP = "import app; app.create_app()"
+DEFERRED = ('PyPDF2', 'magic', 'celery')
+
+
+def run_python(code: str, importtime: bool = False) -> Tuple[float, str]:
+    """Run code in a fresh interpreter and return (wall seconds, stderr)."""
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + ['-c', code]
+    env = dict(os.environ, DATABASE_URL=os.getenv('DATABASE_URL', 'sqlite://'))
+    env.pop('CELERY_BROKER_URL', None)
+    started = time.perf_counter()
+    completed = subprocess.run(
+        command, cwd=BACKEND, env=env, capture_output=True, text=True, check=True
+    )
+    return time.perf_counter() - started, completed.stderr
+
+
+def parse_importtime(stderr: str) -> List[Dict]:
+    """Parse ``-X importtime`` output into one entry per imported module."""
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules.append({
+            'name': name.strip(),
+            'depth': (len(name) - len(name.lstrip())) // 2,
+            'self_ms': int(self_us) / 1000,
+            'cumulative_ms': int(cumulative_us) / 1000
+        })
+    return modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float, default=1000,
+                        help='Maximum median start-up time beyond interpreter start-up.')
+    parser.add_argument('--deferred', nargs='*', default=list(DEFERRED),
+                        help='Top-level packages that must not be imported on start-up.')
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args()
+
+    interpreter = statistics.median(run_python("pass")[0] for _ in range(args.runs))
+    samples, modules = [], []
+    for _ in range(args.runs):
+        seconds, stderr = run_python(STARTUP, importtime=True)
+        samples.append(seconds)
+        modules = parse_importtime(stderr)
+    startup_ms = (statistics.median(samples) - interpreter) * 1000
+
+    by_package = {}
+    for module in modules:
+        package = module['name'].split('.')[0]
+        if module['depth'] <= 1 or package not in by_package:
+            by_package[package] = max(by_package.get(package, 0), module['cumulative_ms'])
+    print(f"Slowest imports (cumulative, last run):")
+    for package, cumulative in sorted(by_package.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {cumulative:8.1f}ms  {package}")
+
+    imported = sorted({m['name'].split('.')[0] for m in modules} & set(args.deferred))
+    print(f"\nStart-up: {startup_ms:.0f}ms median over {args.runs} runs "
+          f"(interpreter {interpreter * 1000:.0f}ms excluded), budget {args.budget_ms:.0f}ms")
+    ok = startup_ms <= args.budget_ms
+    if imported:
+        print(f"Imported on start-up although deferred: {', '.join(imported)}")
+        ok = False
+    print("OK" if ok else "FAIL")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
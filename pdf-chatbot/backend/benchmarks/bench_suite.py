@@ -0,0 +1,302 @@
+"""
+Benchmark the upload, extraction, retrieval, chat and history hot paths.
+
+Generates a synthetic PDF corpus (see synthetic_pdfs.py) and times, per
+document: upload validation and save, extract_text, BM25 and dense
+retrieval, and ChatbotService.process_message. Chat history reads are timed
+against a seeded chat_messages table. Every case reports throughput,
+p50/p95/p99 latency and the peak RSS of the process so far, and the whole
+run is written as JSON so that results can be compared between commits.
+Run from the backend directory:
+
+    python benchmarks/bench_suite.py --pages 10 100 1000 5000 --output after.json
+    python benchmarks/bench_suite.py --output after.json --compare before.json
+
+Uses a temporary SQLite database unless DATABASE_URL is set. With
+--compare, exits non-zero if any p50 or p95 latency regressed by more than
+--threshold.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+from werkzeug.datastructures import FileStorage  # noqa: E402
+
+from synthetic_pdfs import KINDS, generate_corpus  # noqa: E402
+
+
+def peak_rss_mib() -> float:
+    """High-water mark of resident memory of this process and its children."""
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    scale = 2**20 if sys.platform == 'darwin' else 2**10
+    return max(usage, children) / scale
+
+
+def measure(name: str, params: Dict, operation: Callable[[int], None], repeat: int,
+            units_per_op: float = 1, unit: str = 'ops') -> Dict:
+    """Time ``operation(i)`` for i in range(repeat) and summarize the samples.
+
+    Args:
+        name: Case name, e.g. 'extract_text'.
+        params: Parameters identifying the case (document kind, pages...).
+        operation: Callable receiving the iteration number.
+        repeat: Number of timed iterations.
+        units_per_op: Work units per iteration, e.g. pages or MiB.
+        unit: Name of the work unit for the throughput figure.
+
+    Returns:
+        The case result: latency percentiles in milliseconds, throughput in
+        units per second and the peak RSS in MiB.
+    """
+    timings = []
+    for iteration in range(repeat):
+        started = time.perf_counter()
+        operation(iteration)
+        timings.append(time.perf_counter() - started)
+
+    samples = np.array(timings)
+    total = float(samples.sum())
+    return {
+        'name': name,
+        'params': params,
+        'samples': len(timings),
+        'unit': unit,
+        'throughput': units_per_op * len(timings) / total if total else None,
+        'mean_ms': float(samples.mean() * 1000),
+        'p50_ms': float(np.percentile(samples, 50) * 1000),
+        'p95_ms': float(np.percentile(samples, 95) * 1000),
+        'p99_ms': float(np.percentile(samples, 99) * 1000),
+        'peak_rss_mib': peak_rss_mib()
+    }
+
+
+def report(result: Dict) -> None:
+    params = ' '.join(f"{key}={value}" for key, value in result['params'].items())
+    print(
+        f"{result['name']:<18} {params:<32} n={result['samples']:<5} "
+        f"{result['throughput'] or 0:>10.1f} {result['unit']}/s  "
+        f"p50={result['p50_ms']:.2f}ms p95={result['p95_ms']:.2f}ms "
+        f"p99={result['p99_ms']:.2f}ms  rss={result['peak_rss_mib']:.0f}MiB"
+    )
+
+
+def create_benchmark_app(upload_folder: str, database_url: str):
+    """Create an app that runs extraction inline and answers without a cache."""
+    from app import create_app
+    from config import Config
+
+    class BenchmarkConfig(Config):
+        SQLALCHEMY_DATABASE_URI = database_url
+        UPLOAD_FOLDER = upload_folder
+        CELERY_BROKER_URL = None
+        EXTRACTION_LOCAL_WORKERS = 0
+        ANSWER_CACHE_SIZE = 0
+        ANSWER_CACHE_URL = None
+        MESSAGE_WRITE_BEHIND = False
+        CHAT_SOCKET_WORKERS = 0
+
+    from migrations import upgrade
+    from models import db
+
+    app = create_app(BenchmarkConfig)
+    with app.app_context():
+        upgrade(db.engine)
+    return app
+
+
+def bench_document(app, document, args) -> List[Dict]:
+    """Run the per-document cases."""
+    from pdf_handler import PDFHandler
+    from retrieval import DocumentIndex, index_path
+
+    params = {'kind': document.kind, 'pages': document.pages}
+    size_mib = document.size / 2**20
+    with open(document.path, 'rb') as f:
+        data = f.read()
+
+    handler = PDFHandler(os.path.join(app.config['UPLOAD_FOLDER'], 'bench'))
+    # Measure throughput, not the production size limit
+    handler.MAX_FILE_SIZE = max(handler.MAX_FILE_SIZE, len(data))
+    service = app.extensions['chatbot_service']
+    results = []
+
+    def validate(_):
+        valid, error = handler.validate_file(
+            FileStorage(stream=io.BytesIO(data), filename='bench.pdf')
+        )
+        assert valid, error
+
+    stored = []
+
+    def save(iteration):
+        # A distinct trailing comment gives every upload its own content hash
+        staged, error = handler.stage_stream(io.BytesIO(data + b"%% %d\n" % iteration))
+        assert not error, error
+        pdf_doc, error = handler.save_staged(staged, 'bench.pdf')
+        assert not error, error
+        stored.append(pdf_doc.id)
+
+    results.append(measure('upload_validate', params, validate, args.repeat, size_mib, 'MiB'))
+    results.append(measure('upload_save', params, save, args.repeat, size_mib, 'MiB'))
+
+    pdf_id = stored[0]
+
+    def extract(_):
+        result = handler.extract_text(pdf_id)
+        assert result['status'] == 'success', result
+
+    results.append(measure(
+        'extract_text', params, extract, args.extract_repeat, document.pages, 'pages'
+    ))
+
+    from models import PDFDocument, db
+    pdf_doc = db.session.get(PDFDocument, pdf_id)
+    index = DocumentIndex.load(index_path(pdf_doc.file_path), pdf_doc.content_hash)
+    queries = [document.sample_queries[i % len(document.sample_queries)]
+               for i in range(args.queries)]
+    for mode in ('bm25', 'dense'):
+        results.append(measure(
+            'retrieval', dict(params, mode=mode),
+            lambda i, mode=mode: index.search(queries[i], k=3, mode=mode), args.queries
+        ))
+
+    results.append(measure(
+        'process_message', params,
+        lambda i: service.process_message(1, str(pdf_id), queries[i]), args.queries
+    ))
+    return results
+
+
+def bench_history(app, args) -> List[Dict]:
+    """Time history reads against a seeded chat_messages table."""
+    from explain_chat_messages import seed_chat_messages
+    from models import db
+
+    sample = seed_chat_messages(
+        db.session, args.history_messages, args.history_documents, users=10
+    )
+    service = app.extensions['chatbot_service']
+    pdf_id, user_id = str(sample['pdf_id']), sample['user_id']
+    conversation = len(service.get_chat_history(user_id, pdf_id))
+    params = {'messages': args.history_messages, 'conversation': conversation}
+
+    latest = service.get_history_page(user_id, pdf_id, 50)
+    return [
+        measure('history_full', params,
+                lambda _: service.get_chat_history(user_id, pdf_id),
+                args.repeat, conversation, 'messages'),
+        measure('history_page', dict(params, limit=50),
+                lambda _: service.get_history_page(user_id, pdf_id, 50,
+                                                   before=latest['before']),
+                args.queries, 50, 'messages')
+    ]
+
+
+def compare(results: List[Dict], baseline_path: str, threshold: float) -> bool:
+    """Print latency changes against a previous run.
+
+    Returns:
+        True if no p50 or p95 latency grew by more than ``threshold``.
+    """
+    with open(baseline_path) as f:
+        baseline = {
+            (case['name'], json.dumps(case['params'], sort_keys=True)): case
+            for case in json.load(f)['results']
+        }
+
+    ok = True
+    print(f"\nCompared with {baseline_path}:")
+    for case in results:
+        before = baseline.get((case['name'], json.dumps(case['params'], sort_keys=True)))
+        if before is None:
+            continue
+        changes = []
+        for field in ('p50_ms', 'p95_ms'):
+            ratio = case[field] / before[field] if before[field] else 1.0
+            regressed = ratio > 1 + threshold
+            ok = ok and not regressed
+            changes.append(f"{field[:3]} {ratio:.2f}x{' REGRESSED' if regressed else ''}")
+        params = ' '.join(f"{key}={value}" for key, value in case['params'].items())
+        print(f"{case['name']:<18} {params:<32} {'  '.join(changes)}")
+    return ok
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--pages', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--kinds', nargs='+', choices=KINDS, default=list(KINDS))
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Iterations of upload and full-history cases.')
+    parser.add_argument('--extract-repeat', type=int, default=2)
+    parser.add_argument('--queries', type=int, default=200,
+                        help='Iterations of retrieval, chat and history page cases.')
+    parser.add_argument('--history-messages', type=int, default=100000)
+    parser.add_argument('--history-documents', type=int, default=10)
+    parser.add_argument('--output', help='Write the results to this JSON file.')
+    parser.add_argument('--compare', help='Results JSON of a previous run.')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Latency growth that counts as a regression.')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='pdf-chatbot-bench-')
+    try:
+        database_url = os.getenv('DATABASE_URL') or f"sqlite:///{workdir}/bench.db"
+        corpus = generate_corpus(os.path.join(workdir, 'corpus'), args.pages, args.kinds)
+        app = create_benchmark_app(os.path.join(workdir, 'uploads'), database_url)
+
+        results = []
+        with app.app_context():
+            for document in corpus:
+                for result in bench_document(app, document, args):
+                    report(result)
+                    results.append(result)
+            for result in bench_history(app, args):
+                report(result)
+                results.append(result)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    run = {
+        'revision': git_revision(),
+        'created_at': datetime.utcnow().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'args': vars(args),
+        'results': results
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(run, f, indent=2)
+    if args.compare and not compare(results, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+"""
+Capture query plans of the chat_messages hot paths against a seeded table.
+
+Seeds the configured database (DATABASE_URL) with documents and chat
+messages, runs the history queries exactly as ChatbotService issues them
+plus the conversation and thread lookups, and prints the EXPLAIN output of
+each. Exits non-zero if any plan scans the whole table or sorts history
+instead of reading it in index order. Run from the backend directory:
+
+    DATABASE_URL=postgresql://... python benchmarks/explain_chat_messages.py --messages 1000000
+
+The database is migrated first; seeded rows are left in place so that
+plans can be inspected further.
+"""
+import argparse
+import os
+import sys
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event, insert, select, text  # noqa: E402
+
+BASE_TIME = datetime(2024, 1, 1)
+BATCH_SIZE = 10000
+
+
+def _seed_id() -> uuid.UUID:
+    # SQLite gives columns declared as UUID numeric affinity, so a hex string
+    # made of digits and a single 'e' would be stored as a REAL; skip those
+    while True:
+        value = uuid.uuid4()
+        if not value.hex.replace('e', '', 1).isdigit():
+            return value
+
+
+def seed_chat_messages(session, messages: int, documents: int = 1000,
+                       users: int = 10) -> Dict:
+    """Insert documents and alternating user/assistant messages.
+
+    Messages are spread round-robin over documents and users, one second
+    apart, and every assistant message replies to the user message before it.
+
+    Returns:
+        IDs of a sample document, user, conversation and parent message.
+    """
+    from chatbot import ChatbotService
+    from models import ChatMessage, PDFDocument
+
+    document_ids = [_seed_id() for _ in range(documents)]
+    session.execute(insert(PDFDocument.__table__), [{
+        'id': document_id,
+        'filename': f"seed-{index}.pdf",
+        'file_path': f"/seed/{index}.pdf",
+        'file_size': 0,
+        'processing_status': 'completed'
+    } for index, document_id in enumerate(document_ids)])
+
+    conversations = {}
+    parents = {}
+    rows = []
+    for number in range(messages):
+        # Consecutive pairs share a document and user: a question and its answer
+        pair = number // 2
+        document_id = document_ids[pair % documents]
+        user_id = (pair // documents) % users
+        key = (user_id, document_id)
+        if key not in conversations:
+            conversations[key] = ChatbotService._conversation_id(user_id, document_id)
+
+        message_id = _seed_id()
+        is_user = number % 2 == 0
+        rows.append({
+            'id': message_id,
+            'pdf_document_id': document_id,
+            'message_type': 'user' if is_user else 'assistant',
+            'content': f"Seeded message {number}",
+            'timestamp': BASE_TIME + timedelta(seconds=number),
+            'conversation_id': conversations[key],
+            'parent_message_id': None if is_user else parents.get(key)
+        })
+        parents[key] = message_id
+        if len(rows) >= BATCH_SIZE:
+            session.execute(insert(ChatMessage.__table__), rows)
+            rows = []
+    if rows:
+        session.execute(insert(ChatMessage.__table__), rows)
+    session.commit()
+    session.execute(text("ANALYZE"))
+    session.commit()
+
+    return {
+        'pdf_id': document_ids[0],
+        'user_id': 0,
+        'conversation_id': conversations[(0, document_ids[0])],
+        'parent_id': parents[(0, document_ids[0])]
+    }
+
+
+@contextmanager
+def capture_queries(engine):
+    """Collect the (statement, parameters) of chat_messages SELECTs."""
+    captured = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT') and 'chat_messages' in statement:
+            captured.append((statement, parameters))
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield captured
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def run_hot_paths(service, sample: Dict, page_size: int = 50) -> None:
+    """Issue the queries whose plans are checked."""
+    from models import ChatMessage, db
+
+    pdf_id, user_id = str(sample['pdf_id']), sample['user_id']
+    latest = service.get_history_page(user_id, pdf_id, page_size)
+    service.get_history_page(user_id, pdf_id, page_size, before=latest['before'])
+    service.get_history_page(user_id, pdf_id, page_size, since=latest['before'])
+
+    # Conversation timeline and thread replies
+    db.session.execute(
+        select(ChatMessage).where(ChatMessage.conversation_id == sample['conversation_id'])
+        .order_by(ChatMessage.timestamp.desc()).limit(page_size)
+    ).all()
+    db.session.execute(
+        select(ChatMessage).where(ChatMessage.parent_message_id == sample['parent_id'])
+    ).all()
+
+
+def explain(connection, statement: str, parameters) -> List[str]:
+    """Return the plan of a captured statement as text lines."""
+    if connection.dialect.name == 'postgresql':
+        prefix = "EXPLAIN (ANALYZE, BUFFERS) "
+    else:
+        prefix = "EXPLAIN QUERY PLAN "
+    rows = connection.exec_driver_sql(prefix + statement, parameters).all()
+    # SQLite returns (id, parent, notused, detail) rows, PostgreSQL one text column
+    return [str(row[-1]) for row in rows]
+
+
+def plan_problems(plan: List[str], ordered: bool) -> List[str]:
+    """List the ways a plan falls short of an index range scan."""
+    problems = []
+    for line in plan:
+        if 'Seq Scan on chat_messages' in line:
+            problems.append("sequential scan")
+        if line.startswith('SCAN chat_messages') and 'INDEX' not in line:
+            problems.append("full table scan")
+        if ordered and ('USE TEMP B-TREE FOR ORDER BY' in line or line.lstrip().startswith('Sort ')):
+            problems.append("explicit sort")
+    return problems
+
+
+def check_plans(app, sample: Dict, report=print) -> bool:
+    """Explain every hot-path query and report whether all use an index.
+
+    Args:
+        app: Flask application bound to the seeded database.
+        sample: Sample IDs returned by seed_chat_messages().
+        report: Callable receiving each output line.
+
+    Returns:
+        True if every plan is an index range or index-only scan.
+    """
+    from chatbot import ChatbotService
+    from models import db
+
+    with app.app_context():
+        service = ChatbotService()
+        with capture_queries(db.engine) as captured:
+            run_hot_paths(service, sample)
+
+        ok = True
+        with db.engine.connect() as connection:
+            for statement, parameters in captured:
+                plan = explain(connection, statement, parameters)
+                problems = plan_problems(plan, ordered='ORDER BY' in statement.upper())
+                ok = ok and not problems
+                report(' '.join(statement.split()))
+                for line in plan:
+                    report(f"    {line}")
+                report(f"  -> {'FAIL: ' + ', '.join(problems) if problems else 'ok'}\n")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--messages', type=int, default=1000000)
+    parser.add_argument('--documents', type=int, default=1000)
+    args = parser.parse_args()
+
+    from app import create_app
+    from migrations import upgrade
+    from models import db
+
+    app = create_app()
+    with app.app_context():
+        upgrade(db.engine)
+        sample = seed_chat_messages(db.session, args.messages, args.documents)
+    sys.exit(0 if check_plans(app, sample) else 1)
+
+
+if __name__ == '__main__':
+    main()
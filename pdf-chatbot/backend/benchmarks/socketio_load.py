@@ -0,0 +1,300 @@
+"""
+Socket.IO load test for concurrent chat rooms.
+
+Starts the backend in a child process for each async mode, uploads one
+synthetic PDF per room, connects N clients spread over M rooms through the
+``join`` event and sends ``chat_message`` events at a fixed total rate.
+For every message it measures:
+
+- end-to-end latency: from the sender's ``chat_message`` to the sender
+  receiving the matching ``chat_response``
+- fan-out latency: from the same ``chat_message`` to each other member of
+  the room receiving that ``chat_response``
+
+The rate is stepped up until the p95 end-to-end latency exceeds --slo-ms or
+fewer than --min-delivery of the responses arrive; the last rate that held
+is reported as the saturation point of the mode. Run from the backend
+directory (the client side needs ``pip install "python-socketio[client]"``,
+the eventlet and gevent modes need those packages installed):
+
+    python benchmarks/socketio_load.py --clients 200 --rooms 20 \\
+        --rates 10 20 50 100 200 --modes threading eventlet gevent
+"""
+import argparse
+import importlib.util
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from collections import defaultdict
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+ASYNC_MODES = ('threading', 'eventlet', 'gevent')
+
+
+def serve(mode: str, port: int) -> None:
+    """Run the backend with the given async mode; used in the child process."""
+    if mode == 'eventlet':
+        import eventlet
+        eventlet.monkey_patch()
+    elif mode == 'gevent':
+        from gevent import monkey
+        monkey.patch_all()
+
+    from app import create_app, socketio
+    from migrations import upgrade
+    from models import db
+
+    app = create_app()
+    with app.app_context():
+        upgrade(db.engine)
+    socketio.run(app, host='127.0.0.1', port=port, allow_unsafe_werkzeug=True)
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(mode: str, workdir: str, args) -> subprocess.Popen:
+    """Start the backend in a child process and wait until it answers HTTP."""
+    port = _free_port()
+    env = dict(
+        os.environ,
+        DATABASE_URL=f"sqlite:///{workdir}/{mode}.db",
+        SOCKETIO_ASYNC_MODE=mode,
+        # Extract uploads inline so that rooms are ready once uploaded
+        EXTRACTION_LOCAL_WORKERS='0',
+        CHAT_SOCKET_WORKERS=str(args.workers),
+        CHAT_SOCKET_QUEUE_SIZE=str(args.queue_size)
+    )
+    log = open(os.path.join(workdir, f"{mode}.log"), 'w')
+    process = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), '--serve', mode, '--port', str(port)],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        env=env, stdout=log, stderr=subprocess.STDOUT
+    )
+    process.url = f"http://127.0.0.1:{port}"
+
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{mode} server exited; see {log.name}")
+        try:
+            urllib.request.urlopen(f"{process.url}/api/chat/workers", timeout=1)
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"{mode} server did not start; see {log.name}")
+
+
+def upload_rooms(url: str, rooms: int, workdir: str) -> List[str]:
+    """Upload one small synthetic PDF per room and return the document IDs."""
+    from synthetic_pdfs import generate_pdf
+
+    pdf_ids = []
+    for room in range(rooms):
+        document = generate_pdf(os.path.join(workdir, f"room-{room}.pdf"), 20, seed=room)
+        with open(document.path, 'rb') as f:
+            request = urllib.request.Request(
+                f"{url}/api/upload?filename=room-{room}.pdf", data=f.read(),
+                headers={'Content-Type': 'application/pdf'}, method='POST'
+            )
+        with urllib.request.urlopen(request, timeout=60) as response:
+            pdf_ids.append(json.load(response)['file']['id'])
+    return pdf_ids
+
+
+class LoadClient:
+    """One Socket.IO client that records when it receives each response."""
+
+    def __init__(self, number: int, pdf_id: str, received: Dict, lock):
+        import socketio
+
+        self.number = number
+        self.pdf_id = pdf_id
+        self.joined = threading.Event()
+        self.sio = socketio.Client(reconnection=False)
+        self.errors = 0
+
+        @self.sio.on('room_joined')
+        def on_joined(data):
+            self.joined.set()
+
+        @self.sio.on('chat_response')
+        def on_response(data):
+            now = time.perf_counter()
+            with lock:
+                received[data['message']].append((self.number, now))
+
+        @self.sio.on('error')
+        def on_error(data):
+            self.errors += 1
+
+    def connect(self, url: str) -> None:
+        self.sio.connect(url, transports=['websocket'])
+        self.sio.emit('join', {'pdf_id': self.pdf_id})
+        if not self.joined.wait(10):
+            raise RuntimeError(f"Client {self.number} could not join its room")
+
+    def send(self, message: str) -> None:
+        self.sio.emit('chat_message', {'pdf_id': self.pdf_id, 'message': message})
+
+
+def percentile_ms(samples: List[float], q: float):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))] * 1000
+
+
+def run_rate(clients: List[LoadClient], received: Dict, lock, rate: float,
+             duration: float, drain: float) -> Dict:
+    """Send messages at ``rate`` per second for ``duration`` seconds."""
+    with lock:
+        received.clear()
+    errors_before = sum(client.errors for client in clients)
+    sent = {}
+    interval = 1.0 / rate
+    count = int(rate * duration)
+    started = time.perf_counter()
+    for number in range(count):
+        # Fixed schedule: a slow emit does not lower the offered rate
+        delay = started + number * interval - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        client = clients[number % len(clients)]
+        message = f"word{number % 50} word{number % 7} #{rate}-{number}"
+        sent[message] = (client.number, time.perf_counter())
+        client.send(message)
+
+    deadline = time.perf_counter() + drain
+    while time.perf_counter() < deadline:
+        with lock:
+            if all(any(n == sender for n, _ in received.get(message, ()))
+                   for message, (sender, _) in sent.items()):
+                break
+        time.sleep(0.05)
+    elapsed = time.perf_counter() - started
+
+    members = defaultdict(int)
+    for client in clients:
+        members[client.pdf_id] += 1
+    end_to_end, fan_out, expected_fan_out = [], [], 0
+    with lock:
+        for message, (sender, sent_at) in sent.items():
+            expected_fan_out += members[clients[sender].pdf_id] - 1
+            for number, received_at in received.get(message, ()):
+                (end_to_end if number == sender else fan_out).append(received_at - sent_at)
+
+    return {
+        'rate': rate,
+        'sent': count,
+        'answered': len(end_to_end),
+        'delivery': len(end_to_end) / count if count else 1.0,
+        'fan_out_delivery': len(fan_out) / expected_fan_out if expected_fan_out else 1.0,
+        'throughput': len(end_to_end) / elapsed,
+        'errors': sum(client.errors for client in clients) - errors_before,
+        'e2e_p50_ms': percentile_ms(end_to_end, 50),
+        'e2e_p95_ms': percentile_ms(end_to_end, 95),
+        'e2e_p99_ms': percentile_ms(end_to_end, 99),
+        'fan_out_p50_ms': percentile_ms(fan_out, 50),
+        'fan_out_p95_ms': percentile_ms(fan_out, 95),
+        'fan_out_p99_ms': percentile_ms(fan_out, 99)
+    }
+
+
+def run_mode(mode: str, workdir: str, args) -> Dict:
+    """Sweep the message rates against one async mode."""
+    server = start_server(mode, workdir, args)
+    clients = []
+    try:
+        pdf_ids = upload_rooms(server.url, args.rooms, workdir)
+        received, lock = defaultdict(list), threading.Lock()
+        for number in range(args.clients):
+            client = LoadClient(number, pdf_ids[number % len(pdf_ids)], received, lock)
+            client.connect(server.url)
+            clients.append(client)
+
+        steps, saturation = [], None
+        for rate in args.rates:
+            step = run_rate(clients, received, lock, rate, args.duration, args.drain)
+            steps.append(step)
+            print(
+                f"{mode:<10} rate={rate:>6}/s  answered={step['delivery']:.0%}  "
+                f"throughput={step['throughput']:.1f}/s  "
+                f"e2e p50={step['e2e_p50_ms'] or 0:.0f}ms p95={step['e2e_p95_ms'] or 0:.0f}ms  "
+                f"fan-out p95={step['fan_out_p95_ms'] or 0:.0f}ms  errors={step['errors']}"
+            )
+            held = (
+                step['delivery'] >= args.min_delivery
+                and step['e2e_p95_ms'] is not None
+                and step['e2e_p95_ms'] <= args.slo_ms
+            )
+            if not held:
+                break
+            saturation = rate
+        return {'mode': mode, 'saturation_rate': saturation, 'steps': steps}
+    finally:
+        for client in clients:
+            client.sio.disconnect()
+        server.terminate()
+        server.wait(10)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--clients', type=int, default=100)
+    parser.add_argument('--rooms', type=int, default=10)
+    parser.add_argument('--rates', type=float, nargs='+', default=[5, 10, 20, 50, 100, 200],
+                        help='Total chat messages per second, tried in order.')
+    parser.add_argument('--duration', type=float, default=10, help='Seconds per rate.')
+    parser.add_argument('--drain', type=float, default=10,
+                        help='Seconds to wait for outstanding responses.')
+    parser.add_argument('--slo-ms', type=float, default=1000,
+                        help='Highest acceptable p95 end-to-end latency.')
+    parser.add_argument('--min-delivery', type=float, default=0.99)
+    parser.add_argument('--modes', nargs='+', choices=ASYNC_MODES, default=list(ASYNC_MODES))
+    parser.add_argument('--workers', type=int, default=4, help='CHAT_SOCKET_WORKERS')
+    parser.add_argument('--queue-size', type=int, default=100, help='CHAT_SOCKET_QUEUE_SIZE')
+    parser.add_argument('--output', help='Write the results to this JSON file.')
+    parser.add_argument('--serve', choices=ASYNC_MODES, help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port)
+        return
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix='pdf-chatbot-load-') as workdir:
+        for mode in args.modes:
+            if mode != 'threading' and importlib.util.find_spec(mode) is None:
+                print(f"{mode:<10} skipped: {mode} is not installed")
+                results.append({'mode': mode, 'saturation_rate': None, 'skipped': True})
+                continue
+            result = run_mode(mode, workdir, args)
+            results.append(result)
+
+    print()
+    for result in results:
+        if not result.get('skipped'):
+            print(f"{result['mode']:<10} sustains {result['saturation_rate']:g} messages/s"
+                  if result['saturation_rate'] else
+                  f"{result['mode']:<10} missed the SLO at the lowest rate")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'args': vars(args), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""
+Generate synthetic PDFs for benchmarks, without any PDF library.
+
+Two kinds of document are produced:
+
+``text``   Text-heavy pages: many lines of Helvetica text with words drawn
+           from a Zipf-distributed vocabulary, like a manual or a report.
+``image``  Image-heavy pages: one Flate-compressed grayscale image per page
+           with a short caption, like a scanned document.
+
+Documents are written object by object, so generating thousands of pages
+does not hold the whole file in memory. Generation is deterministic for a
+given seed. Run from the backend directory to write a corpus:
+
+    python benchmarks/synthetic_pdfs.py --pages 10 100 1000 5000 --out /tmp/corpus
+"""
+import argparse
+import os
+import zlib
+from typing import List, NamedTuple, Tuple
+import numpy as np
+
+KINDS = ('text', 'image')
+FONT = 1  # Object number of the shared font
+LINE_HEIGHT = 12
+
+
+class SyntheticPDF(NamedTuple):
+    """A generated document and the words usable as queries against it."""
+    path: str
+    kind: str
+    pages: int
+    size: int
+    sample_queries: List[str]
+
+
+def _escape(text: str) -> str:
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def _stream(content: bytes, extra: bytes = b'') -> bytes:
+    return b"<<%s/Length %d>>\nstream\n%s\nendstream" % (extra, len(content), content)
+
+
+def _text_page(rng, words, lines: int, words_per_line: int) -> Tuple[bytes, List[str]]:
+    ranks = np.minimum(rng.zipf(1.3, size=(lines, words_per_line)), len(words)) - 1
+    rows = [" ".join(words[row]) for row in ranks]
+    ops = [b"BT /F1 10 Tf %d TL 72 750 Td" % LINE_HEIGHT]
+    for row in rows:
+        ops.append(b"(%s) Tj T*" % _escape(row).encode('latin-1'))
+    ops.append(b"ET")
+    return b"\n".join(ops), rows
+
+
+def _image(rng, size: int) -> bytes:
+    # Blocky noise compresses about as well as a scanned page
+    blocks = rng.integers(0, 256, size=(-(-size // 8), -(-size // 8)), dtype=np.uint8)
+    pixels = np.kron(blocks, np.ones((8, 8), dtype=np.uint8))[:size, :size]
+    return zlib.compress(pixels.tobytes(), 6)
+
+
+def generate_pdf(path: str, pages: int, kind: str = 'text', seed: int = 0,
+                 lines_per_page: int = 50, words_per_line: int = 12,
+                 image_size: int = 256, vocabulary: int = 5000) -> SyntheticPDF:
+    """Write a synthetic PDF.
+
+    Args:
+        path: Destination file path.
+        pages: Number of pages.
+        kind: 'text' for text-heavy or 'image' for image-heavy pages.
+        seed: Random seed; the same arguments produce the same file.
+        lines_per_page: Lines of text on a text-heavy page.
+        words_per_line: Words per line of text.
+        image_size: Width and height in pixels of the image on an image page.
+        vocabulary: Number of distinct words.
+
+    Returns:
+        The generated document, with a few lines of its text as sample queries.
+    """
+    if kind not in KINDS:
+        raise ValueError(f"Unknown document kind: {kind}")
+    rng = np.random.default_rng(seed)
+    words = np.array([f"word{i}" for i in range(vocabulary)])
+    samples = [] if kind == 'text' else ["scanned page figure"]
+
+    offsets = []
+    with open(path, 'wb') as out:
+        def write_object(body: bytes) -> int:
+            offsets.append(out.tell())
+            out.write(b"%d 0 obj\n%s\nendobj\n" % (len(offsets), body))
+            return len(offsets)
+
+        out.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        write_object(b"<</Type/Font/Subtype/Type1/BaseFont/Helvetica>>")
+        # Pages refer to the page tree, which is written after them: the
+        # font, then per page an image (image kind), its contents and itself
+        tree_ref = 1 + pages * (3 if kind == 'image' else 2) + 1
+        kids = []
+        for number in range(pages):
+            resources = b"/Font<</F1 %d 0 R>>" % FONT
+            if kind == 'text':
+                content, rows = _text_page(rng, words, lines_per_page, words_per_line)
+                if len(samples) < 64:
+                    samples.append(" ".join(rows[rng.integers(len(rows))].split()[:6]))
+            else:
+                image = write_object(_stream(
+                    _image(rng, image_size),
+                    b"/Type/XObject/Subtype/Image/Width %d/Height %d"
+                    b"/ColorSpace/DeviceGray/BitsPerComponent 8/Filter/FlateDecode"
+                    % (image_size, image_size)
+                ))
+                resources += b"/XObject<</Im1 %d 0 R>>" % image
+                caption = f"Figure {number + 1} scanned page {' '.join(words[:3])}"
+                content = (
+                    b"q %d 0 0 %d 72 200 cm /Im1 Do Q "
+                    b"BT /F1 10 Tf 72 150 Td (%s) Tj ET"
+                    % (image_size, image_size, caption.encode('latin-1'))
+                )
+            contents = write_object(_stream(content))
+            kids.append(write_object(
+                b"<</Type/Page/Parent %d 0 R/MediaBox[0 0 612 792]"
+                b"/Resources<<%s>>/Contents %d 0 R>>" % (tree_ref, resources, contents)
+            ))
+        tree = write_object(b"<</Type/Pages/Kids[%s]/Count %d>>" % (
+            b" ".join(b"%d 0 R" % kid for kid in kids), len(kids)
+        ))
+        root = write_object(b"<</Type/Catalog/Pages %d 0 R>>" % tree)
+
+        xref = out.tell()
+        out.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(offsets) + 1))
+        for offset in offsets:
+            out.write(b"%010d 00000 n \n" % offset)
+        out.write(b"trailer\n<</Size %d/Root %d 0 R>>\nstartxref\n%d\n%%%%EOF\n" % (
+            len(offsets) + 1, root, xref
+        ))
+        size = out.tell()
+
+    return SyntheticPDF(path, kind, pages, size, samples)
+
+
+def generate_corpus(directory: str, page_counts, kinds=KINDS, seed: int = 0,
+                    **options) -> List[SyntheticPDF]:
+    """Generate one document per page count and kind into a directory."""
+    os.makedirs(directory, exist_ok=True)
+    corpus = []
+    for kind in kinds:
+        for pages in page_counts:
+            path = os.path.join(directory, f"{kind}-{pages}.pdf")
+            corpus.append(generate_pdf(path, pages, kind, seed=seed + pages, **options))
+    return corpus
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--pages', type=int, nargs='+', default=[10, 100, 1000, 5000])
+    parser.add_argument('--kinds', nargs='+', choices=KINDS, default=list(KINDS))
+    parser.add_argument('--out', default='benchmark-corpus')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    for document in generate_corpus(args.out, args.pages, args.kinds, args.seed):
+        print(f"{document.path}: {document.pages} pages, {document.size / 2**20:.1f}MiB")
+
+
+if __name__ == '__main__':
+    main()
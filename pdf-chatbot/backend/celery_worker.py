@@ -0,0 +1,14 @@
+"""
+Celery worker entry point.
+
+Run with CELERY_BROKER_URL set:
+    celery -A celery_worker worker --pool threads
+
+The default prefork pool runs tasks in daemonic processes, which cannot
+start the extraction sandbox (see sandbox.py); extraction would then run
+without its time and memory budgets.
+"""
+from app import create_app
+
+flask_app = create_app()
+celery = flask_app.extensions['job_dispatcher'].celery
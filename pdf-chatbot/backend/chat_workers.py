@@ -0,0 +1,138 @@
+"""
+Bounded worker pool for chat answers requested over Socket.IO.
+
+Answering a question means index loads, retrieval and database writes, all
+of which block. Running them inside the Socket.IO event handler stalls
+event delivery for every other connected client, so ``chat_message``
+events only enqueue the work here and return. Workers are started with
+``socketio.start_background_task``, so they are threads in threading mode
+and greenlets under eventlet or gevent (which then need the standard
+library monkey patched, as Flask-SocketIO requires for blocking I/O).
+"""
+import queue
+import threading
+from typing import Callable, Dict
+from models import db
+
+
+class ChatQueueFull(Exception):
+    """Raised when the chat worker queue cannot accept more messages."""
+
+
+class ChatWorkerPool:
+    """Runs chat answers on a fixed number of Socket.IO background tasks.
+
+    With ``workers=0`` tasks run synchronously inside ``submit``, which keeps
+    tests deterministic.
+    """
+
+    def __init__(self, app, socketio, workers=4, max_queue=100):
+        """Initialize the pool. Workers start on the first submitted task.
+
+        Args:
+            app: Flask application used for the application context of tasks.
+            socketio: SocketIO instance that starts the background tasks.
+            workers: Maximum number of answers computed concurrently; 0 runs
+                tasks inline.
+            max_queue: Maximum number of tasks waiting for a worker.
+        """
+        self.app = app
+        self.socketio = socketio
+        self.workers = workers
+        self.max_queue = max_queue
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._started = 0
+        self._active = 0
+        self._lock = threading.Lock()
+
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def submit(self, fn: Callable, *args) -> None:
+        """Queue ``fn(*args)`` to run in an application context.
+
+        Raises:
+            ChatQueueFull: If max_queue tasks are already waiting.
+        """
+        if self.workers <= 0:
+            self._run(fn, args)
+            return
+
+        self._start_workers()
+        try:
+            self._queue.put_nowait((fn, args))
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            raise ChatQueueFull(f"Chat queue is full ({self.max_queue} messages)")
+
+    def queue_depth(self) -> int:
+        """Number of tasks waiting for a worker."""
+        return self._queue.qsize()
+
+    def stats(self) -> Dict:
+        """Return the queue depth, busy workers and task counters."""
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'active': self._active,
+                'queue_depth': self.queue_depth(),
+                'max_queue': self.max_queue,
+                'completed': self.completed,
+                'failed': self.failed,
+                'rejected': self.rejected
+            }
+
+    def join(self):
+        """Block until every queued task has been processed."""
+        self._queue.join()
+
+    def _start_workers(self):
+        with self._lock:
+            while self._started < self.workers:
+                self.socketio.start_background_task(self._worker)
+                self._started += 1
+
+    def _worker(self):
+        while True:
+            fn, args = self._queue.get()
+            try:
+                with self._lock:
+                    self._active += 1
+                with self.app.app_context():
+                    self._run(fn, args)
+                    db.session.remove()
+            finally:
+                with self._lock:
+                    self._active -= 1
+                self._queue.task_done()
+
+    def _run(self, fn, args):
+        try:
+            fn(*args)
+        except Exception as e:
+            self.app.logger.error(f"Chat task crashed: {str(e)}")
+            with self._lock:
+                self.failed += 1
+        else:
+            with self._lock:
+                self.completed += 1
+
+
+def create_chat_worker_pool(app, socketio) -> ChatWorkerPool:
+    """Create the chat worker pool configured for an application.
+
+    Args:
+        app: Flask application.
+        socketio: SocketIO instance bound to the application.
+
+    Returns:
+        A ChatWorkerPool sized by CHAT_SOCKET_WORKERS and CHAT_SOCKET_QUEUE_SIZE.
+    """
+    return ChatWorkerPool(
+        app,
+        socketio,
+        workers=app.config.get('CHAT_SOCKET_WORKERS', 4),
+        max_queue=app.config.get('CHAT_SOCKET_QUEUE_SIZE', 100)
+    )
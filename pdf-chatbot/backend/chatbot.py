@@ -1,75 +1,555 @@
 """
-Mock chatbot service for testing purposes.
+Chatbot service answering questions from the passages of an extracted PDF.
 """
-from typing import Dict, List, Tuple
-from models import db, PDFDocument, ChatMessage
+import base64
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+from sqlalchemy import tuple_
+from sqlalchemy.orm import load_only
+from answer_cache import AnswerCache
+from message_writer import MessageWriter
+from metrics import CHAT_SECONDS, HISTORY_SECONDS
+from models import db, PDFDocument, PDFPage, ChatMessage
+from retrieval import DocumentIndex, IncrementalIndex, RETRIEVAL_MODES, SearchResult, index_path
+
+class PageCoverage(NamedTuple):
+    """Pages of a document covered by the index answers are drawn from."""
+    pages_indexed: Optional[int]
+    total_pages: Optional[int]  # Page count from the upload pre-scan, if known
+    complete: bool
+
+
+class AnswerChunk(NamedTuple):
+    """A passage of a streamed answer."""
+    text: str
+    confidence: float
+    coverage: Optional[PageCoverage]  # Of the index the answer was drawn from
+
+
+class _CachedIndex(NamedTuple):
+    """Index of a document in the service's cache."""
+    version: tuple
+    index: DocumentIndex
+    coverage: PageCoverage
+    partial: Optional[IncrementalIndex]  # Grown while the document is extracted
+
 
 class ChatbotService:
-    """Mock service for handling chatbot interactions."""
-    
-    def __init__(self):
-        """Initialize the mock chatbot service."""
-        pass
-        
-    def process_message(self, user_id: int, pdf_id: str, 
-                       message: str) -> Tuple[str, float]:
-        """Process a user message and generate a mock response.
-        
+    """Service for handling chatbot interactions using passage retrieval."""
+
+    NOT_FOUND_RESPONSE = "I'm sorry, I couldn't find the PDF document you're referring to."
+    PROCESSING_RESPONSE = (
+        "This document is still being processed. Please ask again in a moment."
+    )
+    NO_ANSWER_RESPONSE = (
+        "I couldn't find anything about that in this document. "
+        "Could you rephrase your question?"
+    )
+    TOP_K = 3  # Passages retrieved per question
+    MIN_CONFIDENCE = 0.2  # Below this, ask the user to rephrase
+    INDEX_CACHE_SIZE = 32  # Per-document indexes kept in memory
+
+    def __init__(self, retrieval_mode: str = 'bm25',
+                 answer_cache: Optional[AnswerCache] = None,
+                 message_writer: Optional[MessageWriter] = None,
+                 embedding_dim: int = 256):
+        """Initialize the chatbot service with an empty index cache.
+
+        Args:
+            retrieval_mode: 'bm25' for lexical or 'dense' for embedding search.
+            answer_cache: Optional cache of answers to repeated questions.
+            message_writer: Optional write-behind writer; without one each
+                exchange is committed before the answer is returned.
+            embedding_dim: Embedding width of indexes built from stored
+                pages, matching the index files written at extraction.
+        """
+        if retrieval_mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode: {retrieval_mode}")
+        self.retrieval_mode = retrieval_mode
+        self.answer_cache = answer_cache
+        self.message_writer = message_writer
+        self.embedding_dim = embedding_dim
+        self._indexes = OrderedDict()
+        self._indexes_lock = threading.Lock()
+        self._partial_lock = threading.Lock()
+
+    def process_message(self, user_id: int, pdf_id: str, message: str,
+                        with_coverage: bool = False) -> Tuple:
+        """Process a user message and answer it from the document's passages.
+
         Args:
             user_id: ID of the user sending the message.
             pdf_id: ID of the PDF document being discussed.
             message: User's message text.
-            
+            with_coverage: Also return the page coverage of the answer.
+
         Returns:
-            Tuple containing (response text, confidence score).
+            Tuple containing (response text, confidence score), followed by
+            the PageCoverage of the index the answer was drawn from (None if
+            the document does not exist) with ``with_coverage``.
         """
-        # Get PDF content
-        pdf_doc = PDFDocument.query.get(pdf_id)
-        if not pdf_doc or not pdf_doc.content:
-            return "I'm sorry, I couldn't find the PDF document you're referring to.", 0.0
-            
-        # Store the message in chat history
-        chat_message = ChatMessage(
-            user_id=user_id,
-            pdf_id=pdf_id,
-            message=message,
-            is_user=True
-        )
-        db.session.add(chat_message)
-        
-        # Generate mock response
-        response = "This is a mock response for testing purposes."
-        confidence = 0.8
-        
-        chat_message = ChatMessage(
-            user_id=user_id,
-            pdf_id=pdf_id,
-            message=response,
-            is_user=False
+        started = time.perf_counter()
+
+        # Look the document up without loading its text
+        pdf_doc = self._get_document(pdf_id)
+        answered = self._answer_many(pdf_doc, [message]) if pdf_doc else None
+        if answered is None:
+            answer = (self._unavailable_response(pdf_doc), 0.0)
+            coverage = self._unavailable_coverage(pdf_doc)
+        else:
+            (answer,), coverage = answered
+            self._store_exchanges(
+                user_id, pdf_doc.id, [(message, answer[0])],
+                response_time=time.perf_counter() - started
+            )
+
+        return answer + (coverage,) if with_coverage else answer
+
+    def process_messages(self, user_id: int, pdf_id: str, messages: Sequence[str],
+                         with_coverage: bool = False):
+        """Answer several messages about one document in a single pass.
+
+        The document and its index are loaded once, all questions are scored
+        together, the pages of every answer are fetched in one query and all
+        exchanges are persisted in one transaction.
+
+        Args:
+            user_id: ID of the user sending the messages.
+            pdf_id: ID of the PDF document being discussed.
+            messages: User message texts.
+            with_coverage: Also return the page coverage of the answers.
+
+        Returns:
+            One (response text, confidence score) per message, in input order;
+            with ``with_coverage``, a tuple of that list and the PageCoverage
+            of the index the answers were drawn from.
+        """
+        started = time.perf_counter()
+        messages = list(messages)
+        pdf_doc = self._get_document(pdf_id) if messages else None
+        answered = self._answer_many(pdf_doc, messages) if pdf_doc else None
+        if answered is None:
+            answers = [(self._unavailable_response(pdf_doc), 0.0)] * len(messages)
+            coverage = self._unavailable_coverage(pdf_doc)
+        else:
+            answers, coverage = answered
+            self._store_exchanges(
+                user_id, pdf_doc.id,
+                [(message, response) for message, (response, _) in zip(messages, answers)],
+                response_time=(time.perf_counter() - started) / len(messages)
+            )
+        return (answers, coverage) if with_coverage else answers
+
+    def stream_message(self, user_id: int, pdf_id: str,
+                       message: str) -> Iterator[AnswerChunk]:
+        """Answer a user message as a stream of answer chunks.
+
+        Answers are extractive: the cited passage is complete as soon as
+        retrieval returns, and there is nothing to send before that. The
+        stream therefore yields one passage-sized chunk per answer passage,
+        straight from retrieval, rather than splitting a finished answer into
+        words. The exchange is persisted once, after the last chunk, and only
+        if the stream is consumed to the end, so it adds nothing to the time
+        to the first chunk.
+
+        Args:
+            user_id: ID of the user sending the message.
+            pdf_id: ID of the PDF document being discussed.
+            message: User's message text.
+
+        Yields:
+            AnswerChunk with the next piece of response text, the confidence
+            and the page coverage of the answer.
+        """
+        started = time.perf_counter()
+
+        pdf_doc = self._get_document(pdf_id)
+        answered = self._answer_many(pdf_doc, [message]) if pdf_doc else None
+        if answered is None:
+            yield AnswerChunk(
+                self._unavailable_response(pdf_doc), 0.0, self._unavailable_coverage(pdf_doc)
+            )
+            return
+
+        ((response, confidence),), coverage = answered
+        yield AnswerChunk(response, confidence, coverage)
+
+        self._store_exchanges(
+            user_id, pdf_doc.id, [(message, response)],
+            response_time=time.perf_counter() - started
         )
-        db.session.add(chat_message)
-        db.session.commit()
-        
-        return response, confidence
-    
+
+    @HISTORY_SECONDS.time('full')
     def get_chat_history(self, user_id: int, pdf_id: str) -> List[Dict]:
         """Retrieve chat history for a specific user and PDF.
-        
+
         Args:
             user_id: ID of the user.
             pdf_id: ID of the PDF document.
-            
+
         Returns:
             List of chat messages with their metadata.
         """
-        messages = ChatMessage.query.filter_by(
-            user_id=user_id,
-            pdf_id=pdf_id
-        ).order_by(ChatMessage.timestamp.asc()).all()
-        
-        return [{
-            'id': msg.id,
-            'message': msg.message,
-            'is_user': msg.is_user,
+        query = self._history_query(user_id, pdf_id)
+        if query is None:
+            return []
+
+        messages = query.order_by(ChatMessage.timestamp.asc(), ChatMessage.id.asc()).all()
+        return [self._serialize(msg) for msg in messages]
+
+    @HISTORY_SECONDS.time('page')
+    def get_history_page(self, user_id: int, pdf_id: str, limit: int,
+                         before: Optional[str] = None,
+                         since: Optional[str] = None) -> Dict:
+        """Retrieve one page of chat history using (timestamp, id) keyset cursors.
+
+        Without a cursor the latest ``limit`` messages are returned. ``before``
+        pages backwards through older messages and ``since`` returns the
+        messages written after a cursor, oldest first, for delta syncs.
+        Messages are always returned in chronological order.
+
+        Args:
+            user_id: ID of the user.
+            pdf_id: ID of the PDF document.
+            limit: Maximum number of messages to return.
+            before: Cursor of the oldest message the client already has.
+            since: Cursor of the newest message the client already has.
+
+        Returns:
+            Dictionary with the messages, whether more messages lie beyond the
+            page, and the cursors of its oldest and newest messages.
+
+        Raises:
+            ValueError: If a cursor is malformed.
+        """
+        page = {'messages': [], 'has_more': False, 'before': before, 'since': since}
+        query = self._history_query(user_id, pdf_id)
+        if query is None:
+            return page
+
+        if since:
+            timestamp, message_id = self.decode_cursor(since)
+            query = query.filter(
+                tuple_(ChatMessage.timestamp, ChatMessage.id) > (timestamp, message_id)
+            ).order_by(ChatMessage.timestamp.asc(), ChatMessage.id.asc())
+        else:
+            if before:
+                timestamp, message_id = self.decode_cursor(before)
+                query = query.filter(
+                    tuple_(ChatMessage.timestamp, ChatMessage.id) < (timestamp, message_id)
+                )
+            query = query.order_by(ChatMessage.timestamp.desc(), ChatMessage.id.desc())
+
+        # One extra row tells whether another page follows
+        messages = query.limit(limit + 1).all()
+        page['has_more'] = len(messages) > limit
+        messages = messages[:limit]
+        if not since:
+            messages.reverse()
+
+        if messages:
+            page['before'] = self.encode_cursor(messages[0])
+            page['since'] = self.encode_cursor(messages[-1])
+        page['messages'] = [self._serialize(msg) for msg in messages]
+        return page
+
+    def get_pages(self, pdf_id: str, page_numbers: Iterable[int]) -> List[PDFPage]:
+        """Load only the requested pages of a document.
+
+        Args:
+            pdf_id: ID of the PDF document.
+            page_numbers: 1-based page numbers to load.
+
+        Returns:
+            The matching pages in page order.
+        """
+        pdf_uuid = self._parse_id(pdf_id)
+        page_numbers = list(page_numbers)
+        if pdf_uuid is None or not page_numbers:
+            return []
+        return PDFPage.query.filter(
+            PDFPage.pdf_document_id == pdf_uuid,
+            PDFPage.page_number.in_(page_numbers)
+        ).order_by(PDFPage.page_number.asc()).all()
+
+    @CHAT_SECONDS.time('retrieval')
+    def _answer_many(self, pdf_doc: PDFDocument, messages: Sequence[str]
+                     ) -> Optional[Tuple[List[Tuple[str, float]], PageCoverage]]:
+        """Answer messages from the cache, searching the index once for the rest.
+
+        Returns:
+            One (response text, confidence) per message, in order, and the
+            coverage of the index they were drawn from; or None if the
+            document has no extracted pages.
+        """
+        answers = [self._cached_answer(pdf_doc, message) for message in messages]
+        missing = [position for position, answer in enumerate(answers) if answer is None]
+        if not missing:
+            # Only answers about completed documents are cached
+            return answers, PageCoverage(pdf_doc.page_count, pdf_doc.page_count, True)
+
+        cached = self._get_index(pdf_doc)
+        if cached is None:
+            return None
+        index = cached.index
+
+        results = index.search_many(
+            [messages[position] for position in missing],
+            k=self.TOP_K, mode=self.retrieval_mode
+        )
+        # Answers from a partial index go stale as more pages are extracted
+        cacheable = self.answer_cache is not None and pdf_doc.processing_status == 'completed'
+        for position, answer in zip(missing, self._compose_answers(pdf_doc, index, results)):
+            answers[position] = answer
+            if cacheable:
+                self.answer_cache.set(pdf_doc.id, pdf_doc.content_hash, messages[position], answer)
+        return answers, cached.coverage
+
+    def _unavailable_response(self, pdf_doc: Optional[PDFDocument]) -> str:
+        """Response for a document that is missing or has no extracted pages yet."""
+        if pdf_doc is not None and pdf_doc.processing_status in ('pending', 'processing'):
+            return self.PROCESSING_RESPONSE
+        return self.NOT_FOUND_RESPONSE
+
+    @staticmethod
+    def _unavailable_coverage(pdf_doc: Optional[PDFDocument]) -> Optional[PageCoverage]:
+        """Coverage of a document that is missing or has no extracted pages yet."""
+        return PageCoverage(0, pdf_doc.page_count, False) if pdf_doc is not None else None
+
+    def _cached_answer(self, pdf_doc: PDFDocument, message: str) -> Optional[Tuple[str, float]]:
+        """Return a cached answer for a completed document, if any."""
+        if self.answer_cache is None or pdf_doc.processing_status != 'completed':
+            return None
+        return self.answer_cache.get(pdf_doc.id, pdf_doc.content_hash, message)
+
+    def _compose_answers(self, pdf_doc: PDFDocument, index: DocumentIndex,
+                         results: Sequence[SearchResult]) -> List[Tuple[str, float]]:
+        """Turn ranked passages into responses, loading only the pages needed."""
+        best = [
+            tuple(int(value) for value in index.passages[result.passages[0]])
+            if result.passages and result.confidence >= self.MIN_CONFIDENCE else None
+            for result in results
+        ]
+        page_numbers = {passage[0] for passage in best if passage}
+        page_texts = {
+            page.page_number: page.text for page in self.get_pages(pdf_doc.id, page_numbers)
+        }
+
+        answers = []
+        for result, passage in zip(results, best):
+            if passage is None:
+                answers.append((self.NO_ANSWER_RESPONSE, result.confidence))
+                continue
+            page_number, start, end = passage
+            if page_number not in page_texts:
+                answers.append((self.NO_ANSWER_RESPONSE, 0.0))
+                continue
+            text = page_texts[page_number][start:end].strip()
+            answers.append((f"{text} (page {page_number})", result.confidence))
+        return answers
+
+    @CHAT_SECONDS.time('lookup')
+    def _get_document(self, pdf_id: str) -> Optional[PDFDocument]:
+        """Load the small columns of a document, or None if it does not exist."""
+        pdf_uuid = self._parse_id(pdf_id)
+        if pdf_uuid is None:
+            return None
+        return db.session.get(
+            PDFDocument, pdf_uuid,
+            options=[load_only(
+                PDFDocument.id, PDFDocument.file_path, PDFDocument.content_hash,
+                PDFDocument.page_count, PDFDocument.processing_status,
+                PDFDocument.processing_date
+            )]
+        )
+
+    def _get_index(self, pdf_doc: PDFDocument) -> Optional[_CachedIndex]:
+        """Return the retrieval index of a document with its page coverage.
+
+        Indexes are cached per document and reloaded when the document is
+        re-extracted. On a cache miss the index written at extraction time is
+        loaded; if it is missing or stale it is rebuilt from the stored pages.
+        While the document is still being extracted, its index is grown from
+        the pages stored so far instead: each call only indexes the pages
+        committed since the previous one.
+
+        Returns:
+            The cache entry holding the index and the coverage of the pages
+            it was built from, or None if the document has no extracted pages.
+        """
+        version = (pdf_doc.content_hash, pdf_doc.processing_date)
+        with self._indexes_lock:
+            cached = self._indexes.get(pdf_doc.id)
+            if cached and cached.version == version:
+                self._indexes.move_to_end(pdf_doc.id)
+                if cached.partial is None:
+                    return cached
+            else:
+                cached = None
+
+        if cached is None and pdf_doc.content_hash:
+            index = DocumentIndex.load(index_path(pdf_doc.file_path), pdf_doc.content_hash)
+            if index is not None:
+                cached = _CachedIndex(
+                    version, index,
+                    PageCoverage(pdf_doc.page_count, pdf_doc.page_count, True), None
+                )
+        if cached is None and pdf_doc.processing_status == 'completed':
+            page_texts = [text for text, in db.session.query(PDFPage.text).filter_by(
+                pdf_document_id=pdf_doc.id
+            ).order_by(PDFPage.page_number.asc())]
+            if page_texts:
+                cached = _CachedIndex(
+                    version, DocumentIndex.build(page_texts, dim=self.embedding_dim),
+                    PageCoverage(len(page_texts), pdf_doc.page_count, True), None
+                )
+        elif cached is None or cached.partial is not None:
+            cached = self._extend_partial_index(
+                pdf_doc, version, cached.partial if cached else None
+            )
+        if cached is None:
+            return None
+
+        with self._indexes_lock:
+            self._indexes[pdf_doc.id] = cached
+            self._indexes.move_to_end(pdf_doc.id)
+            while len(self._indexes) > self.INDEX_CACHE_SIZE:
+                self._indexes.popitem(last=False)
+        return cached
+
+    def _extend_partial_index(self, pdf_doc: PDFDocument, version: tuple,
+                              partial: Optional[IncrementalIndex]) -> Optional[_CachedIndex]:
+        """Add the pages stored since the last call to a document's partial index.
+
+        Extraction commits pages in batches, in page order, so the stored
+        pages are always the first pages of the document.
+
+        Returns:
+            The cache entry, or None if no pages have been stored yet.
+        """
+        with self._partial_lock:
+            partial = partial or IncrementalIndex(self.embedding_dim)
+            page_texts = [text for text, in db.session.query(PDFPage.text).filter(
+                PDFPage.pdf_document_id == pdf_doc.id,
+                PDFPage.page_number > partial.pages
+            ).order_by(PDFPage.page_number.asc())]
+            if page_texts:
+                partial.add_pages(page_texts)
+            if not partial.pages:
+                return None
+            return _CachedIndex(
+                version, partial.index(),
+                PageCoverage(partial.pages, pdf_doc.page_count, False), partial
+            )
+
+    @CHAT_SECONDS.time('persistence')
+    def _store_exchanges(self, user_id: int, pdf_uuid: uuid.UUID,
+                         exchanges: Sequence[Tuple[str, str]],
+                         response_time: Optional[float] = None) -> None:
+        """Persist user messages and the assistant replies to them together.
+
+        Args:
+            user_id: ID of the user.
+            pdf_uuid: ID of the PDF document.
+            exchanges: (message, response) pairs in the order they were asked.
+            response_time: Seconds taken to answer each message.
+        """
+        conversation_id = self._conversation_id(user_id, pdf_uuid)
+        rows = []
+        previous = None
+        for message, response in exchanges:
+            # Keep every reply after its question, and each exchange after
+            # the one before, in (timestamp, id) order
+            asked_at = datetime.utcnow()
+            if previous is not None:
+                asked_at = max(asked_at, previous + timedelta(microseconds=1))
+            answered_at = max(datetime.utcnow(), asked_at + timedelta(microseconds=1))
+            previous = answered_at
+
+            user_message_id = uuid.uuid4()
+            rows.append({
+                'id': user_message_id,
+                'pdf_document_id': pdf_uuid,
+                'message_type': 'user',
+                'content': message,
+                'timestamp': asked_at,
+                'conversation_id': conversation_id,
+                'parent_message_id': None,
+                'response_time': None
+            })
+            rows.append({
+                'id': uuid.uuid4(),
+                'pdf_document_id': pdf_uuid,
+                'message_type': 'assistant',
+                'content': response,
+                'timestamp': answered_at,
+                'conversation_id': conversation_id,
+                'parent_message_id': user_message_id,
+                'response_time': response_time
+            })
+
+        if self.message_writer is not None:
+            self.message_writer.write(rows)
+            return
+
+        db.session.add_all(ChatMessage(**row) for row in rows)
+        db.session.commit()
+
+    def _history_query(self, user_id: int, pdf_id: str):
+        """Query of a user's messages about a document, or None for a bad ID."""
+        pdf_uuid = self._parse_id(pdf_id)
+        if pdf_uuid is None:
+            return None
+        return ChatMessage.query.filter_by(
+            pdf_document_id=pdf_uuid,
+            conversation_id=self._conversation_id(user_id, pdf_uuid)
+        )
+
+    @staticmethod
+    def encode_cursor(msg: ChatMessage) -> str:
+        """Encode the (timestamp, id) position of a message as an opaque cursor."""
+        raw = f"{msg.timestamp.isoformat()}|{msg.id}".encode('utf-8')
+        return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+    @staticmethod
+    def decode_cursor(cursor: str) -> Tuple[datetime, uuid.UUID]:
+        """Decode a cursor produced by encode_cursor().
+
+        Raises:
+            ValueError: If the cursor is malformed.
+        """
+        try:
+            raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+            timestamp, message_id = raw.split('|')
+            return datetime.fromisoformat(timestamp), uuid.UUID(message_id)
+        except (ValueError, UnicodeDecodeError) as e:
+            raise ValueError(f"Invalid history cursor: {cursor}") from e
+
+    @staticmethod
+    def _conversation_id(user_id: int, pdf_uuid: uuid.UUID) -> uuid.UUID:
+        """Derive the stable conversation ID of a user's chat about a document."""
+        return uuid.uuid5(uuid.NAMESPACE_URL, f"pdf-chatbot:{user_id}:{pdf_uuid}")
+
+    @staticmethod
+    def _parse_id(pdf_id) -> Optional[uuid.UUID]:
+        """Convert a document ID to a UUID, or None if it is malformed."""
+        if isinstance(pdf_id, uuid.UUID):
+            return pdf_id
+        try:
+            return uuid.UUID(str(pdf_id))
+        except ValueError:
+            return None
+
+    @staticmethod
+    def _serialize(msg: ChatMessage) -> Dict:
+        """Convert a chat message to its API representation."""
+        return {
+            'id': str(msg.id),
+            'message': msg.content,
+            'is_user': msg.message_type == 'user',
             'timestamp': msg.timestamp.isoformat()
-        } for msg in messages]
\ No newline at end of file
+        }
@@ -15,6 +15,83 @@ class Config:
     
     # Secret key for session management
     SECRET_KEY = os.getenv('SECRET_KEY', 'dev-secret-key')
+    
+    # Text extraction: documents with at least EXTRACTION_PARALLEL_MIN_PAGES
+    # pages are split across EXTRACTION_WORKERS processes
+    EXTRACTION_WORKERS = int(os.getenv('EXTRACTION_WORKERS', os.cpu_count() or 1))
+    EXTRACTION_PARALLEL_MIN_PAGES = int(os.getenv('EXTRACTION_PARALLEL_MIN_PAGES', 100))
+    
+    # Documents with at least EXTRACTION_STREAMING_MIN_PAGES pages are stored
+    # EXTRACTION_PAGE_BATCH pages at a time instead of being held in memory
+    EXTRACTION_STREAMING_MIN_PAGES = int(os.getenv('EXTRACTION_STREAMING_MIN_PAGES', 500))
+    EXTRACTION_PAGE_BATCH = int(os.getenv('EXTRACTION_PAGE_BATCH', 100))
+    
+    # Pages are extracted in child processes limited to EXTRACTION_MEMORY_LIMIT_MB
+    # of address space; pages taking longer than EXTRACTION_PAGE_TIMEOUT seconds,
+    # and all pages left after EXTRACTION_DOCUMENT_TIMEOUT seconds, are skipped
+    EXTRACTION_SANDBOX = os.getenv('EXTRACTION_SANDBOX', 'true').lower() == 'true'
+    EXTRACTION_PAGE_TIMEOUT = float(os.getenv('EXTRACTION_PAGE_TIMEOUT', 30.0))
+    EXTRACTION_DOCUMENT_TIMEOUT = float(os.getenv('EXTRACTION_DOCUMENT_TIMEOUT', 900.0))
+    EXTRACTION_MEMORY_LIMIT_MB = int(os.getenv('EXTRACTION_MEMORY_LIMIT_MB', 1024))
+    
+    # Extraction jobs run on Celery when a broker is configured, otherwise on
+    # EXTRACTION_LOCAL_WORKERS in-process threads (0 runs jobs inline)
+    CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL')
+    CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND')
+    EXTRACTION_LOCAL_WORKERS = int(os.getenv('EXTRACTION_LOCAL_WORKERS', 2))
+    EXTRACTION_QUEUE_SIZE = int(os.getenv('EXTRACTION_QUEUE_SIZE', 100))
+    EXTRACTION_STALE_AFTER = int(os.getenv('EXTRACTION_STALE_AFTER', 3600))  # Seconds
+    
+    # Local jobs are scheduled smallest first, fairly between tenants; every
+    # EXTRACTION_AGING_SECONDS of waiting offsets a doubling of document size.
+    # EXTRACTION_FAST_LANE_WORKERS of the local workers only take documents of
+    # up to EXTRACTION_FAST_LANE_PAGES (estimated) pages
+    EXTRACTION_AGING_SECONDS = float(os.getenv('EXTRACTION_AGING_SECONDS', 30.0))
+    EXTRACTION_FAST_LANE_PAGES = int(os.getenv('EXTRACTION_FAST_LANE_PAGES', 10))
+    EXTRACTION_FAST_LANE_WORKERS = int(os.getenv('EXTRACTION_FAST_LANE_WORKERS', 1))
+    
+    # Extraction progress is published at most every EXTRACTION_PROGRESS_INTERVAL
+    # seconds and only after advancing EXTRACTION_PROGRESS_STEP percent
+    EXTRACTION_PROGRESS_INTERVAL = float(os.getenv('EXTRACTION_PROGRESS_INTERVAL', 1.0))
+    EXTRACTION_PROGRESS_STEP = float(os.getenv('EXTRACTION_PROGRESS_STEP', 5.0))
+    
+    # Chat retrieval: 'bm25' (lexical) or 'dense' (hashed TF-IDF embeddings)
+    RETRIEVAL_MODE = os.getenv('RETRIEVAL_MODE', 'bm25')
+    RETRIEVAL_EMBEDDING_DIM = int(os.getenv('RETRIEVAL_EMBEDDING_DIM', 256))
+    
+    # Answers to repeated questions: in-process LRU of ANSWER_CACHE_SIZE
+    # entries (0 disables it), or shared through Redis at ANSWER_CACHE_URL
+    ANSWER_CACHE_SIZE = int(os.getenv('ANSWER_CACHE_SIZE', 1024))
+    ANSWER_CACHE_TTL = int(os.getenv('ANSWER_CACHE_TTL', 3600))  # Seconds
+    ANSWER_CACHE_URL = os.getenv('ANSWER_CACHE_URL')
+    
+    # Write-behind persistence of chat messages: buffered rows are inserted
+    # in batches of MESSAGE_BATCH_SIZE or every MESSAGE_FLUSH_INTERVAL_MS
+    MESSAGE_WRITE_BEHIND = os.getenv('MESSAGE_WRITE_BEHIND', 'false').lower() == 'true'
+    MESSAGE_BATCH_SIZE = int(os.getenv('MESSAGE_BATCH_SIZE', 100))
+    MESSAGE_FLUSH_INTERVAL_MS = int(os.getenv('MESSAGE_FLUSH_INTERVAL_MS', 50))
+    MESSAGE_BUFFER_SIZE = int(os.getenv('MESSAGE_BUFFER_SIZE', 10000))
+    MESSAGE_BUFFER_TIMEOUT = float(os.getenv('MESSAGE_BUFFER_TIMEOUT', 5.0))  # Seconds
+    
+    # Maximum number of questions answered by one /api/chat/<pdf_id>/batch call
+    CHAT_BATCH_MAX_MESSAGES = int(os.getenv('CHAT_BATCH_MAX_MESSAGES', 100))
+    
+    # Socket.IO server: 'threading', 'eventlet' or 'gevent'; unset picks the
+    # first one installed
+    SOCKETIO_ASYNC_MODE = os.getenv('SOCKETIO_ASYNC_MODE') or None
+    # Message queue (e.g. redis://) shared with Celery workers, so that events
+    # emitted during extraction reach clients connected to the web processes
+    SOCKETIO_MESSAGE_QUEUE = os.getenv('SOCKETIO_MESSAGE_QUEUE')
+    
+    # Socket.IO chat answers run on CHAT_SOCKET_WORKERS background workers
+    # (0 answers inside the event handler); at most CHAT_SOCKET_QUEUE_SIZE
+    # messages wait for a worker before new ones are rejected
+    CHAT_SOCKET_WORKERS = int(os.getenv('CHAT_SOCKET_WORKERS', 4))
+    CHAT_SOCKET_QUEUE_SIZE = int(os.getenv('CHAT_SOCKET_QUEUE_SIZE', 100))
+    
+    # Chat history pagination
+    HISTORY_PAGE_SIZE = int(os.getenv('HISTORY_PAGE_SIZE', 50))
+    HISTORY_MAX_PAGE_SIZE = int(os.getenv('HISTORY_MAX_PAGE_SIZE', 200))
 
 class DevelopmentConfig(Config):
     """Development configuration."""
@@ -29,6 +106,15 @@ class TestingConfig(Config):
     WTF_CSRF_ENABLED = False
     # Make the instance folder temporary for testing
     UPLOAD_FOLDER = '/tmp/test_uploads'
+    # Run extraction jobs inline, without a broker or worker threads
+    CELERY_BROKER_URL = None
+    EXTRACTION_LOCAL_WORKERS = 0
+    # Extract in-process so tests can patch PyPDF2
+    EXTRACTION_SANDBOX = False
+    ANSWER_CACHE_URL = None
+    MESSAGE_WRITE_BEHIND = False
+    CHAT_SOCKET_WORKERS = 0
+    SOCKETIO_ASYNC_MODE = 'threading'
 
 class ProductionConfig(Config):
     """Production configuration."""
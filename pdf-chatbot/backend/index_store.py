@@ -0,0 +1,260 @@
+"""
+Versioned, memory-mappable on-disk format for per-document index arrays.
+
+Layout of an index file (all integers little-endian)::
+
+    offset 0   magic            8 bytes  b"PDFCIDX\\0"
+    offset 8   format version   uint16
+    offset 10  reserved         uint16
+    offset 12  metadata length  uint32
+    offset 16  header checksum  uint32   CRC-32 of bytes 0-15 and the metadata
+    offset 20  metadata         UTF-8 JSON: content hash, payload size and
+                                one entry per array (name, dtype, shape, offset)
+    ...        arrays           raw C-order data, each aligned to 64 bytes
+
+Opening a file reads and checks only the header; the arrays are then views
+into a read-only ``mmap`` of the file, so nothing is copied and every worker
+process mapping the same file shares its page-cache pages. Files are written
+to a temporary name and renamed into place, so processes that still map an
+older version keep a consistent view until they reopen.
+"""
+import json
+import mmap
+import os
+import struct
+import tempfile
+import zlib
+from typing import Dict, Mapping, Optional, Tuple
+import numpy as np
+
+MAGIC = b"PDFCIDX\0"
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+
+_PREFIX = struct.Struct('<8sHHI')
+_CHECKSUM = struct.Struct('<I')
+_HEADER_SIZE = _PREFIX.size + _CHECKSUM.size
+
+
+class IndexFormatError(Exception):
+    """Raised when an index file is corrupt or written in another format."""
+
+
+def _align(offset: int) -> int:
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def write_index(path: str, arrays: Mapping[str, np.ndarray],
+                content_hash: Optional[str] = None) -> None:
+    """Atomically write named arrays to an index file.
+
+    Args:
+        path: Destination path.
+        arrays: Arrays to store, keyed by name.
+        content_hash: Hash of the source document, checked by open_index().
+    """
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    layout = {name: (array.dtype, array.shape) for name, array in arrays.items()}
+    with IndexWriter(path, layout, content_hash) as writer:
+        for name, array in arrays.items():
+            writer.write(name, array)
+
+
+class IndexWriter:
+    """Writes an index file whose arrays arrive in chunks.
+
+    The dtype and shape of every array must be known up front; each array is
+    then written in order along its first axis, in as many chunks as needed,
+    so arrays larger than memory can be stored. Used as a context manager,
+    the file is renamed into place when the block completes and discarded
+    if it raises.
+    """
+
+    def __init__(self, path: str, layout: Mapping[str, Tuple[np.dtype, Tuple[int, ...]]],
+                 content_hash: Optional[str] = None):
+        """Create the temporary file and write the header.
+
+        Args:
+            path: Destination path.
+            layout: (dtype, shape) of each array, keyed by name.
+            content_hash: Hash of the source document, checked by open_index().
+        """
+        self.path = path
+        self._sections = {}
+        payload_size = 0
+        for name, (dtype, shape) in layout.items():
+            dtype = np.dtype(dtype)
+            nbytes = int(np.prod(shape)) * dtype.itemsize
+            self._sections[name] = {
+                'name': name,
+                'dtype': np.lib.format.dtype_to_descr(dtype),
+                'shape': list(shape),
+                'offset': payload_size,
+                'nbytes': nbytes,
+                'written': 0
+            }
+            payload_size = _align(payload_size + nbytes)
+
+        # Array offsets are absolute, so they lengthen the metadata they are
+        # stored in; grow the reserved header space until both agree.
+        data_start = _align(_HEADER_SIZE)
+        while True:
+            metadata = json.dumps({
+                'content_hash': content_hash or '',
+                'payload_size': payload_size,
+                'sections': [{
+                    'name': section['name'],
+                    'dtype': section['dtype'],
+                    'shape': section['shape'],
+                    'offset': data_start + section['offset']
+                } for section in self._sections.values()]
+            }, separators=(',', ':')).encode('utf-8')
+            if _HEADER_SIZE + len(metadata) <= data_start:
+                break
+            data_start = _align(_HEADER_SIZE + len(metadata))
+        for section in self._sections.values():
+            section['offset'] += data_start
+
+        prefix = _PREFIX.pack(MAGIC, FORMAT_VERSION, 0, len(metadata))
+        checksum = zlib.crc32(metadata, zlib.crc32(prefix))
+
+        # A unique temporary name, as identical uploads share one index path
+        descriptor, self._temp_path = tempfile.mkstemp(
+            dir=os.path.dirname(path) or '.', prefix=os.path.basename(path), suffix='.tmp'
+        )
+        self._out = os.fdopen(descriptor, 'wb')
+        try:
+            os.chmod(self._temp_path, 0o644)  # mkstemp creates files readable by the owner only
+            self._out.write(prefix)
+            self._out.write(_CHECKSUM.pack(checksum))
+            self._out.write(metadata)
+            self._out.truncate(data_start + payload_size)
+        except Exception:
+            self.abort()
+            raise
+
+    def write(self, name: str, chunk: np.ndarray) -> None:
+        """Append the next rows of an array.
+
+        Raises:
+            ValueError: If the chunk has the wrong dtype or overruns the array.
+        """
+        section = self._sections[name]
+        chunk = np.ascontiguousarray(chunk)
+        if np.lib.format.dtype_to_descr(chunk.dtype) != section['dtype']:
+            raise ValueError(f"Index array {name} has dtype {section['dtype']}, not {chunk.dtype}")
+        if section['written'] + chunk.nbytes > section['nbytes']:
+            raise ValueError(f"Too much data for index array {name}")
+        if chunk.nbytes:
+            self._out.seek(section['offset'] + section['written'])
+            self._out.write(chunk.tobytes())
+            section['written'] += chunk.nbytes
+
+    def commit(self) -> None:
+        """Rename the completed file into place.
+
+        Raises:
+            ValueError: If an array has not been written completely.
+        """
+        try:
+            incomplete = [s['name'] for s in self._sections.values() if s['written'] != s['nbytes']]
+            if incomplete:
+                raise ValueError(f"Index arrays not written completely: {', '.join(incomplete)}")
+            self._out.close()
+            os.replace(self._temp_path, self.path)
+        except Exception:
+            self.abort()
+            raise
+
+    def abort(self) -> None:
+        """Discard the temporary file."""
+        self._out.close()
+        if os.path.exists(self._temp_path):
+            os.remove(self._temp_path)
+
+    def __enter__(self) -> 'IndexWriter':
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
+
+
+def read_header(path: str) -> Dict:
+    """Read and validate the header of an index file.
+
+    Args:
+        path: Index file path.
+
+    Returns:
+        The decoded metadata.
+
+    Raises:
+        OSError: If the file cannot be read.
+        IndexFormatError: If the magic, version, checksum or size is wrong.
+    """
+    with open(path, 'rb') as f:
+        prefix = f.read(_PREFIX.size)
+        checksum = f.read(_CHECKSUM.size)
+        if len(prefix) < _PREFIX.size or len(checksum) < _CHECKSUM.size:
+            raise IndexFormatError("Index file is truncated")
+
+        magic, version, _, metadata_length = _PREFIX.unpack(prefix)
+        if magic != MAGIC:
+            raise IndexFormatError("Not an index file")
+        if version != FORMAT_VERSION:
+            raise IndexFormatError(f"Unsupported index format version {version}")
+
+        metadata = f.read(metadata_length)
+        if zlib.crc32(metadata, zlib.crc32(prefix)) != _CHECKSUM.unpack(checksum)[0]:
+            raise IndexFormatError("Index header checksum mismatch")
+        file_size = os.fstat(f.fileno()).st_size
+
+    header = json.loads(metadata)
+    data_start = _align(_HEADER_SIZE + metadata_length)
+    if file_size != data_start + header['payload_size']:
+        raise IndexFormatError("Index file size does not match its header")
+    return header
+
+
+def open_index(path: str, content_hash: Optional[str] = None) -> Optional[Dict[str, np.ndarray]]:
+    """Map an index file and return read-only, zero-copy views of its arrays.
+
+    Args:
+        path: Index file path.
+        content_hash: Expected source hash; a mismatch counts as stale.
+
+    Returns:
+        Arrays keyed by name, or None if the file is missing, stale or corrupt.
+    """
+    try:
+        header = read_header(path)
+    except (OSError, ValueError, KeyError, IndexFormatError):
+        return None
+    if content_hash and header['content_hash'] != content_hash:
+        return None
+
+    with open(path, 'rb') as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    arrays = {}
+    for section in header['sections']:
+        dtype = np.lib.format.descr_to_dtype(_descr(section['dtype']))
+        shape = tuple(section['shape'])
+        count = int(np.prod(shape))
+        if not count:
+            arrays[section['name']] = np.empty(shape, dtype=dtype)
+            continue
+        arrays[section['name']] = np.frombuffer(
+            buffer, dtype=dtype, count=count, offset=section['offset']
+        ).reshape(shape)
+    return arrays
+
+
+def _descr(descr):
+    """Restore the tuples that JSON turned into lists in a structured dtype."""
+    if isinstance(descr, list):
+        return [tuple(field) for field in descr]
+    return descr
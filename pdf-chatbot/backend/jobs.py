@@ -0,0 +1,448 @@
+"""
+Background job dispatch for PDF text extraction.
+
+Extraction runs as a Celery task when CELERY_BROKER_URL is configured, and on
+a bounded pool of in-process worker threads otherwise. Both backends record
+every job in the ``extraction_jobs`` table, so queue latency is measured the
+same way whichever one is in use, and queued local jobs survive a restart.
+Local jobs are handed to the workers by an ExtractionScheduler (see
+scheduler.py) rather than in arrival order.
+"""
+import queue
+import threading
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional
+from sqlalchemy import update
+from models import db, ExtractionJob, PDFDocument
+from progress import create_progress_reporter
+from scheduler import ExtractionScheduler, estimate_cost
+
+
+class JobQueueFull(Exception):
+    """Raised when the local extraction queue cannot accept more jobs.
+
+    The job stays queued in the job table; ``job`` is set by submit().
+    """
+
+    job = None
+
+
+class JobDispatchError(Exception):
+    """Raised when a job could not be handed to its backend, e.g. a broker is down.
+
+    The job and its document have been marked failed by then.
+    """
+
+    def __init__(self, job, message):
+        super().__init__(message)
+        self.job = job
+
+
+def _as_uuid(value):
+    return value if isinstance(value, uuid.UUID) else uuid.UUID(str(value))
+
+
+class JobDispatcher:
+    """Base class for extraction job dispatchers."""
+
+    backend = None
+
+    def __init__(self, app, pdf_handler):
+        """Initialize the dispatcher.
+
+        Args:
+            app: Flask application used for the application context of jobs.
+            pdf_handler: PDFHandler that performs the extraction.
+        """
+        self.app = app
+        self.pdf_handler = pdf_handler
+
+    def submit(self, pdf_id, tenant: Optional[str] = None) -> ExtractionJob:
+        """Record and enqueue an extraction job for a document.
+
+        Args:
+            pdf_id: ID of the PDFDocument to extract.
+            tenant: Optional tenant the job is scheduled fairly against.
+
+        Returns:
+            The persisted ExtractionJob.
+
+        Raises:
+            JobQueueFull: If the local queue is full; the job stays queued.
+            JobDispatchError: If the backend could not accept the job.
+        """
+        job = ExtractionJob(
+            pdf_document_id=_as_uuid(pdf_id),
+            backend=self.backend,
+            status='queued',
+            tenant=tenant,
+            enqueued_at=datetime.utcnow()
+        )
+        db.session.add(job)
+        db.session.commit()
+        try:
+            self._enqueue(job)
+        except JobQueueFull as e:
+            e.job = job
+            raise
+        except Exception as e:
+            raise JobDispatchError(self._fail_dispatch(job.id, e), str(e)) from e
+        return job
+
+    def _fail_dispatch(self, job_id, error) -> ExtractionJob:
+        """Mark a job that could not be enqueued, and its document, as failed."""
+        db.session.rollback()
+        job = db.session.get(ExtractionJob, job_id)
+        job.status = 'failed'
+        job.error = f"Could not dispatch job: {error}"
+        job.finished_at = datetime.utcnow()
+        pdf_doc = db.session.get(PDFDocument, job.pdf_document_id)
+        if pdf_doc is not None:
+            pdf_doc.processing_status = 'failed'
+            pdf_doc.processing_error = (
+                "Extraction could not be queued; upload the file again to retry"
+            )
+        db.session.commit()
+        return job
+
+    def run_job(self, job_id, on_progress: Optional[Callable] = None) -> Optional[Dict]:
+        """Claim and run a queued job. Requires an application context.
+
+        The job is claimed with a conditional update, so a job that has
+        already been picked up elsewhere is skipped.
+
+        Args:
+            job_id: ID of the ExtractionJob.
+            on_progress: Optional callable receiving (pages_done, total_pages),
+                throttled like the progress written to the document.
+
+        Returns:
+            The extraction result, or None if the job was not claimed.
+        """
+        job_id = _as_uuid(job_id)
+        claimed = db.session.execute(
+            update(ExtractionJob)
+            .where(ExtractionJob.id == job_id, ExtractionJob.status == 'queued')
+            .values(status='running', started_at=datetime.utcnow())
+        ).rowcount
+        db.session.commit()
+        if not claimed:
+            return None
+
+        job = db.session.get(ExtractionJob, job_id)
+        self.app.logger.info(
+            f"Extraction job {job.id} started on {self.backend} "
+            f"after {job.queue_latency:.3f}s in queue"
+        )
+        # Per-page progress is coalesced before it reaches the database,
+        # Socket.IO clients and on_progress
+        reporter = create_progress_reporter(self.app, job.pdf_document_id, forward=on_progress)
+        try:
+            result = self.pdf_handler.extract_text(job.pdf_document_id, on_progress=reporter)
+        except Exception as e:
+            db.session.rollback()
+            result = {"status": "error", "message": str(e)}
+
+        job = db.session.get(ExtractionJob, job_id)
+        job.status = 'completed' if result.get('status') == 'success' else 'failed'
+        job.error = result.get('message') if job.status == 'failed' else None
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+        reporter.finish(job.status, job.error)
+        return result
+
+    def get_status(self, job: ExtractionJob) -> Dict:
+        """Describe the state of a job.
+
+        Args:
+            job: ExtractionJob to describe.
+
+        Returns:
+            Dictionary with job state and timing information.
+        """
+        return {
+            'id': str(job.id),
+            'backend': job.backend,
+            'status': job.status,
+            'enqueued_at': job.enqueued_at.isoformat(),
+            'started_at': job.started_at.isoformat() if job.started_at else None,
+            'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+            'queue_latency': job.queue_latency,
+            'error': job.error
+        }
+
+    def queue_depth(self) -> int:
+        """Number of jobs waiting to start."""
+        return ExtractionJob.query.filter_by(status='queued', backend=self.backend).count()
+
+    def shutdown(self):
+        """Stop accepting work. Queued jobs stay in the job table."""
+
+    def _enqueue(self, job):
+        raise NotImplementedError
+
+
+class LocalDispatcher(JobDispatcher):
+    """Runs extraction jobs on a bounded pool of in-process worker threads.
+
+    With ``workers=0`` jobs run synchronously inside ``submit``, which keeps
+    tests deterministic.
+    """
+
+    backend = 'local'
+
+    def __init__(self, app, pdf_handler, workers=2, max_queue=100,
+                 fast_lane_workers=1, fast_lane_pages=10, aging_seconds=30.0):
+        """Initialize the local dispatcher.
+
+        Args:
+            app: Flask application.
+            pdf_handler: PDFHandler that performs the extraction.
+            workers: Number of worker threads; 0 runs jobs inline.
+            max_queue: Maximum number of jobs waiting for a worker.
+            fast_lane_workers: Workers reserved for small documents; at least
+                one worker always takes documents of any size.
+            fast_lane_pages: Largest estimated page count of the fast lane.
+            aging_seconds: Waiting time that offsets a doubling of job cost.
+        """
+        super().__init__(app, pdf_handler)
+        self.workers = workers
+        self.fast_lane_workers = max(0, min(fast_lane_workers, workers - 1))
+        self._queue = ExtractionScheduler(
+            maxsize=max_queue, aging_seconds=aging_seconds, fast_lane_pages=fast_lane_pages
+        )
+        self._threads = []
+        self._lock = threading.Lock()
+        self._in_flight = set()  # Jobs in the scheduler or being run
+        self._deferred = False  # Whether queued jobs were left in the job table
+
+    def _enqueue(self, job):
+        if self.workers <= 0:
+            self.run_job(job.id)
+            return
+
+        self._start_workers()
+        document = job.pdf_document
+        with self._lock:
+            try:
+                self._queue.put(
+                    job.id,
+                    tenant=job.tenant,
+                    cost=estimate_cost(document.page_count, document.file_size),
+                    waited=max(0.0, (datetime.utcnow() - job.enqueued_at).total_seconds())
+                )
+            except queue.Full:
+                # The job stays queued in the table until a worker frees a slot
+                self._deferred = True
+                raise JobQueueFull(f"Extraction queue is full ({self._queue.maxsize} jobs)")
+            self._in_flight.add(job.id)
+
+    def _start_workers(self):
+        with self._lock:
+            while len(self._threads) < self.workers:
+                fast_lane = len(self._threads) < self.fast_lane_workers
+                thread = threading.Thread(
+                    target=self._worker,
+                    args=(fast_lane,),
+                    name=f"extraction-{'fast-' if fast_lane else ''}worker-{len(self._threads)}",
+                    daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def _worker(self, fast_lane=False):
+        while True:
+            scheduled = self._queue.get(fast_lane=fast_lane)
+            if scheduled is None:
+                return
+            try:
+                with self.app.app_context():
+                    if self._deferred:
+                        # Taking the job freed a slot for a deferred one
+                        self._enqueue_pending()
+                    self.run_job(scheduled.job_id)
+                    db.session.remove()
+            except Exception as e:
+                self.app.logger.error(f"Extraction job {scheduled.job_id} crashed: {str(e)}")
+            finally:
+                with self._lock:
+                    self._in_flight.discard(scheduled.job_id)
+                self._queue.task_done()
+
+    def recover(self, stale_after=3600):
+        """Re-enqueue jobs left behind by a previous process.
+
+        Queued jobs are enqueued again, keeping the time they have already
+        waited for aging, and jobs that have been running for longer than
+        ``stale_after`` seconds are assumed to have been interrupted and are
+        reset to queued. Requires an application context.
+
+        Args:
+            stale_after: Seconds after which a running job counts as abandoned.
+
+        Returns:
+            Number of jobs enqueued.
+        """
+        cutoff = datetime.utcnow() - timedelta(seconds=stale_after)
+        db.session.execute(
+            update(ExtractionJob)
+            .where(
+                ExtractionJob.backend == self.backend,
+                ExtractionJob.status == 'running',
+                ExtractionJob.started_at < cutoff
+            )
+            .values(status='queued', started_at=None)
+        )
+        db.session.commit()
+        return self._enqueue_pending()
+
+    def _enqueue_pending(self) -> int:
+        """Enqueue queued jobs from the job table that are not in the scheduler yet.
+
+        Returns:
+            Number of jobs enqueued.
+        """
+        with self._lock:
+            self._deferred = False
+            in_flight = set(self._in_flight)
+        pending = ExtractionJob.query.filter_by(
+            backend=self.backend, status='queued'
+        ).options(
+            db.joinedload(ExtractionJob.pdf_document)
+        ).order_by(ExtractionJob.enqueued_at.asc()).all()
+        now = datetime.utcnow()
+        # Admit the jobs the scheduler would run first, not the oldest
+        candidates = [
+            (job, job.tenant,
+             estimate_cost(job.pdf_document.page_count, job.pdf_document.file_size),
+             max(0.0, (now - job.enqueued_at).total_seconds()))
+            for job in pending if job.id not in in_flight
+        ]
+        enqueued = 0
+        for job in self._queue.admission_order(candidates):
+            try:
+                self._enqueue(job)
+            except JobQueueFull:
+                break
+            enqueued += 1
+        return enqueued
+
+    def queue_depth(self) -> int:
+        """Number of jobs waiting for a worker thread."""
+        return self._queue.qsize()
+
+    def join(self):
+        """Block until every enqueued job has been processed."""
+        self._queue.join()
+
+    def shutdown(self):
+        """Stop the worker threads once the queued jobs finish.
+
+        Jobs submitted afterwards stay queued in the job table.
+        """
+        with self._lock:
+            self._queue.close()
+            self._threads = []
+
+
+class CeleryDispatcher(JobDispatcher):
+    """Runs extraction jobs as Celery tasks on a configured broker."""
+
+    backend = 'celery'
+
+    def __init__(self, app, pdf_handler, broker_url, result_backend=None):
+        """Initialize the Celery dispatcher.
+
+        The Celery application and its extraction task are created on first
+        use, so processes that never dispatch a job do not import Celery.
+
+        Args:
+            app: Flask application.
+            pdf_handler: PDFHandler that performs the extraction.
+            broker_url: Celery broker URL.
+            result_backend: Optional Celery result backend URL.
+        """
+        super().__init__(app, pdf_handler)
+        self.broker_url = broker_url
+        self.result_backend = result_backend
+        self._celery = None
+        self._lock = threading.Lock()
+
+    @property
+    def celery(self):
+        """The Celery application, with the extraction task registered."""
+        with self._lock:
+            if self._celery is None:
+                self._celery = self._create_celery()
+        return self._celery
+
+    @property
+    def extract_task(self):
+        """The registered extraction task."""
+        return self.celery.tasks['pdf_tasks.extract_text']
+
+    def _create_celery(self):
+        from celery import Celery, Task
+
+        flask_app = self.app
+
+        class FlaskTask(Task):
+            def __call__(self, *args, **kwargs):
+                with flask_app.app_context():
+                    return self.run(*args, **kwargs)
+
+        celery = Celery(
+            'pdf_tasks', broker=self.broker_url, backend=self.result_backend,
+            task_cls=FlaskTask
+        )
+        dispatcher = self
+
+        @celery.task(bind=True, name='pdf_tasks.extract_text')
+        def extract_text(task, job_id):
+            result = dispatcher.run_job(
+                job_id,
+                on_progress=lambda current, total: task.update_state(
+                    state='PROGRESS',
+                    meta={'current': current, 'total': total}
+                )
+            )
+            # The result backend gets the summary; the text is in the database
+            if result:
+                result.pop('text', None)
+            return result
+
+        self.app.extensions['celery'] = celery
+        return celery
+
+    def _enqueue(self, job):
+        result = self.extract_task.delay(str(job.id))
+        job.task_id = result.id
+        db.session.commit()
+
+
+def create_dispatcher(app, pdf_handler) -> JobDispatcher:
+    """Create the job dispatcher configured for an application.
+
+    Args:
+        app: Flask application.
+        pdf_handler: PDFHandler that performs the extraction.
+
+    Returns:
+        A CeleryDispatcher if CELERY_BROKER_URL is set, else a LocalDispatcher.
+    """
+    config = app.config
+    broker_url = config.get('CELERY_BROKER_URL')
+    if broker_url:
+        return CeleryDispatcher(
+            app, pdf_handler, broker_url, config.get('CELERY_RESULT_BACKEND')
+        )
+    return LocalDispatcher(
+        app,
+        pdf_handler,
+        workers=config.get('EXTRACTION_LOCAL_WORKERS', 2),
+        max_queue=config.get('EXTRACTION_QUEUE_SIZE', 100),
+        fast_lane_workers=config.get('EXTRACTION_FAST_LANE_WORKERS', 1),
+        fast_lane_pages=config.get('EXTRACTION_FAST_LANE_PAGES', 10),
+        aging_seconds=config.get('EXTRACTION_AGING_SECONDS', 30.0)
+    )
@@ -0,0 +1,259 @@
+"""
+Write-behind persistence of chat messages.
+
+With MESSAGE_WRITE_BEHIND enabled, ChatbotService hands the rows of each
+exchange to a MessageWriter instead of committing them itself, so answer
+latency no longer includes the database round trip. A background thread
+drains the buffer with one multi-row INSERT per batch, as soon as
+MESSAGE_BATCH_SIZE rows are pending or MESSAGE_FLUSH_INTERVAL_MS after the
+first pending row. The buffer is bounded: when it is full, writers block
+for up to MESSAGE_BUFFER_TIMEOUT seconds and then fail, and everything
+still buffered is flushed when the process shuts down.
+
+Batches are made of whole writes, so a reply is never committed without
+the question its parent_message_id points to. A batch that keeps failing
+is retried one write at a time before anything is dropped, so a single
+bad row only loses the exchanges written with it.
+
+Messages become visible in the history once their batch commits, so a
+client may briefly not see an answer it has just received.
+"""
+import threading
+import time
+from typing import Dict, List, Optional
+from sqlalchemy import insert
+from metrics import MESSAGE_FLUSH_SECONDS
+from models import db, ChatMessage
+
+
+class MessageBufferFull(Exception):
+    """Raised when the write-behind buffer stays full past the timeout."""
+
+
+class MessageWriter:
+    """Bounded buffer of chat message rows flushed in batches by a thread."""
+
+    MAX_ATTEMPTS = 3  # Flush attempts before a batch is split up or dropped
+
+    def __init__(self, app, batch_size=100, flush_interval=0.05,
+                 max_pending=10000, put_timeout=5.0):
+        """Initialize the writer. The flush thread starts on the first write.
+
+        Args:
+            app: Flask application used for the application context of flushes.
+            batch_size: Rows per INSERT; a full batch is flushed immediately.
+                A single write larger than this is flushed as one batch.
+            flush_interval: Seconds a row may wait for its batch to fill up.
+            max_pending: Maximum number of buffered rows.
+            put_timeout: Seconds write() blocks while the buffer is full.
+        """
+        self.app = app
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max(max_pending, batch_size)
+        self.put_timeout = put_timeout
+
+        self._pending = []  # Row groups, one per write()
+        self._pending_rows = 0
+        self._in_flight = 0
+        self._closed = False
+        self._flush_waiters = 0
+        self._thread = None
+        self._condition = threading.Condition()
+
+        self.flushes = 0
+        self.rows_written = 0
+        self.rows_dropped = 0
+        self.flush_seconds_total = 0.0
+        self.flush_seconds_max = 0.0
+        self.last_flush_seconds = None
+
+    def write(self, rows: List[Dict]) -> None:
+        """Buffer the rows of one or more exchanges; they are flushed together.
+
+        Args:
+            rows: Column values of each ChatMessage, with IDs and timestamps
+                set. Rows that reference each other must be written together.
+
+        Raises:
+            MessageBufferFull: If the buffer has no room within put_timeout.
+            RuntimeError: If the writer has been closed.
+        """
+        deadline = time.monotonic() + self.put_timeout
+        with self._condition:
+            while self._pending_rows + len(rows) > self.max_pending and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise MessageBufferFull(
+                        f"Chat message buffer is full ({self.max_pending} messages)"
+                    )
+                self._condition.wait(remaining)
+            if self._closed:
+                raise RuntimeError("Message writer is closed")
+
+            self._pending.append(list(rows))
+            self._pending_rows += len(rows)
+            self._start()
+            self._condition.notify_all()
+
+    def flush(self, timeout=None) -> bool:
+        """Block until every buffered row has been flushed.
+
+        Returns:
+            True if the buffer drained within the timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            # Partial batches are flushed without waiting while anyone waits here
+            self._flush_waiters += 1
+            self._condition.notify_all()
+            try:
+                while self._pending or self._in_flight:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    self._condition.wait(remaining)
+            finally:
+                self._flush_waiters -= 1
+        return True
+
+    def close(self) -> None:
+        """Flush everything still buffered and stop the flush thread."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+        elif self._pending:
+            self._flush_batch(self._pending)
+            self._pending = []
+            self._pending_rows = 0
+
+    def stats(self) -> Dict:
+        """Return buffer depth and flush counters, including flush latency."""
+        with self._condition:
+            return {
+                'pending': self._pending_rows + self._in_flight,
+                'flushes': self.flushes,
+                'rows_written': self.rows_written,
+                'rows_dropped': self.rows_dropped,
+                'flush_seconds_avg': (
+                    self.flush_seconds_total / self.flushes if self.flushes else None
+                ),
+                'flush_seconds_max': self.flush_seconds_max,
+                'last_flush_seconds': self.last_flush_seconds
+            }
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name='chat-message-writer', daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if not self._pending:
+                    return
+
+                # Give the batch until the interval elapses to fill up
+                deadline = time.monotonic() + self.flush_interval
+                while (self._pending_rows < self.batch_size
+                       and not self._closed and not self._flush_waiters):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+
+                # Take whole writes, at least one, up to batch_size rows
+                batch, rows = [], 0
+                while self._pending and (
+                        not batch or rows + len(self._pending[0]) <= self.batch_size):
+                    group = self._pending.pop(0)
+                    batch.append(group)
+                    rows += len(group)
+                self._pending_rows -= rows
+                self._in_flight = rows
+                # Wake writers waiting for room
+                self._condition.notify_all()
+
+            self._flush_batch(batch)
+
+            with self._condition:
+                self._in_flight = 0
+                self._condition.notify_all()
+
+    def _flush_batch(self, batch: List[List[Dict]]) -> None:
+        started = time.perf_counter()
+        with self.app.app_context():
+            try:
+                rows = [row for group in batch for row in group]
+                error = self._insert(rows, self.MAX_ATTEMPTS)
+                written = len(rows) if error is None else 0
+                if error is not None:
+                    # Retry one write at a time so only the bad ones are dropped
+                    for group in batch:
+                        if len(batch) > 1:
+                            error = self._insert(group, 1)
+                        if error is None:
+                            written += len(group)
+                            continue
+                        self.app.logger.error(
+                            f"Dropping {len(group)} chat messages after "
+                            f"failed flushes: {str(error)}"
+                        )
+                        with self._condition:
+                            self.rows_dropped += len(group)
+            finally:
+                db.session.remove()
+
+        elapsed = time.perf_counter() - started
+        MESSAGE_FLUSH_SECONDS.observe(elapsed)
+        with self._condition:
+            self.flushes += 1
+            self.rows_written += written
+            self.flush_seconds_total += elapsed
+            self.flush_seconds_max = max(self.flush_seconds_max, elapsed)
+            self.last_flush_seconds = elapsed
+
+    def _insert(self, rows: List[Dict], attempts: int) -> Optional[Exception]:
+        """Insert rows in one transaction, retrying transient failures.
+
+        Returns:
+            None on success, otherwise the error of the last attempt.
+        """
+        for attempt in range(1, attempts + 1):
+            try:
+                db.session.execute(insert(ChatMessage.__table__), rows)
+                db.session.commit()
+                return None
+            except Exception as e:
+                db.session.rollback()
+                if attempt == attempts:
+                    return e
+                time.sleep(0.05 * attempt)
+
+
+def create_message_writer(app):
+    """Create the write-behind writer if MESSAGE_WRITE_BEHIND is enabled.
+
+    Args:
+        app: Flask application.
+
+    Returns:
+        A MessageWriter, or None when messages are committed synchronously.
+    """
+    config = app.config
+    if not config.get('MESSAGE_WRITE_BEHIND'):
+        return None
+    return MessageWriter(
+        app,
+        batch_size=config.get('MESSAGE_BATCH_SIZE', 100),
+        flush_interval=config.get('MESSAGE_FLUSH_INTERVAL_MS', 50) / 1000,
+        max_pending=config.get('MESSAGE_BUFFER_SIZE', 10000),
+        put_timeout=config.get('MESSAGE_BUFFER_TIMEOUT', 5.0)
+    )
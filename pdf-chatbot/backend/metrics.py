@@ -0,0 +1,231 @@
+"""
+Latency histograms and gauges exposed in the Prometheus text format.
+
+Histograms are recorded on the hot paths of uploads, extraction, chat and
+history queries, so observing must stay cheap enough to leave on in
+production. Each thread therefore counts into its own shard, which only
+that thread ever writes, and nothing is locked per observation; a scrape
+sums the shards. Shards of finished threads are folded into one retired
+shard, so thread-per-request servers do not grow the shard list.
+
+Gauges are read when ``/metrics`` is scraped, from callables supplied by
+the application (connection pool, queue depths).
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Upper bounds in seconds, from sub-millisecond lookups to slow extractions
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0
+)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str]) -> str:
+    pairs = [
+        '{}="{}"'.format(
+            name, str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+        )
+        for name, value in zip(names, values)
+    ]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Histogram:
+    """Cumulative histogram with optional labels and per-thread shards."""
+
+    def __init__(self, name: str, documentation: str,
+                 labelnames: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        """Initialize the histogram.
+
+        Args:
+            name: Metric name, ending in the unit (``_seconds``).
+            documentation: HELP text.
+            labelnames: Names of the labels passed to observe().
+            buckets: Increasing bucket upper bounds; +Inf is implied.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._local = threading.local()
+        self._shards = []  # (thread, {label values: [bucket counts..., +Inf count, sum]})
+        self._retired = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labelvalues: str) -> None:
+        """Record one observation.
+
+        Args:
+            value: Observed value, in seconds for latency histograms.
+            *labelvalues: One value per label name, in order.
+        """
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._new_shard()
+        counts = shard.get(labelvalues)
+        if counts is None:
+            counts = shard[labelvalues] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    @contextmanager
+    def time(self, *labelvalues: str):
+        """Observe the wall-clock duration of the ``with`` block."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labelvalues)
+
+    def collect(self) -> Dict[Tuple[str, ...], List]:
+        """Sum the shards into per-label counts (non-cumulative) and sums."""
+        with self._lock:
+            self._retire_finished()
+            shards = [self._retired] + [shard for _, shard in self._shards]
+            totals = {}
+            for shard in shards:
+                for labelvalues, counts in list(shard.items()):
+                    total = totals.setdefault(labelvalues, [0] * len(counts[:-1]) + [0.0])
+                    for position, count in enumerate(list(counts)):
+                        total[position] += count
+        return totals
+
+    def render(self) -> List[str]:
+        """Return the metric in the Prometheus text format."""
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram"
+        ]
+        bounds = self.buckets + (float('inf'),)
+        for labelvalues, counts in sorted(self.collect().items()):
+            cumulative = 0
+            for bound, count in zip(bounds, counts[:-1]):
+                cumulative += count
+                labels = _format_labels(
+                    self.labelnames + ('le',), labelvalues + (_format_value(bound),)
+                )
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, labelvalues)
+            lines.append(f"{self.name}_sum{labels} {_format_value(counts[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+    def _new_shard(self) -> Dict:
+        shard = {}
+        with self._lock:
+            self._retire_finished()
+            self._shards.append((threading.current_thread(), shard))
+        self._local.shard = shard
+        return shard
+
+    def _retire_finished(self):
+        # A finished thread can no longer write to its shard, so it is safe to fold
+        alive = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                alive.append((thread, shard))
+                continue
+            for labelvalues, counts in shard.items():
+                retired = self._retired.setdefault(labelvalues, [0] * (len(counts) - 1) + [0.0])
+                for position, count in enumerate(counts):
+                    retired[position] += count
+        self._shards = alive
+
+
+class Gauge:
+    """Gauge whose value is read from a callable at scrape time."""
+
+    def __init__(self, name: str, documentation: str, read: Callable[[], Optional[float]]):
+        """Initialize the gauge.
+
+        Args:
+            name: Metric name.
+            documentation: HELP text.
+            read: Returns the current value, or None if it is unavailable.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.read = read
+
+    def render(self) -> List[str]:
+        """Return the metric in the Prometheus text format."""
+        try:
+            value = self.read()
+        except Exception:
+            value = None
+        if value is None:
+            return []
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} gauge",
+            f"{self.name} {_format_value(value)}"
+        ]
+
+
+UPLOAD_SECONDS = Histogram(
+    'pdf_upload_seconds',
+    'Time spent in each phase of a PDF upload.',
+    ('phase',)
+)
+EXTRACTION_SECONDS = Histogram(
+    'pdf_extraction_seconds',
+    'Total time to extract, store and index the text of a PDF.'
+)
+EXTRACTION_PAGE_SECONDS = Histogram(
+    'pdf_extraction_page_seconds',
+    'Time to extract the text of one PDF page.'
+)
+CHAT_SECONDS = Histogram(
+    'chat_message_seconds',
+    'Time spent in each phase of answering a chat message.',
+    ('phase',)
+)
+EXTRACTION_QUEUE_SECONDS = Histogram(
+    'extraction_queue_wait_seconds',
+    'Time an extraction job waited in the local scheduler, by lane.',
+    ('lane',),
+    buckets=(0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0, 3600.0)
+)
+EXTRACTION_OVERTAKEN_JOBS = Histogram(
+    'extraction_scheduler_overtaken_jobs',
+    'Older queued jobs that each dispatched extraction job was started ahead of, by lane.',
+    ('lane',),
+    buckets=(0, 1, 2, 5, 10, 25, 50, 100)
+)
+HISTORY_SECONDS = Histogram(
+    'chat_history_seconds',
+    'Time to load chat history, by query.',
+    ('query',)
+)
+MESSAGE_FLUSH_SECONDS = Histogram(
+    'chat_message_flush_seconds',
+    'Time to flush one batch of write-behind chat messages.'
+)
+
+HISTOGRAMS = (
+    UPLOAD_SECONDS, EXTRACTION_SECONDS, EXTRACTION_PAGE_SECONDS,
+    EXTRACTION_QUEUE_SECONDS, EXTRACTION_OVERTAKEN_JOBS,
+    CHAT_SECONDS, HISTORY_SECONDS, MESSAGE_FLUSH_SECONDS
+)
+
+
+def render(gauges: Iterable[Gauge] = ()) -> str:
+    """Render every histogram and the given gauges as a Prometheus exposition."""
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render())
+    for gauge in gauges:
+        lines.extend(gauge.render())
+    return '\n'.join(lines) + '\n'
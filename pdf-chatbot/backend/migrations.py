@@ -0,0 +1,258 @@
+"""
+Versioned schema migrations.
+
+Each migration is a function of a SQLAlchemy connection registered under an
+increasing version number. Applied versions are recorded in the
+``schema_migrations`` table, so ``upgrade`` only runs what a database is
+missing. Databases created by the former ``db.create_all()`` call are
+brought up to date by the same path: the baseline migration only creates
+tables that do not exist yet, and later migrations only add what is missing.
+
+The baseline tables are frozen copies of the schema as it was, not the
+current models, so that every database walks the same history.
+
+Run ``flask --app app schema upgrade`` to migrate a database and
+``flask --app app schema current`` to show its version.
+"""
+from datetime import datetime
+from typing import Callable, List, NamedTuple
+import click
+from sqlalchemy import (
+    Column, DateTime, Float, ForeignKey, Index, Integer, MetaData, String, Table, Text,
+    UniqueConstraint, inspect, select
+)
+from sqlalchemy.dialects.postgresql import UUID
+from models import db, ExtractionJob, PDFDocument
+
+_metadata = MetaData()
+schema_migrations = Table(
+    'schema_migrations', _metadata,
+    Column('version', Integer, primary_key=True),
+    Column('description', String(255), nullable=False),
+    Column('applied_at', DateTime, nullable=False)
+)
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    apply: Callable
+    transactional: bool = True
+
+
+MIGRATIONS: List[Migration] = []
+
+
+def migration(version: int, description: str, transactional: bool = True):
+    """Register a migration function under a version number."""
+    def register(apply):
+        MIGRATIONS.append(Migration(version, description, apply, transactional))
+        MIGRATIONS.sort(key=lambda m: m.version)
+        return apply
+    return register
+
+
+# Tables of the baseline: pdf_documents and chat_messages as created by the
+# former db.create_all(), and pdf_pages and extraction_jobs as they were
+# introduced. Later columns and indexes are added by their own migrations.
+_baseline_metadata = MetaData()
+Table(
+    'pdf_documents', _baseline_metadata,
+    Column('id', UUID(as_uuid=True), primary_key=True),
+    Column('filename', String(255), nullable=False),
+    Column('file_path', String(512), nullable=False),
+    Column('file_size', Integer, nullable=False),
+    Column('upload_date', DateTime, nullable=False),
+    Column('last_accessed', DateTime, nullable=True),
+    Column('title', String(255), nullable=True),
+    Column('author', String(255), nullable=True),
+    Column('page_count', Integer, nullable=True),
+    Column('extracted_text', Text, nullable=True),
+    Column('processing_status', String(20)),
+    Column('processing_date', DateTime, nullable=True),
+    Column('processing_error', Text, nullable=True),
+    Column('processing_progress', Float)
+)
+Table(
+    'chat_messages', _baseline_metadata,
+    Column('id', UUID(as_uuid=True), primary_key=True),
+    Column('pdf_document_id', UUID(as_uuid=True), ForeignKey('pdf_documents.id'), nullable=False),
+    Column('message_type', String(10), nullable=False),
+    Column('content', Text, nullable=False),
+    Column('timestamp', DateTime, nullable=False),
+    Column('conversation_id', UUID(as_uuid=True), nullable=False),
+    Column('parent_message_id', UUID(as_uuid=True), ForeignKey('chat_messages.id'), nullable=True),
+    Column('response_time', Float, nullable=True),
+    Column('tokens_used', Integer, nullable=True)
+)
+Table(
+    'pdf_pages', _baseline_metadata,
+    Column('id', Integer, primary_key=True),
+    Column('pdf_document_id', UUID(as_uuid=True), ForeignKey('pdf_documents.id'), nullable=False),
+    Column('page_number', Integer, nullable=False),
+    Column('text', Text, nullable=False),
+    Column('char_start', Integer, nullable=False),
+    Column('char_end', Integer, nullable=False),
+    UniqueConstraint('pdf_document_id', 'page_number', name='uq_pdf_pages_document_page')
+)
+Table(
+    'extraction_jobs', _baseline_metadata,
+    Column('id', UUID(as_uuid=True), primary_key=True),
+    Column('pdf_document_id', UUID(as_uuid=True), ForeignKey('pdf_documents.id'),
+           nullable=False, index=True),
+    Column('backend', String(20), nullable=False),
+    Column('status', String(20), nullable=False, index=True),
+    Column('task_id', String(255), nullable=True),
+    Column('enqueued_at', DateTime, nullable=False),
+    Column('started_at', DateTime, nullable=True),
+    Column('finished_at', DateTime, nullable=True),
+    Column('error', Text, nullable=True)
+)
+
+# Indexes added by later migrations, frozen as they were introduced. They
+# are defined on stand-in tables holding just the indexed columns, so that
+# they are not created along with the baseline tables.
+_index_metadata = MetaData()
+_chat_messages = Table(
+    'chat_messages', _index_metadata,
+    Column('id', UUID(as_uuid=True)),
+    Column('pdf_document_id', UUID(as_uuid=True)),
+    Column('timestamp', DateTime),
+    Column('conversation_id', UUID(as_uuid=True)),
+    Column('parent_message_id', UUID(as_uuid=True))
+)
+_pdf_documents = Table(
+    'pdf_documents', _index_metadata,
+    Column('content_hash', String(64))
+)
+_CHAT_MESSAGE_INDEXES = (
+    Index(
+        'ix_chat_messages_history',
+        _chat_messages.c.pdf_document_id, _chat_messages.c.conversation_id,
+        _chat_messages.c.timestamp, _chat_messages.c.id
+    ),
+    Index(
+        'ix_chat_messages_conversation',
+        _chat_messages.c.conversation_id, _chat_messages.c.timestamp
+    ),
+    Index('ix_chat_messages_parent', _chat_messages.c.parent_message_id)
+)
+_CONTENT_HASH_INDEX = Index('ix_pdf_documents_content_hash', _pdf_documents.c.content_hash)
+
+
+def _add_column_if_missing(connection, column) -> None:
+    """Add a model column to its existing table unless it is already there."""
+    table = column.table
+    existing = {info['name'] for info in inspect(connection).get_columns(table.name)}
+    if column.name not in existing:
+        connection.exec_driver_sql(
+            f"ALTER TABLE {table.name} ADD COLUMN {column.name} "
+            f"{column.type.compile(connection.dialect)}"
+        )
+
+
+@migration(1, "Baseline schema")
+def _baseline(connection):
+    for table in _baseline_metadata.sorted_tables:
+        table.create(connection, checkfirst=True)
+
+
+@migration(2, "Composite indexes for chat_messages access paths", transactional=False)
+def _chat_message_indexes(connection):
+    # PostgreSQL builds the indexes without blocking writes to the table,
+    # which requires running outside a transaction
+    concurrently = connection.dialect.name == 'postgresql'
+    for index in _CHAT_MESSAGE_INDEXES:
+        if concurrently:
+            columns = ', '.join(column.name for column in index.columns)
+            connection.exec_driver_sql(
+                f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index.name} "
+                f"ON {index.table.name} ({columns})"
+            )
+        else:
+            index.create(connection, checkfirst=True)
+
+
+@migration(3, "Tenant of extraction jobs")
+def _extraction_job_tenant(connection):
+    # Databases migrated before the baseline was frozen already have the column
+    _add_column_if_missing(connection, ExtractionJob.__table__.c.tenant)
+
+
+@migration(4, "Content hash of documents")
+def _document_content_hash(connection):
+    # Databases created by db.create_all() before uploads were content-addressed
+    # lack the column; those migrated before the baseline was frozen have it
+    _add_column_if_missing(connection, PDFDocument.__table__.c.content_hash)
+    _CONTENT_HASH_INDEX.create(connection, checkfirst=True)
+
+
+@migration(5, "Pages skipped by the extraction sandbox")
+def _document_skipped_pages(connection):
+    _add_column_if_missing(connection, PDFDocument.__table__.c.skipped_pages)
+
+
+def current_version(engine) -> int:
+    """Return the highest applied migration version, 0 for a new database."""
+    with engine.connect() as connection:
+        schema_migrations.create(connection, checkfirst=True)
+        connection.commit()
+        version = connection.execute(
+            select(db.func.max(schema_migrations.c.version))
+        ).scalar()
+    return version or 0
+
+
+def upgrade(engine, target: int = None) -> List[int]:
+    """Apply pending migrations in version order.
+
+    Args:
+        engine: SQLAlchemy engine of the database to migrate.
+        target: Highest version to apply; defaults to the latest.
+
+    Returns:
+        Versions that were applied.
+    """
+    applied = []
+    version = current_version(engine)
+    for pending in MIGRATIONS:
+        if pending.version <= version or (target is not None and pending.version > target):
+            continue
+        if pending.transactional:
+            with engine.begin() as connection:
+                pending.apply(connection)
+                _record(connection, pending)
+        else:
+            with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+                pending.apply(connection)
+                _record(connection, pending)
+        applied.append(pending.version)
+    return applied
+
+
+def _record(connection, applied: Migration):
+    connection.execute(schema_migrations.insert().values(
+        version=applied.version,
+        description=applied.description,
+        applied_at=datetime.utcnow()
+    ))
+
+
+def register_commands(app):
+    """Register the ``flask schema`` command group on an application."""
+
+    @app.cli.group('schema')
+    def schema():
+        """Manage the database schema."""
+
+    @schema.command('upgrade')
+    @click.option('--target', type=int, default=None, help='Version to migrate to.')
+    def upgrade_command(target):
+        """Apply pending schema migrations."""
+        applied = upgrade(db.engine, target)
+        click.echo(f"Applied migrations: {applied}" if applied else "Schema is up to date")
+
+    @schema.command('current')
+    def current_command():
+        """Show the schema version of the database."""
+        click.echo(current_version(db.engine))
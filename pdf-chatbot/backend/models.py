@@ -14,6 +14,7 @@ class PDFDocument(db.Model):
     filename = db.Column(db.String(255), nullable=False)
     file_path = db.Column(db.String(512), nullable=False)
     file_size = db.Column(db.Integer, nullable=False)  # Size in bytes
+    content_hash = db.Column(db.String(64), nullable=True, index=True)  # SHA-256 of the file
     upload_date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     last_accessed = db.Column(db.DateTime, nullable=True)
     
@@ -22,23 +23,100 @@ class PDFDocument(db.Model):
     author = db.Column(db.String(255), nullable=True)
     page_count = db.Column(db.Integer, nullable=True)
     
-    # Text extraction and processing
-    extracted_text = db.Column(db.Text, nullable=True)
+    # Text extraction and processing. The full text is deferred so that
+    # loading a document row does not pull it; readers should use pages.
+    # Documents extracted in streaming mode only store pages.
+    extracted_text = db.deferred(db.Column(db.Text, nullable=True))
     processing_status = db.Column(db.String(20), default='pending')  # pending, processing, completed, failed
     processing_date = db.Column(db.DateTime, nullable=True)
     processing_error = db.Column(db.Text, nullable=True)
     processing_progress = db.Column(db.Float, default=0.0)  # Progress percentage
+    skipped_pages = db.Column(db.JSON, nullable=True)  # [{"page", "reason"}] skipped by the sandbox
     
     # Relationships
     chat_messages = db.relationship('ChatMessage', back_populates='pdf_document', cascade='all, delete-orphan')
+    pages = db.relationship(
+        'PDFPage',
+        back_populates='pdf_document',
+        cascade='all, delete-orphan',
+        lazy='dynamic',
+        order_by='PDFPage.page_number'
+    )
 
     def __repr__(self):
         return f'<PDFDocument {self.filename}>'
 
+# PUBLIC_INTERFACE
+class PDFPage(db.Model):
+    """Model for storing the extracted text of a single PDF page."""
+    __tablename__ = 'pdf_pages'
+    __table_args__ = (
+        db.UniqueConstraint('pdf_document_id', 'page_number', name='uq_pdf_pages_document_page'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    pdf_document_id = db.Column(UUID(as_uuid=True), db.ForeignKey('pdf_documents.id'), nullable=False)
+    page_number = db.Column(db.Integer, nullable=False)  # 1-based
+    text = db.Column(db.Text, nullable=False, default='')
+    
+    # Character offsets of this page within the full document text
+    char_start = db.Column(db.Integer, nullable=False)
+    char_end = db.Column(db.Integer, nullable=False)
+    
+    # Relationships
+    pdf_document = db.relationship('PDFDocument', back_populates='pages')
+
+    PAGE_SEPARATOR = "\n\n"
+
+    @classmethod
+    def rows_for(cls, pdf_document_id, page_texts, first_page=1, char_start=0):
+        """Build insert rows for a document's pages, computing char offsets.
+        
+        Offsets match the document text produced by joining the pages with
+        PAGE_SEPARATOR. A document can be stored in batches by passing the
+        number of the batch's first page and the offset at which it starts.
+        
+        Args:
+            pdf_document_id: ID of the owning PDFDocument
+            page_texts: Iterable of page texts in page order
+            first_page: Page number of the first text
+            char_start: Offset of the first text within the document text
+            
+        Returns:
+            list: Dictionaries suitable for a bulk insert
+        """
+        rows = []
+        offset = char_start
+        for page_number, text in enumerate(page_texts, start=first_page):
+            text = text or ''
+            rows.append({
+                'pdf_document_id': pdf_document_id,
+                'page_number': page_number,
+                'text': text,
+                'char_start': offset,
+                'char_end': offset + len(text)
+            })
+            offset += len(text) + len(cls.PAGE_SEPARATOR)
+        return rows
+
+    def __repr__(self):
+        return f'<PDFPage {self.pdf_document_id}:{self.page_number}>'
+
 # PUBLIC_INTERFACE
 class ChatMessage(db.Model):
     """Model for storing chat messages and their relationships with PDF documents."""
     __tablename__ = 'chat_messages'
+    __table_args__ = (
+        # History: one conversation about a document in (timestamp, id) order
+        db.Index(
+            'ix_chat_messages_history',
+            'pdf_document_id', 'conversation_id', 'timestamp', 'id'
+        ),
+        # Conversations across documents, newest activity first
+        db.Index('ix_chat_messages_conversation', 'conversation_id', 'timestamp'),
+        # Threads: replies to a message
+        db.Index('ix_chat_messages_parent', 'parent_message_id'),
+    )
 
     id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     pdf_document_id = db.Column(UUID(as_uuid=True), db.ForeignKey('pdf_documents.id'), nullable=False)
@@ -64,3 +142,34 @@ class ChatMessage(db.Model):
 
     def __repr__(self):
         return f'<ChatMessage {self.id}: {self.message_type}>'
+
+# PUBLIC_INTERFACE
+class ExtractionJob(db.Model):
+    """Model for tracking text extraction jobs, whichever backend runs them."""
+    __tablename__ = 'extraction_jobs'
+
+    id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    pdf_document_id = db.Column(UUID(as_uuid=True), db.ForeignKey('pdf_documents.id'), nullable=False, index=True)
+    backend = db.Column(db.String(20), nullable=False)  # 'celery' or 'local'
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True)  # queued, running, completed, failed
+    task_id = db.Column(db.String(255), nullable=True)  # Celery task ID, if any
+    tenant = db.Column(db.String(64), nullable=True)  # Fairness key of the local scheduler
+    
+    # Timing, used to measure queue latency on both backends
+    enqueued_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    
+    # Relationships
+    pdf_document = db.relationship('PDFDocument')
+
+    @property
+    def queue_latency(self):
+        """Seconds spent waiting between enqueue and start, if started."""
+        if self.started_at is None:
+            return None
+        return (self.started_at - self.enqueued_at).total_seconds()
+
+    def __repr__(self):
+        return f'<ExtractionJob {self.id}: {self.status}>'
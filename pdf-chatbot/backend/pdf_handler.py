@@ -1,20 +1,273 @@
 import os
-import magic
+import hashlib
+import itertools
+import multiprocessing
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple, Optional
 from werkzeug.utils import secure_filename
 from datetime import datetime
-from models import PDFDocument, db
-from PyPDF2 import PdfReader
-from celery import Celery
-from celery.result import AsyncResult
+from flask import current_app
+from metrics import EXTRACTION_PAGE_SECONDS, EXTRACTION_SECONDS, UPLOAD_SECONDS
+from models import PDFDocument, PDFPage, db
+from retrieval import IncrementalIndex, index_path
+from sandbox import SandboxLimits, count_pages, extract_ranges, process_context
 
-# Initialize Celery
-celery = Celery('pdf_tasks', broker='redis://localhost:6379/0')
+# python-magic and PyPDF2 are imported where they are used, so that they stay
+# off the start-up path of processes that never validate or extract a file
+
+def _extract_reader_page(pdf_reader, page_num):
+    """Extract one page from an open PdfReader, or an error placeholder."""
+    started = time.perf_counter()
+    try:
+        text = pdf_reader.pages[page_num].extract_text()
+    except Exception as e:
+        text = f"[Error extracting page {page_num + 1}: {str(e)}]"
+    EXTRACTION_PAGE_SECONDS.observe(time.perf_counter() - started)
+    return text
+
+def _extract_reader_pages(pdf_reader, start, stop, on_page=None):
+    """Extract pages ``start`` to ``stop - 1`` from an open PdfReader."""
+    text_content = []
+    for page_num in range(start, stop):
+        if on_page:
+            on_page(page_num)
+        text_content.append(_extract_reader_page(pdf_reader, page_num))
+    return text_content
+
+def extract_page_range(file_path, start, stop):
+    """Extract the text of pages ``start`` to ``stop - 1`` of a PDF.
+    
+    Module-level so that it can be pickled into worker processes. Pages that
+    fail to extract are replaced by an error placeholder.
+    
+    Args:
+        file_path (str): Path to the PDF file
+        start (int): Index of the first page
+        stop (int): Index one past the last page
+        
+    Returns:
+        tuple: (start, list of page texts)
+    """
+    from PyPDF2 import PdfReader
+    
+    with open(file_path, 'rb') as file:
+        return start, _extract_reader_pages(PdfReader(file), start, stop)
+
+def _timed_page_range(file_path, start, stop):
+    """Run extract_page_range and also return its duration in seconds."""
+    started = time.perf_counter()
+    start, texts = extract_page_range(file_path, start, stop)
+    return start, texts, time.perf_counter() - started
+
+def _page_ranges(total_pages, workers, max_pages=None):
+    """Split pages into contiguous ranges, a few per worker for load balancing."""
+    size = max(1, -(-total_pages // (workers * 4)))
+    if max_pages:
+        size = min(size, max_pages)
+    return [(start, min(start + size, total_pages)) for start in range(0, total_pages, size)]
+
+def iter_pages(file_path, workers=1, parallel_min_pages=0, on_progress=None, range_pages=None,
+               sandbox=None, on_skip=None):
+    """Yield the text of every page of a PDF, in page order.
+    
+    Documents with at least ``parallel_min_pages`` pages are split into page
+    ranges that are extracted by a pool of ``workers`` processes. At most two
+    ranges per worker are in flight, so text extracted ahead of the consumer
+    stays bounded; ``range_pages`` caps the size of a range, and of the
+    stretch of pages read by one PdfReader when extracting sequentially. Smaller
+    documents, and callers that cannot start child processes (daemonic
+    processes such as Celery prefork children), are extracted sequentially.
+    
+    With ``sandbox`` limits every range is extracted in a child process with
+    per-page and per-document time budgets and a memory ceiling (see
+    sandbox.py); pages that exceed them are skipped and get a placeholder.
+    
+    Args:
+        file_path (str): Path to the PDF file
+        workers (int): Maximum number of extraction processes
+        parallel_min_pages (int): Minimum page count before fanning out
+        on_progress: Optional callable receiving (pages_done, total_pages)
+        range_pages (int): Optional maximum number of pages per range
+        sandbox (SandboxLimits): Optional budgets for sandboxed extraction
+        on_skip: Optional callable receiving (page_number, reason) for every
+            page skipped by the sandbox
+        
+    Yields:
+        tuple: (page_number, total_pages, text) with 1-based page numbers
+    """
+    from PyPDF2 import PdfReader
+    
+    report = on_progress or (lambda current, total: None)
+    can_fork = not multiprocessing.current_process().daemon
+    
+    if sandbox is not None and can_fork:
+        total_pages = count_pages(file_path, sandbox)
+        if workers > 1 and total_pages >= max(parallel_min_pages, 2):
+            ranges, concurrency = _page_ranges(total_pages, workers, range_pages), workers
+        else:
+            size = range_pages or total_pages or 1
+            ranges = [(start, min(start + size, total_pages))
+                      for start in range(0, total_pages, size)]
+            concurrency = 1
+        yield from extract_ranges(
+            file_path, total_pages, ranges, sandbox, concurrency,
+            on_progress=report, on_skip=on_skip
+        )
+        return
+    
+    with open(file_path, 'rb') as file:
+        pdf_reader = PdfReader(file)
+        total_pages = len(pdf_reader.pages)
+        
+        if workers <= 1 or total_pages < max(parallel_min_pages, 2) or not can_fork:
+            for page_num in range(total_pages):
+                if range_pages and page_num and page_num % range_pages == 0:
+                    # PdfReader caches every object it parses; a fresh reader
+                    # per range keeps that cache from growing with the document
+                    pdf_reader = PdfReader(file)
+                report(page_num + 1, total_pages)
+                yield page_num + 1, total_pages, _extract_reader_page(pdf_reader, page_num)
+            return
+    
+    page_ranges = _page_ranges(total_pages, workers, range_pages)
+    ranges = iter(page_ranges)
+    in_flight = deque()
+    # Workers are started from the fork server too: forking a process that
+    # runs threads (request handlers, job workers) can copy held locks
+    with ProcessPoolExecutor(max_workers=min(workers, len(page_ranges)),
+                             mp_context=process_context()) as executor:
+        for start, stop in itertools.islice(ranges, workers * 2):
+            in_flight.append(executor.submit(_timed_page_range, file_path, start, stop))
+        pages_done = 0
+        while in_flight:
+            start, texts, seconds = in_flight.popleft().result()
+            following = next(ranges, None)
+            if following:
+                in_flight.append(executor.submit(_timed_page_range, file_path, *following))
+            # Per-page timings recorded in the worker processes are lost with
+            # them, so each page counts the mean time of its range
+            for _ in texts:
+                EXTRACTION_PAGE_SECONDS.observe(seconds / len(texts))
+            pages_done += len(texts)
+            report(pages_done, total_pages)
+            for offset, text in enumerate(texts):
+                yield start + offset + 1, total_pages, text
+
+def extract_pages(file_path, workers=1, parallel_min_pages=0, on_progress=None,
+                  sandbox=None, on_skip=None):
+    """Extract the text of every page of a PDF, in page order.
+    
+    Collects iter_pages; see there for how the work is split and sandboxed.
+    
+    Args:
+        file_path (str): Path to the PDF file
+        workers (int): Maximum number of extraction processes
+        parallel_min_pages (int): Minimum page count before fanning out
+        on_progress: Optional callable receiving (pages_done, total_pages)
+        sandbox (SandboxLimits): Optional budgets for sandboxed extraction
+        on_skip: Optional callable receiving (page_number, reason)
+        
+    Returns:
+        tuple: (list of page texts, total_pages)
+    """
+    text_content = []
+    total_pages = 0
+    pages = iter_pages(
+        file_path, workers, parallel_min_pages, on_progress, sandbox=sandbox, on_skip=on_skip
+    )
+    for _, total_pages, text in pages:
+        text_content.append(text)
+    return text_content, total_pages
+
+def sandbox_limits(config):
+    """Build the extraction sandbox budgets from the application configuration.
+
+    Args:
+        config: Application configuration
+
+    Returns:
+        SandboxLimits, or None if EXTRACTION_SANDBOX is disabled
+    """
+    if not config.get('EXTRACTION_SANDBOX', True):
+        return None
+    memory_limit_mb = config.get('EXTRACTION_MEMORY_LIMIT_MB', 1024)
+    return SandboxLimits(
+        page_timeout=config.get('EXTRACTION_PAGE_TIMEOUT', 30.0),
+        document_timeout=config.get('EXTRACTION_DOCUMENT_TIMEOUT', 900.0),
+        memory_limit=memory_limit_mb * 2**20 if memory_limit_mb else None
+    )
+
+class PDFMetadata(NamedTuple):
+    """Document size and metadata read by prescan_pdf."""
+    page_count: Optional[int]
+    title: Optional[str]
+    author: Optional[str]
+
+def _info_string(info, key, max_length=255):
+    """Return a document information entry as a column-sized string, or None."""
+    value = info.get(key) if info else None
+    if value is None:
+        return None
+    value = str(value.get_object()).strip()
+    return value[:max_length] or None
+
+def prescan_pdf(file_path):
+    """Read the page count, title and author of a PDF without parsing pages.
+    
+    Opening the reader only loads the trailer and cross-reference table; the
+    page count is the /Count of the root page tree node and the metadata
+    comes from the document information dictionary, so the cost does not
+    grow with the number or content of the pages.
+    
+    Args:
+        file_path (str): Path to the PDF file
+        
+    Returns:
+        tuple: (PDFMetadata, error_message)
+    """
+    from PyPDF2 import PdfReader
+    
+    try:
+        with open(file_path, 'rb') as file:
+            pdf_reader = PdfReader(file)
+            if pdf_reader.is_encrypted:
+                return PDFMetadata(None, None, None), "PDF is encrypted"
+            
+            count = pdf_reader.trailer['/Root']['/Pages'].get('/Count')
+            count = count.get_object() if count is not None else None
+            page_count = int(count) if isinstance(count, int) and count >= 0 else None
+            
+            info = pdf_reader.trailer.get('/Info')
+            info = info.get_object() if info is not None else None
+            return PDFMetadata(
+                page_count, _info_string(info, '/Title'), _info_string(info, '/Author')
+            ), None
+    except Exception as e:
+        return PDFMetadata(None, None, None), f"Error reading PDF metadata: {str(e)}"
+
+class StagedUpload(NamedTuple):
+    """An upload that has been streamed to a temporary file and validated."""
+    temp_path: str
+    sha256: str
+    size: int
 
 class PDFHandler:
     """Handles PDF file operations including validation, storage, and text extraction."""
     
     ALLOWED_MIME_TYPES = ['application/pdf']
     MAX_FILE_SIZE = 50 * 1024 * 1024  # 50MB
+    CHUNK_SIZE = 64 * 1024  # Read size for streamed uploads
+    HEADER_SNIFF_SIZE = 2048  # Bytes handed to python-magic
+    
+    # Columns copied from an already-processed document with identical content;
+    # the extracted text and pages are copied inside the database
+    REUSABLE_FIELDS = (
+        'page_count', 'title', 'author',
+        'processing_status', 'processing_date', 'processing_progress'
+    )
     
     def __init__(self, upload_folder):
         """Initialize PDFHandler with upload folder path.
@@ -25,6 +278,7 @@ class PDFHandler:
         self.upload_folder = upload_folder
         os.makedirs(upload_folder, exist_ok=True)
     
+    @UPLOAD_SECONDS.time('validate')
     def validate_file(self, file):
         """Validate uploaded file.
         
@@ -44,10 +298,11 @@ class PDFHandler:
         file.seek(0)
         
         if size > self.MAX_FILE_SIZE:
-            return False, f"File too large. Maximum size is {self.MAX_FILE_SIZE // (1024*1024)}MB"
+            return False, self._too_large_message()
             
         # Check file type using python-magic
-        mime = magic.from_buffer(file.read(2048), mime=True)
+        import magic
+        mime = magic.from_buffer(file.read(self.HEADER_SNIFF_SIZE), mime=True)
         file.seek(0)
         
         if mime not in self.ALLOWED_MIME_TYPES:
@@ -55,6 +310,127 @@ class PDFHandler:
             
         return True, None
     
+    @UPLOAD_SECONDS.time('save')
+    def stage_stream(self, stream):
+        """Stream an upload to a temporary file in the upload folder.
+        
+        The stream is read once in CHUNK_SIZE pieces: the PDF header is sniffed
+        from the first bytes, the SHA-256 digest and byte count are computed as
+        the data is written, and reading stops as soon as MAX_FILE_SIZE is
+        exceeded. The temporary file is removed on any failure.
+        
+        Args:
+            stream: Readable binary stream, e.g. ``request.stream``
+            
+        Returns:
+            tuple: (StagedUpload, error_message)
+        """
+        fd, temp_path = tempfile.mkstemp(
+            prefix='.upload-', suffix='.part', dir=self.upload_folder
+        )
+        digest = hashlib.sha256()
+        size = 0
+        head = b''
+        sniffed = False
+        error = None
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                while True:
+                    chunk = stream.read(self.CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    
+                    size += len(chunk)
+                    if size > self.MAX_FILE_SIZE:
+                        error = self._too_large_message()
+                        break
+                    
+                    if not sniffed:
+                        head += chunk
+                        if len(head) >= self.HEADER_SNIFF_SIZE:
+                            sniffed = True
+                            error = self._check_header(head)
+                            if error:
+                                break
+                    
+                    digest.update(chunk)
+                    out.write(chunk)
+            
+            # Short uploads never fill the sniff buffer
+            if not error and not sniffed:
+                error = self._check_header(head)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        
+        if error:
+            os.remove(temp_path)
+            return None, error
+        
+        return StagedUpload(temp_path, digest.hexdigest(), size), None
+    
+    def _check_header(self, head):
+        """Return an error message if the leading bytes are not a PDF."""
+        import magic
+        mime = magic.from_buffer(head[:self.HEADER_SNIFF_SIZE], mime=True)
+        if mime not in self.ALLOWED_MIME_TYPES:
+            return "Invalid file type. Only PDF files are allowed"
+        return None
+    
+    def _too_large_message(self):
+        return f"File too large. Maximum size is {self.MAX_FILE_SIZE // (1024*1024)}MB"
+    
+    def _storage_path(self, content_hash):
+        """Build the content-addressed storage path for a SHA-256 digest."""
+        return os.path.join(self.upload_folder, content_hash[:2], f"{content_hash}.pdf")
+    
+    def find_by_hash(self, content_hash):
+        """Find an existing document with the given content hash.
+        
+        Documents whose extraction has completed are preferred, so that their
+        results can be reused.
+        
+        Args:
+            content_hash: SHA-256 hex digest of the file content
+            
+        Returns:
+            PDFDocument or None
+        """
+        completed_first = db.case((PDFDocument.processing_status == 'completed', 0), else_=1)
+        return PDFDocument.query.filter_by(content_hash=content_hash).order_by(
+            completed_first, PDFDocument.upload_date.asc()
+        ).first()
+    
+    def _reuse_extraction(self, source, pdf_doc):
+        """Copy completed extraction results from a document with identical content.
+        
+        The new document must already be flushed. Text and pages are copied
+        with INSERT ... SELECT / UPDATE statements so they never pass through
+        the application.
+        """
+        if source.processing_status != 'completed':
+            return
+        for field in self.REUSABLE_FIELDS:
+            setattr(pdf_doc, field, getattr(source, field))
+        
+        source_text = db.select(PDFDocument.extracted_text).where(
+            PDFDocument.id == source.id
+        ).scalar_subquery()
+        db.session.execute(
+            db.update(PDFDocument)
+            .where(PDFDocument.id == pdf_doc.id)
+            .values(extracted_text=source_text)
+        )
+        db.session.execute(
+            db.insert(PDFPage).from_select(
+                ['pdf_document_id', 'page_number', 'text', 'char_start', 'char_end'],
+                db.select(
+                    db.literal(pdf_doc.id, PDFPage.pdf_document_id.type),
+                    PDFPage.page_number, PDFPage.text, PDFPage.char_start, PDFPage.char_end
+                ).where(PDFPage.pdf_document_id == source.id)
+            )
+        )
+    
     def save_file(self, file):
         """Save uploaded file and create database record.
         
@@ -64,46 +440,118 @@ class PDFHandler:
         Returns:
             tuple: (PDFDocument, error_message)
         """
+        staged, error = self.stage_stream(file.stream)
+        if error:
+            return None, error
+        return self.save_staged(staged, file.filename)
+    
+    @UPLOAD_SECONDS.time('prescan')
+    def prescan(self, file_path):
+        """Read page count and metadata of a stored upload.
+        
+        A file whose metadata cannot be read is still accepted; its page count
+        is filled in by extraction, which reports any real problem.
+        
+        Args:
+            file_path (str): Path to the stored PDF
+            
+        Returns:
+            PDFMetadata: Page count, title and author, None where unknown
+        """
+        metadata, _ = prescan_pdf(file_path)
+        return metadata
+    
+    def save_staged(self, staged, filename):
+        """Move a staged upload into content-addressed storage and record it.
+        
+        If a file with the same content is already stored, the staged copy is
+        discarded and the existing blob is shared. Completed extraction results
+        of an identical document are reused by the new record. Page count,
+        title and author are read by a pre-scan (or copied from an identical
+        document) and recorded in the same transaction.
+        
+        The time spent is observed as the 'commit' upload phase, except for
+        the pre-scan, which is observed as its own phase.
+        
+        Args:
+            staged: StagedUpload returned by stage_stream
+            filename: Original filename supplied by the client
+            
+        Returns:
+            tuple: (PDFDocument, error_message)
+        """
+        started = time.perf_counter()
+        prescan_seconds = 0.0
+        file_path = self._storage_path(staged.sha256)
+        created_blob = False
         try:
-            # Secure the filename and generate storage path
-            filename = secure_filename(file.filename)
-            timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
-            unique_filename = f"{timestamp}_{filename}"
-            file_path = os.path.join(self.upload_folder, unique_filename)
+            filename = secure_filename(filename)
+            
+            if os.path.exists(file_path):
+                os.remove(staged.temp_path)
+            else:
+                os.makedirs(os.path.dirname(file_path), exist_ok=True)
+                # Atomic within the upload folder, so readers never see partial files
+                os.replace(staged.temp_path, file_path)
+                created_blob = True
             
-            # Save the file
-            file.save(file_path)
+            existing = self.find_by_hash(staged.sha256)
+            if existing and existing.page_count is not None:
+                metadata = PDFMetadata(existing.page_count, existing.title, existing.author)
+            else:
+                prescan_started = time.perf_counter()
+                metadata = self.prescan(file_path)
+                prescan_seconds = time.perf_counter() - prescan_started
             
-            # Create database record
             pdf_doc = PDFDocument(
                 filename=filename,
                 file_path=file_path,
-                file_size=os.path.getsize(file_path),
-                upload_date=datetime.utcnow()
+                file_size=staged.size,
+                content_hash=staged.sha256,
+                upload_date=datetime.utcnow(),
+                page_count=metadata.page_count,
+                title=metadata.title,
+                author=metadata.author
             )
             
             db.session.add(pdf_doc)
+            if existing:
+                db.session.flush()
+                self._reuse_extraction(existing, pdf_doc)
             db.session.commit()
             
             return pdf_doc, None
             
         except Exception as e:
-            # Clean up file if saved
-            if os.path.exists(file_path):
+            db.session.rollback()
+            if os.path.exists(staged.temp_path):
+                os.remove(staged.temp_path)
+            if created_blob and os.path.exists(file_path):
                 os.remove(file_path)
             
             return None, f"Error saving file: {str(e)}"
+        finally:
+            UPLOAD_SECONDS.observe(time.perf_counter() - started - prescan_seconds, 'commit')
             
-    @celery.task(bind=True)
-    def extract_text(self, pdf_id):
-        """Extract text from PDF file asynchronously.
+    @EXTRACTION_SECONDS.time()
+    def extract_text(self, pdf_id, on_progress=None):
+        """Extract text from a stored PDF and record it on the document.
+        
+        Called by the job dispatcher (see jobs.py) from a Celery task or a
+        local worker thread; requires an application context. Documents with
+        at least EXTRACTION_STREAMING_MIN_PAGES pages (as counted at upload)
+        are extracted in streaming mode, see _extract.
         
         Args:
             pdf_id: ID of the PDFDocument to process
+            on_progress: Optional callable receiving (pages_done, total_pages)
             
         Returns:
-            dict: Status and extracted text if successful
+            dict: Status, page count, character count and SHA-256 digest of the
+            document text if successful, plus the text itself unless streamed,
+            and the pages skipped by the sandbox with the reason for each
         """
+        pdf_doc = None
         try:
             pdf_doc = PDFDocument.query.get(pdf_id)
             if not pdf_doc:
@@ -113,82 +561,166 @@ class PDFHandler:
             pdf_doc.processing_status = "processing"
             db.session.commit()
             
-            # Extract text using PyPDF2
-            text_content = []
-            with open(pdf_doc.file_path, 'rb') as file:
-                try:
-                    pdf_reader = PdfReader(file)
-                    total_pages = len(pdf_reader.pages)
-                    
-                    for page_num in range(total_pages):
-                        # Update progress
-                        self.update_state(
-                            state='PROGRESS',
-                            meta={'current': page_num + 1, 'total': total_pages}
-                        )
-                        
-                        try:
-                            page = pdf_reader.pages[page_num]
-                            text_content.append(page.extract_text())
-                        except Exception as e:
-                            text_content.append(f"[Error extracting page {page_num + 1}: {str(e)}]")
-                            
-                except Exception as e:
-                    return {"status": "error", "message": f"Error reading PDF: {str(e)}"}
-            
-            # Join all text content
-            full_text = "\n\n".join(text_content)
-            
-            # Update document with extracted text
-            pdf_doc.extracted_text = full_text
-            pdf_doc.processing_status = "completed"
-            pdf_doc.processing_date = datetime.utcnow()
-            db.session.commit()
-            
-            return {
-                "status": "success",
-                "text": full_text,
-                "total_pages": total_pages
-            }
+            config = current_app.config
+            streaming = (
+                (pdf_doc.page_count or 0) >= config.get('EXTRACTION_STREAMING_MIN_PAGES', 500)
+            )
+            return self._extract(pdf_doc, config, on_progress, keep_text=not streaming)
             
         except Exception as e:
+            db.session.rollback()
             if pdf_doc:
                 pdf_doc.processing_status = "failed"
                 pdf_doc.processing_error = str(e)
                 db.session.commit()
             return {"status": "error", "message": str(e)}
     
-    def get_processing_status(self, task_id):
-        """Get the current status of a text extraction task.
+    def _extract(self, pdf_doc, config, on_progress=None, keep_text=True):
+        """Extract a document, storing and indexing its pages in batches.
+        
+        Pages are inserted and committed every EXTRACTION_PAGE_BATCH pages as
+        they are extracted and added to an IncrementalIndex, so questions can
+        be answered from the pages stored so far while extraction is still
+        running (see ChatbotService). The character count and digest of the
+        document text are computed on the fly. Without ``keep_text``
+        (streaming mode) only one batch of page text is held by the worker
+        however large the document is, and ``extracted_text`` is left empty;
+        the text is only stored as pages. The index segments of each batch are
+        then spilled to disk next to the file and merged into the index file
+        at the end, so the index does not grow the worker either.
         
         Args:
-            task_id: Celery task ID
+            pdf_doc: PDFDocument being processed
+            config: Application configuration
+            on_progress: Optional callable receiving (pages_done, total_pages)
+            keep_text: Whether to store the joined text on the document
             
         Returns:
-            dict: Task status and progress information
+            dict: Status, page count, character count and SHA-256 digest of the
+            document text, the pages skipped by the sandbox (also stored on
+            the document), and the text itself with ``keep_text``
         """
-        task = AsyncResult(task_id)
-        if task.state == 'PENDING':
-            response = {
-                'state': task.state,
-                'current': 0,
-                'total': 1,
-                'status': 'Pending...'
-            }
-        elif task.state != 'FAILURE':
-            response = {
-                'state': task.state,
-                'current': task.info.get('current', 0),
-                'total': task.info.get('total', 1),
-                'status': task.info.get('status', '')
-            }
-            if 'result' in task.info:
-                response['result'] = task.info['result']
-        else:
-            response = {
-                'state': task.state,
-                'current': 1,
-                'total': 1,
-                'status': str(task.info),
-            }
-        return response
+        batch_size = max(1, config.get('EXTRACTION_PAGE_BATCH', 100))
+        separator = PDFPage.PAGE_SEPARATOR
+        
+        # Replace any pages from a previous extraction
+        PDFPage.query.filter_by(pdf_document_id=pdf_doc.id).delete()
+        db.session.commit()
+        
+        document_index = IncrementalIndex(
+            config.get('RETRIEVAL_EMBEDDING_DIM', 256),
+            spill_dir=None if keep_text else os.path.dirname(pdf_doc.file_path)
+        )
+        digest = hashlib.sha256()
+        text_content = []
+        batch = []
+        char_count = 0
+        total_pages = 0
+        skipped_pages = []
+        limits = sandbox_limits(config)
+        if limits is not None and multiprocessing.current_process().daemon:
+            current_app.logger.warning(
+                f"Extracting {pdf_doc.id} WITHOUT the sandbox: daemonic processes "
+                "cannot start sandbox children, so no page, document or memory "
+                "budget applies. Run Celery workers with --pool threads."
+            )
+        try:
+            pages = iter_pages(
+                pdf_doc.file_path,
+                workers=config.get('EXTRACTION_WORKERS', 1),
+                parallel_min_pages=config.get('EXTRACTION_PARALLEL_MIN_PAGES', 0),
+                on_progress=on_progress,
+                range_pages=None if keep_text else batch_size,
+                sandbox=limits,
+                on_skip=lambda page, reason: skipped_pages.append(
+                    {"page": page, "reason": reason}
+                )
+            )
+            for page_number, total_pages, text in pages:
+                text = text or ''
+                if page_number > 1:
+                    digest.update(separator.encode('utf-8'))
+                digest.update(text.encode('utf-8'))
+                if keep_text:
+                    text_content.append(text)
+                batch.append(text)
+                if len(batch) >= batch_size:
+                    char_count = self._store_page_batch(
+                        pdf_doc.id, batch, char_count, document_index
+                    )
+                    batch = []
+            char_count = self._store_page_batch(pdf_doc.id, batch, char_count, document_index)
+        except Exception as e:
+            document_index.close()
+            db.session.rollback()
+            return self._fail_reading(pdf_doc, e)
+        self._log_skipped(pdf_doc, skipped_pages)
+        
+        # Store the retrieval index next to the file
+        self._save_index(pdf_doc, document_index)
+        document_index.close()
+        
+        result = {
+            "status": "success",
+            "total_pages": total_pages,
+            "char_count": char_count,
+            "text_digest": digest.hexdigest(),
+            "skipped_pages": skipped_pages
+        }
+        if keep_text:
+            pdf_doc.extracted_text = result["text"] = separator.join(text_content)
+        pdf_doc.skipped_pages = skipped_pages
+        self._complete(pdf_doc, total_pages)
+        
+        return result
+    
+    def _store_page_batch(self, pdf_id, texts, char_count, document_index):
+        """Insert, commit and index a batch of pages; returns the text length so far."""
+        if not texts:
+            return char_count
+        first_page = document_index.pages + 1
+        # Pages after the first start behind the separator ending the previous page
+        char_start = char_count + len(PDFPage.PAGE_SEPARATOR) if first_page > 1 else 0
+        rows = PDFPage.rows_for(pdf_id, texts, first_page, char_start)
+        db.session.execute(db.insert(PDFPage), rows)
+        db.session.commit()
+        document_index.add_pages(texts)
+        return rows[-1]['char_end']
+    
+    def _save_index(self, pdf_doc, document_index):
+        """Store a DocumentIndex or IncrementalIndex next to the file."""
+        try:
+            document_index.save(index_path(pdf_doc.file_path), pdf_doc.content_hash)
+        except Exception as e:
+            current_app.logger.warning(
+                f"Could not build retrieval index for {pdf_doc.id}: {str(e)}"
+            )
+    
+    def _complete(self, pdf_doc, total_pages):
+        """Mark a document as extracted and drop answers about earlier text."""
+        pdf_doc.page_count = total_pages
+        pdf_doc.processing_status = "completed"
+        pdf_doc.processing_date = datetime.utcnow()
+        pdf_doc.processing_progress = 100.0
+        db.session.commit()
+        
+        # Answers about the previous extraction are no longer valid
+        answer_cache = current_app.extensions.get('answer_cache')
+        if answer_cache is not None:
+            answer_cache.invalidate(pdf_doc.id)
+    
+    def _log_skipped(self, pdf_doc, skipped_pages):
+        """Warn about pages skipped by the extraction sandbox."""
+        if skipped_pages:
+            current_app.logger.warning(
+                f"Skipped {len(skipped_pages)} page(s) of {pdf_doc.id}: "
+                + ", ".join(f"{skip['page']} ({skip['reason']})" for skip in skipped_pages)
+            )
+    
+    def _fail_reading(self, pdf_doc, error):
+        """Record that a PDF could not be read and build the error result."""
+        message = f"Error reading PDF: {str(error)}"
+        pdf_doc.processing_status = "failed"
+        pdf_doc.processing_error = message
+        db.session.commit()
+        return {"status": "error", "message": message}
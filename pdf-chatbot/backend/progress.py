@@ -0,0 +1,140 @@
+"""
+Throttled reporting of extraction progress.
+
+Extraction reports progress after every page. Passing each report on would
+mean one database write, one Celery result backend write and one Socket.IO
+event per page, so ProgressReporter coalesces them: an update is published
+only once progress has advanced by EXTRACTION_PROGRESS_STEP percent and at
+least EXTRACTION_PROGRESS_INTERVAL seconds have passed since the previous
+one, plus always for the last page. Each published update
+
+- writes ``PDFDocument.processing_progress`` in a single UPDATE,
+- emits an ``extraction_progress`` event to the document's Socket.IO room,
+- is forwarded to an optional callback, e.g. Celery's ``update_state``.
+
+Clients in the room receive a final event with the document status once
+extraction finishes, so they no longer need to poll the status endpoint.
+Events emitted from a Celery worker reach clients only when
+SOCKETIO_MESSAGE_QUEUE points the web and worker processes at a shared
+message queue.
+"""
+import time
+from typing import Callable, Dict, Optional
+from flask import current_app
+from sqlalchemy import update
+from models import db, PDFDocument
+
+
+class ProgressReporter:
+    """Coalesces per-page progress of one document into throttled updates."""
+
+    def __init__(self, pdf_id, min_interval: float = 1.0, min_step: float = 5.0,
+                 forward: Optional[Callable] = None, clock: Callable = time.monotonic):
+        """Initialize the reporter. Requires an application context when called.
+
+        Args:
+            pdf_id: ID of the PDFDocument being extracted.
+            min_interval: Minimum seconds between published updates.
+            min_step: Minimum progress, in percent, between published updates.
+            forward: Optional callable receiving (pages_done, total_pages) for
+                every published update.
+            clock: Monotonic clock, replaceable in tests.
+        """
+        self.pdf_id = pdf_id
+        self.min_interval = min_interval
+        self.min_step = min_step
+        self.forward = forward
+        self._clock = clock
+        self.last_progress = 0.0
+        self.last_published = None
+        self.published = 0
+        self.skipped = 0
+
+    def __call__(self, pages_done: int, total_pages: int) -> None:
+        """Record progress; publishes only if the throttle allows it.
+
+        Args:
+            pages_done: Number of pages extracted so far.
+            total_pages: Number of pages in the document.
+        """
+        progress = 100.0 * pages_done / total_pages if total_pages else 100.0
+        now = self._clock()
+        if pages_done < total_pages and (
+            progress - self.last_progress < self.min_step
+            or (self.last_published is not None
+                and now - self.last_published < self.min_interval)
+        ):
+            self.skipped += 1
+            return
+
+        self.last_progress = progress
+        self.last_published = now
+        self.published += 1
+        self._persist(progress)
+        self._emit({
+            'pdf_id': str(self.pdf_id),
+            'status': 'processing',
+            'progress': round(progress, 1),
+            'pages_done': pages_done,
+            'total_pages': total_pages
+        })
+        if self.forward is not None:
+            self.forward(pages_done, total_pages)
+
+    def finish(self, status: str, message: Optional[str] = None) -> None:
+        """Emit the final event of the extraction.
+
+        Args:
+            status: Final processing status, 'completed' or 'failed'.
+            message: Error message of a failed extraction.
+        """
+        self._emit({
+            'pdf_id': str(self.pdf_id),
+            'status': status,
+            'progress': 100.0 if status == 'completed' else round(self.last_progress, 1),
+            'error': message
+        })
+
+    def _persist(self, progress: float) -> None:
+        try:
+            db.session.execute(
+                update(PDFDocument)
+                .where(PDFDocument.id == self.pdf_id)
+                .values(processing_progress=progress)
+            )
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.warning(
+                f"Could not record progress of {self.pdf_id}: {str(e)}"
+            )
+
+    def _emit(self, payload: Dict) -> None:
+        socketio = current_app.extensions.get('socketio')
+        if socketio is None:
+            return
+        try:
+            socketio.emit('extraction_progress', payload, to=str(self.pdf_id))
+        except Exception as e:
+            current_app.logger.warning(
+                f"Could not emit progress of {self.pdf_id}: {str(e)}"
+            )
+
+
+def create_progress_reporter(app, pdf_id, forward: Optional[Callable] = None) -> ProgressReporter:
+    """Create a progress reporter throttled as configured for an application.
+
+    Args:
+        app: Flask application.
+        pdf_id: ID of the PDFDocument being extracted.
+        forward: Optional callable receiving each published (pages_done, total_pages).
+
+    Returns:
+        A ProgressReporter.
+    """
+    return ProgressReporter(
+        pdf_id,
+        min_interval=app.config.get('EXTRACTION_PROGRESS_INTERVAL', 1.0),
+        min_step=app.config.get('EXTRACTION_PROGRESS_STEP', 5.0),
+        forward=forward
+    )
@@ -0,0 +1,899 @@
+"""
+Passage retrieval over extracted PDF text.
+
+Page texts are split into overlapping word-window passages, which are indexed
+two ways:
+
+* lexically, in a compact array-backed inverted index scored with BM25. Terms
+  are stored as sorted 64-bit hashes and postings in CSR form (one offsets
+  array, one array of passage ids and one of term frequencies), so a lookup
+  is a binary search and scoring is a few vectorized NumPy operations;
+* densely, as a float32 matrix of L2-normalized feature-hashed TF-IDF
+  vectors, so a query is one matrix-vector product and an argpartition.
+
+Both are deterministic, CPU-only and need no model downloads. Documents that
+are still being extracted are indexed a batch of pages at a time with
+IncrementalIndex, which yields the same indexes.
+"""
+import hashlib
+import math
+import os
+import re
+import shutil
+import tempfile
+from collections import Counter
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple, Union
+import numpy as np
+from index_store import IndexWriter, open_index, write_index
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+STOPWORDS = frozenset("""
+a about above after again all am an and any are as at be because been before
+being below between both but by can could did do does doing down during each
+few for from further had has have having he her here hers him his how i if in
+into is it its itself just me more most my no nor not of off on once only or
+other our out over own same she should so some such than that the their them
+then there these they this those through to too under until up very was we
+were what when where which while who whom why will with would you your
+also get give know let like make please say see show tell want
+""".split())
+
+PASSAGE_DTYPE = np.dtype([('page', '<u4'), ('start', '<u4'), ('end', '<u4')])
+RETRIEVAL_MODES = ('bm25', 'dense')
+
+
+def normalize_token(token: str) -> Optional[str]:
+    """Lowercase a token, drop stopwords and strip simple plural/verb suffixes."""
+    token = token.lower()
+    if token in STOPWORDS:
+        return None
+    if len(token) > 4 and token.endswith('ies'):
+        return token[:-3] + 'y'
+    if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+        return token[:-1]
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into normalized index terms."""
+    terms = []
+    for match in TOKEN_PATTERN.finditer(text):
+        term = normalize_token(match.group())
+        if term:
+            terms.append(term)
+    return terms
+
+
+def term_key(term: str) -> int:
+    """Stable 64-bit key of an index term."""
+    return int.from_bytes(hashlib.blake2b(term.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def split_passages(page_texts: Sequence[str], passage_words: int = 120,
+                   overlap_words: int = 20, first_page: int = 1) -> np.ndarray:
+    """Split page texts into overlapping word windows.
+
+    Passages never cross page boundaries and are described by character
+    offsets into their page, so their text can be recovered from PDFPage rows.
+
+    Args:
+        page_texts: Page texts in page order.
+        passage_words: Maximum number of words in a passage.
+        overlap_words: Number of words shared by consecutive passages.
+        first_page: Page number of the first text, for splitting in batches.
+
+    Returns:
+        Structured array of (page, start, end) with 1-based page numbers.
+    """
+    stride = max(1, passage_words - overlap_words)
+    passages = []
+    for page_number, text in enumerate(page_texts, start=first_page):
+        spans = [match.span() for match in TOKEN_PATTERN.finditer(text or '')]
+        for first in range(0, len(spans), stride):
+            last = min(first + passage_words, len(spans)) - 1
+            passages.append((page_number, spans[first][0], spans[last][1]))
+            if last == len(spans) - 1:
+                break
+    return np.array(passages, dtype=PASSAGE_DTYPE)
+
+
+class SearchResult(NamedTuple):
+    """Ranked passages for a query."""
+    passages: List[int]
+    scores: List[float]
+    confidence: float
+
+
+NO_RESULTS = SearchResult([], [], 0.0)
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indexes of the k highest positive scores, best first."""
+    candidates = np.flatnonzero(scores > 0)
+    if len(candidates) > k:
+        candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+
+def _confidence(match: float, top_scores: np.ndarray) -> float:
+    """Scale a match quality in [0, 1] by the margin over the runner-up."""
+    runner_up = float(top_scores[1]) if len(top_scores) > 1 else 0.0
+    margin = (float(top_scores[0]) - runner_up) / float(top_scores[0])
+    return round(min(1.0, match) * (0.5 + 0.5 * margin), 4)
+
+
+class BM25Index:
+    """Array-backed inverted index over document passages with BM25 scoring."""
+
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self, term_keys: np.ndarray, term_offsets: np.ndarray,
+                 postings: np.ndarray, frequencies: np.ndarray, lengths: np.ndarray,
+                 norms: Optional[np.ndarray] = None):
+        """Wrap prebuilt index arrays.
+
+        Args:
+            term_keys: Sorted uint64 term keys.
+            term_offsets: int64 offsets into the postings, one more than terms.
+            postings: int32 passage ids, ascending within each term.
+            frequencies: Term frequency of each posting.
+            lengths: Number of terms in each passage.
+            norms: Precomputed length normalization; derived from lengths if omitted.
+        """
+        self.term_keys = term_keys
+        self.term_offsets = term_offsets
+        self.postings = postings
+        self.frequencies = frequencies
+        self.lengths = lengths
+
+        if norms is not None:
+            self.norms = norms
+            return
+        # Length normalization is independent of the query, so do it once
+        self.norms = self.length_norms(lengths, float(lengths.mean()) if len(lengths) else 0.0)
+
+    @classmethod
+    def length_norms(cls, lengths: np.ndarray, avg_length: float) -> np.ndarray:
+        """Return the BM25 length normalization of passages.
+
+        Args:
+            lengths: Number of terms in each passage.
+            avg_length: Average passage length over the whole index.
+
+        Returns:
+            float32 normalization of each passage.
+        """
+        return (
+            cls.K1 * (1 - cls.B + cls.B * lengths / avg_length)
+            if avg_length else np.full(len(lengths), cls.K1)
+        ).astype(np.float32)
+
+    @classmethod
+    def build(cls, passage_texts: Sequence[str]) -> 'BM25Index':
+        """Index passage texts.
+
+        Args:
+            passage_texts: Text of each passage, in passage id order.
+
+        Returns:
+            A new BM25Index.
+        """
+        keys = {}
+        term_postings = {}
+        lengths = np.zeros(len(passage_texts), dtype=np.int32)
+        for passage_id, text in enumerate(passage_texts):
+            terms = tokenize(text)
+            lengths[passage_id] = len(terms)
+            for term, frequency in Counter(terms).items():
+                key = keys.get(term)
+                if key is None:
+                    key = keys[term] = term_key(term)
+                term_postings.setdefault(key, []).append((passage_id, frequency))
+
+        term_keys = np.array(sorted(term_postings), dtype=np.uint64)
+        term_offsets = np.zeros(len(term_keys) + 1, dtype=np.int64)
+        postings, frequencies = [], []
+        for index, key in enumerate(term_keys.tolist()):
+            entries = term_postings[key]
+            term_offsets[index + 1] = term_offsets[index] + len(entries)
+            postings.extend(passage_id for passage_id, _ in entries)
+            frequencies.extend(frequency for _, frequency in entries)
+
+        return cls(
+            term_keys, term_offsets,
+            np.array(postings, dtype=np.int32),
+            np.array(frequencies, dtype=np.int32),
+            lengths
+        )
+
+    @classmethod
+    def concatenate(cls, indexes: Sequence['BM25Index']) -> 'BM25Index':
+        """Merge indexes over consecutive passage ranges into one.
+
+        Passage ids of each index are offset by the passages of the indexes
+        before it. The result is the same as building one index over all
+        passages, without tokenizing them again.
+
+        Args:
+            indexes: Indexes in passage order.
+
+        Returns:
+            A new BM25Index.
+        """
+        if not indexes:
+            return cls.build([])
+        keys, postings, frequencies, lengths = [], [], [], []
+        base = 0
+        for index in indexes:
+            keys.append(np.repeat(index.term_keys, np.diff(index.term_offsets)))
+            postings.append(index.postings.astype(np.int32) + np.int32(base))
+            frequencies.append(index.frequencies)
+            lengths.append(index.lengths)
+            base += len(index)
+
+        keys = np.concatenate(keys)
+        # A stable sort keeps the postings of each term in passage order
+        order = np.argsort(keys, kind='stable')
+        term_keys, counts = np.unique(keys[order], return_counts=True)
+        term_offsets = np.zeros(len(term_keys) + 1, dtype=np.int64)
+        np.cumsum(counts, out=term_offsets[1:])
+        return cls(
+            term_keys.astype(np.uint64), term_offsets,
+            np.concatenate(postings)[order],
+            np.concatenate(frequencies).astype(np.int32)[order],
+            np.concatenate(lengths).astype(np.int32)
+        )
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def _lookup(self, terms: Iterable[str]) -> List[Optional[int]]:
+        """Map query terms to term indexes, or None for unknown terms."""
+        keys = np.array([term_key(term) for term in terms], dtype=np.uint64)
+        positions = np.searchsorted(self.term_keys, keys)
+        found = []
+        for key, position in zip(keys.tolist(), positions.tolist()):
+            if position < len(self.term_keys) and int(self.term_keys[position]) == key:
+                found.append(position)
+            else:
+                found.append(None)
+        return found
+
+    def _idf(self, document_frequency: int) -> float:
+        count = len(self.lengths)
+        return math.log(1 + (count - document_frequency + 0.5) / (document_frequency + 0.5))
+
+    def search(self, query: str, k: int = 5) -> SearchResult:
+        """Rank passages against a query.
+
+        Confidence combines the IDF-weighted share of query terms found in the
+        best passage with the margin between the best and second-best scores.
+
+        Args:
+            query: Question text.
+            k: Maximum number of passages to return.
+
+        Returns:
+            SearchResult with passage ids, scores and a confidence in [0, 1].
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms or not len(self):
+            return NO_RESULTS
+
+        scores = np.zeros(len(self), dtype=np.float32)
+        matched = []
+        weights = []
+        for term_index in self._lookup(terms):
+            if term_index is None:
+                weights.append(self._idf(0))
+                continue
+            start, end = self.term_offsets[term_index], self.term_offsets[term_index + 1]
+            ids = self.postings[start:end]
+            frequencies = self.frequencies[start:end]
+            idf = self._idf(end - start)
+            scores[ids] += idf * frequencies * (self.K1 + 1) / (frequencies + self.norms[ids])
+            matched.append((ids, idf))
+            weights.append(idf)
+
+        ranked = _top_k(scores, k)
+        if not len(ranked):
+            return NO_RESULTS
+        top_scores = scores[ranked]
+
+        best = int(ranked[0])
+        covered = 0.0
+        for ids, idf in matched:
+            position = np.searchsorted(ids, best)
+            if position < len(ids) and ids[position] == best:
+                covered += idf
+
+        return SearchResult(
+            ranked.tolist(), top_scores.tolist(), _confidence(covered / sum(weights), top_scores)
+        )
+
+
+class HashingEmbedder:
+    """Deterministic text embedder using signed feature hashing and TF-IDF.
+
+    Each term is hashed to one of ``dim`` buckets with a sign taken from the
+    hash, weighted by sublinear term frequency and a per-bucket IDF.
+    """
+
+    def __init__(self, dim: int = 256):
+        """Initialize the embedder.
+
+        Args:
+            dim: Number of hash buckets, i.e. the embedding width.
+        """
+        self.dim = dim
+        self._keys = {}
+
+    def features(self, text: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Hash a text's terms to buckets.
+
+        Returns:
+            Tuple of (bucket indexes, signed sublinear term frequencies).
+        """
+        buckets, values = [], []
+        for term, frequency in Counter(tokenize(text)).items():
+            key = self._keys.get(term)
+            if key is None:
+                key = self._keys[term] = term_key(term)
+            buckets.append(key % self.dim)
+            values.append((1.0 + math.log(frequency)) * (-1.0 if key >> 63 else 1.0))
+        return np.array(buckets, dtype=np.int64), np.array(values, dtype=np.float32)
+
+    def features_many(self, texts: Iterable[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Hash the terms of several texts to buckets.
+
+        Returns:
+            Tuple of (text indexes, bucket indexes, values), one entry per
+            distinct term of each text.
+        """
+        rows, buckets, values = [], [], []
+        for row, text in enumerate(texts):
+            text_buckets, text_values = self.features(text)
+            rows.append(np.full(len(text_buckets), row, dtype=np.int64))
+            buckets.append(text_buckets)
+            values.append(text_values)
+        if not rows:
+            return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64),
+                    np.zeros(0, dtype=np.float32))
+        return np.concatenate(rows), np.concatenate(buckets), np.concatenate(values)
+
+    def embed(self, text: str, idf: Optional[np.ndarray] = None) -> np.ndarray:
+        """Embed a text as an L2-normalized float32 vector.
+
+        Args:
+            text: Text to embed.
+            idf: Optional per-bucket IDF weights; uniform if omitted.
+
+        Returns:
+            Vector of length ``dim``; all zeros if the text has no terms.
+        """
+        buckets, values = self.features(text)
+        vector = np.zeros(self.dim, dtype=np.float32)
+        if idf is not None:
+            values = values * idf[buckets]
+        np.add.at(vector, buckets, values)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+class DenseIndex:
+    """Matrix of passage embeddings searched with a matrix-vector product."""
+
+    def __init__(self, matrix: np.ndarray, idf: np.ndarray):
+        """Wrap prebuilt embedding arrays.
+
+        Args:
+            matrix: float32 array of shape (passages, dim), rows L2-normalized.
+            idf: float32 per-bucket IDF used to embed queries.
+        """
+        self.matrix = matrix
+        self.idf = idf
+        self.embedder = HashingEmbedder(matrix.shape[1])
+
+    @classmethod
+    def build(cls, passage_texts: Sequence[str], dim: int = 256) -> 'DenseIndex':
+        """Embed passage texts.
+
+        Args:
+            passage_texts: Text of each passage, in passage id order.
+            dim: Embedding width.
+
+        Returns:
+            A new DenseIndex.
+        """
+        rows, buckets, values = HashingEmbedder(dim).features_many(passage_texts)
+        return cls.from_features(len(passage_texts), rows, buckets, values, dim)
+
+    @classmethod
+    def from_features(cls, count: int, rows: np.ndarray, buckets: np.ndarray,
+                      values: np.ndarray, dim: int = 256) -> 'DenseIndex':
+        """Weight and normalize hashed passage features, see features_many.
+
+        Args:
+            count: Number of passages.
+            rows: Passage id of each feature.
+            buckets: Bucket of each feature.
+            values: Signed sublinear term frequency of each feature.
+            dim: Embedding width.
+
+        Returns:
+            A new DenseIndex.
+        """
+        idf = cls.bucket_idf(count, cls.bucket_frequencies(rows, buckets, dim))
+        return cls(cls.weighted_rows(count, rows, buckets, values, idf), idf)
+
+    @staticmethod
+    def bucket_frequencies(rows: np.ndarray, buckets: np.ndarray, dim: int) -> np.ndarray:
+        """Count the passages with a feature in each bucket.
+
+        Args:
+            rows: Passage id of each feature.
+            buckets: Bucket of each feature.
+            dim: Embedding width.
+
+        Returns:
+            int64 passage count of each bucket.
+        """
+        return np.bincount(np.unique(rows * dim + buckets) % dim, minlength=dim)
+
+    @staticmethod
+    def bucket_idf(count: int, document_frequency: np.ndarray) -> np.ndarray:
+        """Return the float32 IDF of each bucket over ``count`` passages."""
+        if not count:
+            return np.ones(len(document_frequency), dtype=np.float32)
+        return (np.log((1 + count) / (1 + document_frequency)) + 1).astype(np.float32)
+
+    @staticmethod
+    def weighted_rows(count: int, rows: np.ndarray, buckets: np.ndarray, values: np.ndarray,
+                      idf: np.ndarray) -> np.ndarray:
+        """Weight hashed features by IDF into L2-normalized embedding rows.
+
+        Args:
+            count: Number of passages.
+            rows: Passage id of each feature, below ``count``.
+            buckets: Bucket of each feature.
+            values: Signed sublinear term frequency of each feature.
+            idf: IDF of each bucket.
+
+        Returns:
+            float32 array of shape (count, len(idf)).
+        """
+        matrix = np.zeros((count, len(idf)), dtype=np.float32)
+        np.add.at(matrix, (rows, buckets), values * idf[buckets])
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        np.divide(matrix, norms, out=matrix, where=norms > 0)
+        return matrix
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    def search(self, query: str, k: int = 5) -> SearchResult:
+        """Rank passages by cosine similarity to a query.
+
+        Confidence is the square root of the best cosine similarity, scaled by
+        the margin between the best and second-best passages.
+
+        Args:
+            query: Question text.
+            k: Maximum number of passages to return.
+
+        Returns:
+            SearchResult with passage ids, scores and a confidence in [0, 1].
+        """
+        vector = self.embedder.embed(query, self.idf)
+        if not len(self) or not vector.any():
+            return NO_RESULTS
+        return self._result(self.matrix @ vector, k)
+
+    def search_many(self, queries: Sequence[str], k: int = 5) -> List[SearchResult]:
+        """Rank passages for several queries with one matrix product.
+
+        Args:
+            queries: Question texts.
+            k: Maximum number of passages per query.
+
+        Returns:
+            One SearchResult per query, in query order.
+        """
+        if not len(self) or not queries:
+            return [NO_RESULTS] * len(queries)
+        vectors = np.stack([self.embedder.embed(query, self.idf) for query in queries])
+        scores = vectors @ self.matrix.T
+        return [
+            self._result(row, k) if vector.any() else NO_RESULTS
+            for vector, row in zip(vectors, scores)
+        ]
+
+    @staticmethod
+    def _result(scores: np.ndarray, k: int) -> SearchResult:
+        ranked = _top_k(scores, k)
+        if not len(ranked):
+            return NO_RESULTS
+        top_scores = scores[ranked]
+        return SearchResult(
+            ranked.tolist(), top_scores.tolist(),
+            _confidence(math.sqrt(float(top_scores[0])), top_scores)
+        )
+
+
+class DocumentIndex:
+    """Passages of one document together with their lexical and dense indexes."""
+
+    def __init__(self, passages: np.ndarray, bm25: BM25Index, dense: DenseIndex):
+        """Wrap prebuilt indexes.
+
+        Args:
+            passages: Structured array of passage (page, start, end).
+            bm25: Lexical index over the passages.
+            dense: Embedding index over the passages.
+        """
+        self.passages = passages
+        self.bm25 = bm25
+        self.dense = dense
+
+    @classmethod
+    def build(cls, page_texts: Sequence[str], dim: int = 256) -> 'DocumentIndex':
+        """Chunk page texts into passages and build both indexes.
+
+        Args:
+            page_texts: Page texts in page order.
+            dim: Embedding width of the dense index.
+
+        Returns:
+            A new DocumentIndex.
+        """
+        passages = split_passages(page_texts)
+        passage_texts = [
+            page_texts[page - 1][start:end] for page, start, end in passages.tolist()
+        ]
+        return cls.from_passages(passages, passage_texts, dim)
+
+    @classmethod
+    def from_passages(cls, passages: np.ndarray, passage_texts: Sequence[str],
+                      dim: int = 256) -> 'DocumentIndex':
+        """Build both indexes over passages that have already been split.
+
+        ``passage_texts`` is only iterated, twice, in passage order, so it may
+        be a sequence that loads the texts lazily.
+
+        Args:
+            passages: Structured array of passage (page, start, end).
+            passage_texts: Text of each passage, in passage id order.
+            dim: Embedding width of the dense index.
+
+        Returns:
+            A new DocumentIndex.
+        """
+        return cls(passages, BM25Index.build(passage_texts), DenseIndex.build(passage_texts, dim))
+
+    def __len__(self):
+        return len(self.passages)
+
+    def search(self, query: str, k: int = 5, mode: str = 'bm25') -> SearchResult:
+        """Rank passages with the lexical ('bm25') or semantic ('dense') index."""
+        if mode == 'dense':
+            return self.dense.search(query, k)
+        return self.bm25.search(query, k)
+
+    def search_many(self, queries: Sequence[str], k: int = 5,
+                    mode: str = 'bm25') -> List[SearchResult]:
+        """Rank passages for several queries, in query order.
+
+        Dense queries are scored together in one matrix product; BM25 walks
+        the postings of each query's terms.
+        """
+        if mode == 'dense':
+            return self.dense.search_many(queries, k)
+        return [self.bm25.search(query, k) for query in queries]
+
+    def save(self, path: str, content_hash: Optional[str] = None) -> None:
+        """Atomically write the index in the memory-mappable index format.
+
+        Args:
+            path: Destination path.
+            content_hash: Hash of the source document, checked by load().
+        """
+        write_index(path, {
+            'passages': self.passages,
+            'term_keys': self.bm25.term_keys,
+            'term_offsets': self.bm25.term_offsets,
+            'postings': self.bm25.postings,
+            'frequencies': self.bm25.frequencies,
+            'lengths': self.bm25.lengths,
+            'norms': self.bm25.norms,
+            'matrix': self.dense.matrix,
+            'idf': self.dense.idf
+        }, content_hash)
+
+    @classmethod
+    def load(cls, path: str, content_hash: Optional[str] = None) -> Optional['DocumentIndex']:
+        """Open an index written by save() without copying its arrays.
+
+        The arrays are read-only views of a shared memory map of the file.
+
+        Args:
+            path: Index file path.
+            content_hash: Expected source hash; a mismatch counts as stale.
+
+        Returns:
+            The index, or None if the file is missing, stale or corrupt.
+        """
+        data = open_index(path, content_hash)
+        if data is None:
+            return None
+        try:
+            bm25 = BM25Index(
+                data['term_keys'], data['term_offsets'],
+                data['postings'], data['frequencies'], data['lengths'], data['norms']
+            )
+            return cls(data['passages'], bm25, DenseIndex(data['matrix'], data['idf']))
+        except (KeyError, ValueError, IndexError):
+            return None
+
+
+class _Segment(NamedTuple):
+    """Passages of a batch of pages with their postings and dense features."""
+    passages: np.ndarray
+    bm25: BM25Index
+    rows: np.ndarray
+    buckets: np.ndarray
+    values: np.ndarray
+
+
+class IncrementalIndex:
+    """Document index built a batch of pages at a time, in page order.
+
+    Each batch is split into passages and tokenized once, into a segment of
+    BM25 postings and hashed dense features. ``index()`` merges the segments
+    with array operations only and applies document-wide statistics (IDF and
+    length normalization), so the result is the same as DocumentIndex.build
+    over all pages added so far, and growing the index never re-reads pages.
+
+    Given a ``spill_dir``, each segment is written to a file there instead of
+    kept in memory, and ``save()`` merges the files into the index file a
+    range of terms at a time. Only the vocabulary and per-bucket counts stay
+    in memory, so indexing a long document takes bounded memory. Call
+    ``close()`` (or use the index as a context manager) to remove the files.
+    """
+
+    # Postings merged per step when saving spilled segments
+    MERGE_POSTINGS = 2**18
+
+    def __init__(self, dim: int = 256, spill_dir: Optional[str] = None):
+        """Initialize an empty index.
+
+        Args:
+            dim: Embedding width of the dense index.
+            spill_dir: Directory to write segments to; kept in memory if omitted.
+        """
+        self.dim = dim
+        self.pages = 0  # Pages added so far
+        self._embedder = HashingEmbedder(dim)
+        self._segments: List[Union[_Segment, str]] = []  # Segments or their files
+        self._sizes: List[int] = []  # Passages of each segment
+        self._index: Optional[DocumentIndex] = None
+        self._spill_dir = (
+            tempfile.mkdtemp(prefix='.segments-', dir=spill_dir) if spill_dir else None
+        )
+        # Document-wide statistics of spilled segments
+        self._total_length = 0
+        self._term_keys = np.zeros(0, dtype=np.uint64)
+        self._term_frequencies = np.zeros(0, dtype=np.int64)
+        self._bucket_frequencies = np.zeros(dim, dtype=np.int64)
+
+    def __len__(self):
+        return sum(self._sizes)
+
+    def __enter__(self) -> 'IncrementalIndex':
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close()
+
+    def close(self) -> None:
+        """Remove spilled segment files."""
+        if self._spill_dir is not None:
+            shutil.rmtree(self._spill_dir, ignore_errors=True)
+            self._spill_dir = None
+            self._segments = []
+
+    def add_pages(self, page_texts: Sequence[str]) -> None:
+        """Index the pages following those added so far.
+
+        Args:
+            page_texts: Texts of the next pages, in page order.
+        """
+        first_page = self.pages + 1
+        passages = split_passages(page_texts, first_page=first_page)
+        passage_texts = [
+            page_texts[page - first_page][start:end] for page, start, end in passages.tolist()
+        ]
+        segment = _Segment(
+            passages, BM25Index.build(passage_texts),
+            *self._embedder.features_many(passage_texts)
+        )
+        self._segments.append(self._spill(segment) if self._spill_dir else segment)
+        self._sizes.append(len(passages))
+        self.pages += len(page_texts)
+        self._index = None
+
+    def _spill(self, segment: _Segment) -> str:
+        """Write a segment to a file, accumulating its statistics."""
+        bm25 = segment.bm25
+        self._total_length += int(bm25.lengths.sum())
+        self._bucket_frequencies += DenseIndex.bucket_frequencies(
+            segment.rows, segment.buckets, self.dim
+        )
+        term_keys = np.union1d(self._term_keys, bm25.term_keys).astype(np.uint64)
+        term_frequencies = np.zeros(len(term_keys), dtype=np.int64)
+        term_frequencies[np.searchsorted(term_keys, self._term_keys)] += self._term_frequencies
+        term_frequencies[np.searchsorted(term_keys, bm25.term_keys)] += np.diff(bm25.term_offsets)
+        self._term_keys, self._term_frequencies = term_keys, term_frequencies
+
+        path = os.path.join(self._spill_dir, f'{len(self._segments):06d}.idx')
+        write_index(path, {
+            'passages': segment.passages,
+            'term_keys': bm25.term_keys,
+            'term_offsets': bm25.term_offsets,
+            'postings': bm25.postings,
+            'frequencies': bm25.frequencies,
+            'lengths': bm25.lengths,
+            'rows': segment.rows,
+            'buckets': segment.buckets,
+            'values': segment.values
+        })
+        return path
+
+    @staticmethod
+    def _open_segment(segment: Union[_Segment, str]) -> Dict[str, np.ndarray]:
+        """Return the arrays of a segment, mapping spilled ones from their file."""
+        if isinstance(segment, _Segment):
+            bm25 = segment.bm25
+            return {
+                'passages': segment.passages, 'term_keys': bm25.term_keys,
+                'term_offsets': bm25.term_offsets, 'postings': bm25.postings,
+                'frequencies': bm25.frequencies, 'lengths': bm25.lengths,
+                'rows': segment.rows, 'buckets': segment.buckets, 'values': segment.values
+            }
+        data = open_index(segment)
+        if data is None:
+            raise OSError(f"Index segment {segment} is missing or corrupt")
+        return data
+
+    def _load_segment(self, segment: Union[_Segment, str]) -> _Segment:
+        """Return a segment in memory."""
+        if isinstance(segment, _Segment):
+            return segment
+        data = {name: np.array(array) for name, array in self._open_segment(segment).items()}
+        return _Segment(data['passages'], BM25Index(
+            data['term_keys'], data['term_offsets'],
+            data['postings'], data['frequencies'], data['lengths']
+        ), data['rows'], data['buckets'], data['values'])
+
+    def index(self) -> DocumentIndex:
+        """Return the index of all pages added so far.
+
+        In memory, the segments are merged into one, so later calls only merge
+        the batches added since. Spilled segments are read back into memory
+        on every call; prefer save() for them.
+        """
+        if self._index is not None:
+            return self._index
+        segments = [self._load_segment(segment) for segment in self._segments]
+        if len(segments) > 1:
+            base = np.cumsum([0] + [len(segment.passages) for segment in segments[:-1]])
+            segments = [_Segment(
+                np.concatenate([segment.passages for segment in segments]),
+                BM25Index.concatenate([segment.bm25 for segment in segments]),
+                np.concatenate([
+                    segment.rows + offset for segment, offset in zip(segments, base)
+                ]),
+                np.concatenate([segment.buckets for segment in segments]),
+                np.concatenate([segment.values for segment in segments])
+            )]
+        if self._spill_dir is None:
+            self._segments = segments
+            self._sizes = [sum(self._sizes)] if segments else []
+        if not segments:
+            self._index = DocumentIndex.build([], dim=self.dim)
+            return self._index
+        segment = segments[0]
+        self._index = DocumentIndex(segment.passages, segment.bm25, DenseIndex.from_features(
+            len(segment.passages), segment.rows, segment.buckets, segment.values, self.dim
+        ))
+        return self._index
+
+    def save(self, path: str, content_hash: Optional[str] = None) -> None:
+        """Atomically write the index of all pages added so far, see DocumentIndex.save.
+
+        Args:
+            path: Destination path.
+            content_hash: Hash of the source document, checked by load().
+        """
+        if self._spill_dir is None:
+            self.index().save(path, content_hash)
+            return
+
+        count, dim = len(self), self.dim
+        term_keys = self._term_keys
+        term_offsets = np.zeros(len(term_keys) + 1, dtype=np.int64)
+        np.cumsum(self._term_frequencies, out=term_offsets[1:])
+        total_postings = int(term_offsets[-1])
+        avg_length = self._total_length / count if count else 0.0
+        idf = DenseIndex.bucket_idf(count, self._bucket_frequencies)
+        with IndexWriter(path, {
+            'passages': (PASSAGE_DTYPE, (count,)),
+            'term_keys': (np.uint64, term_keys.shape),
+            'term_offsets': (np.int64, term_offsets.shape),
+            'postings': (np.int32, (total_postings,)),
+            'frequencies': (np.int32, (total_postings,)),
+            'lengths': (np.int32, (count,)),
+            'norms': (np.float32, (count,)),
+            'matrix': (np.float32, (count, dim)),
+            'idf': (np.float32, (dim,))
+        }, content_hash) as writer:
+            writer.write('term_keys', term_keys)
+            writer.write('term_offsets', term_offsets)
+            writer.write('idf', idf)
+            for segment, size in zip(self._segments, self._sizes):
+                data = self._open_segment(segment)
+                writer.write('passages', data['passages'])
+                writer.write('lengths', data['lengths'])
+                writer.write('norms', BM25Index.length_norms(data['lengths'], avg_length))
+                writer.write('matrix', DenseIndex.weighted_rows(
+                    size, data['rows'], data['buckets'], data['values'], idf
+                ))
+                del data
+
+            bases = np.cumsum([0] + self._sizes[:-1])
+            start = 0
+            while start < len(term_keys):
+                stop = int(np.searchsorted(
+                    term_offsets, term_offsets[start] + self.MERGE_POSTINGS, side='right'
+                )) - 1
+                stop = min(max(stop, start + 1), len(term_keys))
+                postings, frequencies = self._merge_postings(
+                    term_keys[start], term_keys[stop - 1], bases
+                )
+                writer.write('postings', postings)
+                writer.write('frequencies', frequencies)
+                start = stop
+
+    def _merge_postings(self, first_key, last_key,
+                        bases: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Collect the postings of a range of terms from every segment.
+
+        Args:
+            first_key: First term key of the range.
+            last_key: Last term key of the range, inclusive.
+            bases: Passage id offset of each segment.
+
+        Returns:
+            (postings, frequencies) of the terms, in term then passage order.
+        """
+        keys, postings, frequencies = [], [], []
+        for segment, base in zip(self._segments, bases):
+            data = self._open_segment(segment)
+            segment_keys, offsets = data['term_keys'], data['term_offsets']
+            first = np.searchsorted(segment_keys, first_key, side='left')
+            last = np.searchsorted(segment_keys, last_key, side='right')
+            keys.append(np.repeat(segment_keys[first:last], np.diff(offsets[first:last + 1])))
+            postings.append(
+                data['postings'][offsets[first]:offsets[last]].astype(np.int32) + np.int32(base)
+            )
+            frequencies.append(np.array(data['frequencies'][offsets[first]:offsets[last]]))
+            del data, segment_keys, offsets
+        # A stable sort keeps the postings of each term in passage order
+        order = np.argsort(np.concatenate(keys), kind='stable')
+        return np.concatenate(postings)[order], np.concatenate(frequencies)[order]
+
+
+def index_path(file_path: str) -> str:
+    """Path of the retrieval index stored next to an uploaded PDF."""
+    return os.path.splitext(file_path)[0] + '.index'
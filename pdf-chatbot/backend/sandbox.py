@@ -0,0 +1,263 @@
+"""
+Isolated, budgeted extraction of PDF pages.
+
+PyPDF2 parses untrusted input: a malformed or adversarial file can keep
+``page.extract_text()`` busy indefinitely or make it allocate without bound,
+and inside a worker thread nothing can interrupt it. In sandbox mode pages
+are therefore extracted in child processes:
+
+- each child caps its own address space with RLIMIT_AS, so runaway
+  allocation fails with MemoryError or takes down only the child;
+- the parent waits at most ``page_timeout`` seconds for each page and
+  ``document_timeout`` seconds for the whole document;
+- a page that exceeds its budget, runs out of memory or crashes the child
+  is skipped: the child is killed if needed, the page is reported with the
+  reason, and a fresh child carries on with the next page. Once the
+  document budget is spent, all remaining pages are skipped.
+
+Children are started from a fork server, so they do not inherit the locks
+of the threads of the calling process. Daemonic processes (e.g. Celery
+prefork children) cannot start children; callers fall back to in-process
+extraction there, without any budget, and warn about it. Celery workers
+should therefore use the threads pool.
+"""
+import multiprocessing
+import time
+from collections import deque
+from typing import Callable, Iterator, List, NamedTuple, Optional, Tuple
+from metrics import EXTRACTION_PAGE_SECONDS
+
+# Reasons a page is skipped
+TIMEOUT = 'timeout'
+MEMORY = 'memory'
+CRASHED = 'crashed'
+DOCUMENT_TIMEOUT = 'document_timeout'
+
+REASONS = {
+    TIMEOUT: 'page extraction timed out',
+    MEMORY: 'page extraction ran out of memory',
+    CRASHED: 'page extraction crashed',
+    DOCUMENT_TIMEOUT: 'document extraction timed out'
+}
+
+
+class SandboxLimits(NamedTuple):
+    """Budgets of sandboxed extraction."""
+    page_timeout: float = 30.0  # Seconds per page
+    document_timeout: float = 900.0  # Seconds per document
+    memory_limit: Optional[int] = 1024 * 2**20  # Bytes of address space per child
+
+
+class SandboxError(Exception):
+    """Raised when a document cannot be opened inside the sandbox."""
+
+
+def skipped_text(page_number: int, reason: str) -> str:
+    """Placeholder stored for the text of a skipped page."""
+    return f"[Page {page_number} skipped: {REASONS[reason]}]"
+
+
+def process_context():
+    """Multiprocessing context for extraction children: a fork server if available."""
+    methods = multiprocessing.get_all_start_methods()
+    if 'forkserver' not in methods:
+        return multiprocessing.get_context()
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload(['sandbox', 'PyPDF2'])
+    return context
+
+
+def _limit_memory(limit: Optional[int]) -> None:
+    if not limit:
+        return
+    import resource
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+
+def _extract_in_child(file_path, start, stop, memory_limit, connection):
+    """Child process: send the page count, then each page of [start, stop)."""
+    try:
+        _limit_memory(memory_limit)
+        from PyPDF2 import PdfReader
+
+        with open(file_path, 'rb') as file:
+            pdf_reader = PdfReader(file)
+            total_pages = len(pdf_reader.pages)
+            connection.send(('total', total_pages))
+            for page_num in range(start, min(stop, total_pages)):
+                started = time.perf_counter()
+                try:
+                    text = pdf_reader.pages[page_num].extract_text()
+                except MemoryError:
+                    # The heap may be left in any state; let a fresh child continue
+                    connection.send(('skip', page_num, MEMORY))
+                    return
+                except Exception as e:
+                    text = f"[Error extracting page {page_num + 1}: {str(e)}]"
+                connection.send(('page', page_num, text, time.perf_counter() - started))
+    except MemoryError:
+        connection.send(('error', 'Out of memory opening PDF'))
+    except Exception as e:
+        connection.send(('error', str(e)))
+    finally:
+        connection.close()
+
+
+class _RangeExtraction:
+    """Extracts one page range in child processes, replacing killed children."""
+
+    def __init__(self, context, file_path, start, stop, limits: SandboxLimits, deadline):
+        self.context = context
+        self.file_path = file_path
+        self.stop = stop
+        self.limits = limits
+        self.deadline = deadline
+        self.next_page = start
+        self.process = None
+        self.receiver = None
+        self._start_child()
+
+    def _start_child(self):
+        self.receiver, sender = self.context.Pipe(duplex=False)
+        self.process = self.context.Process(
+            target=_extract_in_child,
+            args=(self.file_path, self.next_page, self.stop, self.limits.memory_limit, sender),
+            daemon=True
+        )
+        self.process.start()
+        sender.close()
+
+    def close(self):
+        """Kill the current child, if any."""
+        if self.process is not None:
+            if self.process.is_alive():
+                self.process.kill()
+            self.process.join()
+            self.receiver.close()
+            self.process = None
+
+    def receive(self):
+        """Wait for the next message of the child within the page budget.
+
+        Returns:
+            The message, or (reason,) if the child timed out or died.
+        """
+        remaining = self.deadline - time.monotonic()
+        if remaining <= 0 or not self.receiver.poll(min(self.limits.page_timeout, remaining)):
+            self.close()
+            return (DOCUMENT_TIMEOUT if time.monotonic() >= self.deadline else TIMEOUT,)
+        try:
+            return self.receiver.recv()
+        except EOFError:
+            self.close()
+            return (CRASHED,)
+
+    def pages(self) -> Iterator[Tuple[int, Optional[str], Optional[str]]]:
+        """Yield (page index, text, skip reason) for every page of the range."""
+        try:
+            while self.next_page < self.stop:
+                if time.monotonic() >= self.deadline:
+                    self.close()
+                    for page_num in range(self.next_page, self.stop):
+                        yield page_num, None, DOCUMENT_TIMEOUT
+                    return
+                if self.process is None:
+                    self._start_child()
+
+                message = self.receive()
+                kind = message[0]
+                if kind == 'total':
+                    continue
+                if kind == 'error':
+                    raise SandboxError(message[1])
+                if kind == 'page':
+                    _, page_num, text, seconds = message
+                    EXTRACTION_PAGE_SECONDS.observe(seconds)
+                    yield page_num, text, None
+                elif kind == 'skip':
+                    _, page_num, reason = message
+                    self.close()
+                    yield page_num, None, reason
+                elif kind == DOCUMENT_TIMEOUT:
+                    continue
+                else:
+                    page_num = self.next_page
+                    yield page_num, None, kind
+                self.next_page = page_num + 1
+        finally:
+            self.close()
+
+
+def count_pages(file_path: str, limits: SandboxLimits) -> int:
+    """Open a document in a child process and return its page count.
+
+    Raises:
+        SandboxError: If the document cannot be opened within the page budget.
+    """
+    extraction = _RangeExtraction(
+        process_context(), file_path, 0, 0, limits, time.monotonic() + limits.page_timeout
+    )
+    try:
+        message = extraction.receive()
+    finally:
+        extraction.close()
+    if message[0] == 'total':
+        return message[1]
+    if message[0] == 'error':
+        raise SandboxError(message[1])
+    if message[0] == CRASHED:
+        raise SandboxError("Opening the PDF crashed the extractor")
+    raise SandboxError("Opening the PDF timed out")
+
+
+def extract_ranges(file_path: str, total_pages: int, ranges: List[Tuple[int, int]],
+                   limits: SandboxLimits, concurrency: int = 1,
+                   on_progress: Optional[Callable] = None,
+                   on_skip: Optional[Callable] = None) -> Iterator[Tuple[int, int, str]]:
+    """Extract page ranges in sandboxed children, yielding pages in order.
+
+    Up to ``concurrency`` ranges are extracted at once. Children of ranges
+    that are not being read yet block once their pipe is full, so text
+    extracted ahead of the consumer stays bounded; their page budget starts
+    counting when the consumer reaches them.
+
+    Args:
+        file_path: Path to the PDF file.
+        total_pages: Page count, see count_pages.
+        ranges: Contiguous (start, stop) page index ranges, in order.
+        limits: Time and memory budgets.
+        concurrency: Maximum number of ranges extracted at once.
+        on_progress: Optional callable receiving (pages_done, total_pages).
+        on_skip: Optional callable receiving (page_number, reason) for every
+            skipped page.
+
+    Yields:
+        tuple: (page_number, total_pages, text) with 1-based page numbers;
+        skipped pages have a placeholder text.
+    """
+    context = process_context()
+    deadline = time.monotonic() + limits.document_timeout
+    pending = deque(ranges)
+    in_flight = deque()
+    pages_done = 0
+    try:
+        while pending or in_flight:
+            while pending and len(in_flight) < max(1, concurrency):
+                start, stop = pending.popleft()
+                in_flight.append(_RangeExtraction(context, file_path, start, stop, limits, deadline))
+            for page_num, text, reason in in_flight[0].pages():
+                if reason is not None:
+                    text = skipped_text(page_num + 1, reason)
+                    if on_skip:
+                        on_skip(page_num + 1, reason)
+                pages_done += 1
+                if on_progress:
+                    on_progress(pages_done, total_pages)
+                yield page_num + 1, total_pages, text
+            in_flight.popleft()
+    finally:
+        for extraction in in_flight:
+            extraction.close()
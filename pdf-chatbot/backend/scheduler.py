@@ -0,0 +1,228 @@
+"""
+Ordering of queued extraction jobs for the local dispatcher.
+
+A plain FIFO queue lets one large scanned manual hold up every small
+document queued behind it. ExtractionScheduler instead picks the next job
+in three steps:
+
+- Fairness: among tenants with queued work, the tenant that has been
+  served the fewest estimated pages goes next, so one tenant uploading a
+  large batch cannot monopolize the workers. A tenant that was idle starts
+  level with the active ones instead of banking credit.
+- Shortest job first with aging: within that tenant, the job with the
+  lowest ``log2(1 + cost) - waited / aging_seconds`` goes next. Smaller
+  documents win, but every ``aging_seconds`` of waiting counts as much as
+  halving a document's size, so large jobs are not starved.
+- Fast lane: workers reserved for the fast lane only take documents of at
+  most ``fast_lane_pages`` estimated pages, so small uploads start promptly
+  even while every other worker is busy with large ones.
+
+Jobs that did not fit in the scheduler wait in the job table; when slots
+free up, ``admission_order`` picks which of them to admit by the same rules.
+
+Costs are estimated from the page count and file size recorded at upload,
+in page equivalents. Queue wait time and the number of older jobs each job
+was started ahead of are recorded per lane in metrics.py.
+"""
+import itertools
+import math
+import queue
+import threading
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+from metrics import EXTRACTION_OVERTAKEN_JOBS, EXTRACTION_QUEUE_SECONDS
+
+DEFAULT_TENANT = 'default'
+
+# Bytes of a typical text page; scanned pages are far larger and are
+# costed by size rather than by their page count
+ESTIMATED_PAGE_BYTES = 64 * 1024
+
+
+def estimate_cost(page_count: Optional[int], file_size: Optional[int]) -> float:
+    """Estimate the extraction cost of a document in page equivalents.
+
+    Args:
+        page_count: Page count from the upload pre-scan, if known.
+        file_size: File size in bytes, if known.
+
+    Returns:
+        The larger of the page count and the size in typical pages, at least 1.
+    """
+    return float(max(1, page_count or 0, (file_size or 0) / ESTIMATED_PAGE_BYTES))
+
+
+class ScheduledJob(NamedTuple):
+    """A job waiting in the scheduler."""
+    job_id: object
+    tenant: str
+    cost: float
+    enqueued: float  # Scheduler clock time the job was queued at
+    sequence: int  # Arrival order
+
+
+class ExtractionScheduler:
+    """Thread-safe queue handing out extraction jobs in priority order.
+
+    Used like ``queue.Queue``: ``put`` raises ``queue.Full`` when the
+    scheduler holds ``maxsize`` jobs, and every job returned by ``get`` must
+    be confirmed with ``task_done`` for ``join`` to return.
+    """
+
+    def __init__(self, maxsize: int = 100, aging_seconds: float = 30.0,
+                 fast_lane_pages: float = 10, clock: Callable = time.monotonic):
+        """Initialize the scheduler.
+
+        Args:
+            maxsize: Maximum number of waiting jobs.
+            aging_seconds: Waiting time that offsets a doubling of job cost.
+            fast_lane_pages: Largest cost, in page equivalents, of a fast lane job.
+            clock: Monotonic clock, replaceable in tests.
+        """
+        self.maxsize = maxsize
+        self.aging_seconds = aging_seconds
+        self.fast_lane_pages = fast_lane_pages
+        self._clock = clock
+        self._jobs: List[ScheduledJob] = []
+        self._served: Dict[str, float] = {}
+        self._sequence = itertools.count()
+        self._unfinished = 0
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def put(self, job_id, tenant: Optional[str] = None, cost: float = 1.0,
+            waited: float = 0.0) -> None:
+        """Queue a job.
+
+        Args:
+            job_id: ID of the ExtractionJob.
+            tenant: Tenant the job is accounted to; None for the default tenant.
+            cost: Estimated cost in page equivalents, see estimate_cost.
+            waited: Seconds the job has already been queued, e.g. before a restart.
+
+        Raises:
+            queue.Full: If the scheduler is full or closed.
+        """
+        tenant = tenant or DEFAULT_TENANT
+        with self._condition:
+            if self._closed or len(self._jobs) >= self.maxsize:
+                raise queue.Full
+            if tenant not in self._served:
+                self._served[tenant] = min(self._served.values(), default=0.0)
+            self._jobs.append(ScheduledJob(
+                job_id, tenant, cost, self._clock() - waited, next(self._sequence)
+            ))
+            self._unfinished += 1
+            self._condition.notify_all()
+
+    def get(self, fast_lane: bool = False) -> Optional[ScheduledJob]:
+        """Remove and return the next job, blocking until one is eligible.
+
+        Args:
+            fast_lane: Only return jobs small enough for the fast lane.
+
+        Returns:
+            The job to run, or None once the scheduler is closed and holds no
+            eligible job.
+        """
+        with self._condition:
+            while True:
+                eligible = [job for job in self._jobs
+                            if not fast_lane or self.in_fast_lane(job.cost)]
+                if eligible:
+                    break
+                if self._closed:
+                    return None
+                self._condition.wait()
+
+            now = self._clock()
+            job = self._select(eligible, now)
+            overtaken = sum(1 for other in self._jobs if other.sequence < job.sequence)
+            self._jobs.remove(job)
+            self._served[job.tenant] += job.cost
+            if not any(other.tenant == job.tenant for other in self._jobs):
+                del self._served[job.tenant]
+
+        lane = 'fast' if self.in_fast_lane(job.cost) else 'standard'
+        EXTRACTION_QUEUE_SECONDS.observe(now - job.enqueued, lane)
+        EXTRACTION_OVERTAKEN_JOBS.observe(overtaken, lane)
+        return job
+
+    def admission_order(self, candidates: Sequence[Tuple[object, Optional[str], float, float]]
+                        ) -> List[object]:
+        """Order jobs waiting outside the scheduler by the priority get() would give them.
+
+        Tenants take turns, the least served first, continuing from the
+        pages already served to tenants in the scheduler; each tenant's jobs
+        go in order of aged cost.
+
+        Args:
+            candidates: (job_id, tenant, cost, waited) of each waiting job,
+                oldest first.
+
+        Returns:
+            The job ids, in the order to put them.
+        """
+        with self._condition:
+            served = dict(self._served)
+        start = min(served.values(), default=0.0)
+        queues: Dict[str, List] = {}
+        for sequence, (job_id, tenant, cost, waited) in enumerate(candidates):
+            queues.setdefault(tenant or DEFAULT_TENANT, []).append((
+                math.log2(1 + cost) - waited / self.aging_seconds, sequence, cost, job_id
+            ))
+        for tenant, jobs in queues.items():
+            jobs.sort(reverse=True)  # Best last, to pop
+            served.setdefault(tenant, start)
+
+        order = []
+        while queues:
+            tenant = min(queues, key=lambda name: (served[name], queues[name][-1][1]))
+            _, _, cost, job_id = queues[tenant].pop()
+            order.append(job_id)
+            served[tenant] += cost
+            if not queues[tenant]:
+                del queues[tenant]
+        return order
+
+    def in_fast_lane(self, cost: float) -> bool:
+        """Whether a job of the given cost may run in the fast lane."""
+        return cost <= self.fast_lane_pages
+
+    def task_done(self) -> None:
+        """Confirm that a job returned by ``get`` has been processed."""
+        with self._condition:
+            self._unfinished -= 1
+            if self._unfinished <= 0:
+                self._condition.notify_all()
+
+    def join(self) -> None:
+        """Block until every queued job has been processed."""
+        with self._condition:
+            while self._unfinished > 0:
+                self._condition.wait()
+
+    def close(self) -> None:
+        """Stop accepting jobs; ``get`` returns None once the queue is drained."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def qsize(self) -> int:
+        """Number of waiting jobs."""
+        with self._condition:
+            return len(self._jobs)
+
+    def _select(self, eligible: List[ScheduledJob], now: float) -> ScheduledJob:
+        # Ties go to the tenant with the oldest eligible job
+        oldest = {}
+        for job in eligible:
+            oldest.setdefault(job.tenant, job.sequence)
+        tenant = min(oldest, key=lambda name: (self._served[name], oldest[name]))
+        return min(
+            (job for job in eligible if job.tenant == tenant),
+            key=lambda job: (
+                math.log2(1 + job.cost) - (now - job.enqueued) / self.aging_seconds,
+                job.sequence
+            )
+        )
@@ -1,13 +1,15 @@
 import os
 import pytest
 from app import create_app
-from models import db as _db, PDFDocument, ChatMessage
+from config import TestingConfig
+from chatbot import ChatbotService
+from models import db as _db, PDFDocument, PDFPage, ChatMessage
 from datetime import datetime, timedelta
 
 @pytest.fixture
 def app():
     """Create application for the tests."""
-    _app = create_app('testing')
+    _app = create_app(TestingConfig)
     # Ensure test upload folder exists
     os.makedirs(_app.config['UPLOAD_FOLDER'], exist_ok=True)
     return _app
@@ -31,36 +33,109 @@ def mock_pdf_content():
     """Create mock PDF content for testing."""
     return b"%PDF-1.4\n%PDF-1.4\n1 0 obj\n<</Type/Catalog/Pages 2 0 R>>\nendobj"
 
+def build_pdf(page_texts, info=None):
+    """Build a minimal PDF with one line of Helvetica text per page.
+    
+    ``info`` optionally maps document information keys such as 'Title' to
+    literal string values.
+    """
+    objects = [
+        b"<</Type/Catalog/Pages 2 0 R>>",
+        None,  # Page tree, filled in once the page objects are numbered
+        b"<</Type/Font/Subtype/Type1/BaseFont/Helvetica>>",
+    ]
+    kids = []
+    for text in page_texts:
+        escaped = text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+        stream = f"BT /F1 12 Tf 72 720 Td ({escaped}) Tj ET".encode('latin-1')
+        objects.append(b"<</Length %d>>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(
+            b"<</Type/Page/Parent 2 0 R/MediaBox[0 0 612 792]"
+            b"/Resources<</Font<</F1 3 0 R>>>>/Contents %d 0 R>>" % len(objects)
+        )
+        kids.append(b"%d 0 R" % len(objects))
+    objects[1] = b"<</Type/Pages/Kids[%s]/Count %d>>" % (b" ".join(kids), len(kids))
+    trailer_info = b""
+    if info:
+        objects.append(b"<<%s>>" % b"".join(
+            b"/%s(%s)" % (key.encode('latin-1'), value.encode('latin-1'))
+            for key, value in info.items()
+        ))
+        trailer_info = b"/Info %d 0 R" % len(objects)
+    
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref_offset = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<</Size %d/Root 1 0 R%s>>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1, trailer_info, xref_offset
+    )
+    return bytes(out)
+
 @pytest.fixture
-def sample_pdf(db):
-    """Create a sample PDF document for testing."""
+def make_pdf(tmp_path):
+    """Write a generated PDF to a temporary file and return its path."""
+    def _make_pdf(page_texts, name='generated.pdf', info=None):
+        path = tmp_path / name
+        path.write_bytes(build_pdf(page_texts, info))
+        return str(path)
+    return _make_pdf
+
+def create_document(db, page_texts, **fields):
+    """Create a processed PDFDocument with the given page texts."""
+    fields.setdefault('filename', 'sample.pdf')
+    fields.setdefault('file_path', '/tmp/sample.pdf')
+    fields.setdefault('file_size', 1024)
     pdf = PDFDocument(
-        filename='sample.pdf',
-        file_path='/tmp/sample.pdf',
-        file_size=1024,
-        content='Sample PDF content for testing.\nThis document contains test data.',
-        upload_date=datetime.utcnow()
+        extracted_text=PDFPage.PAGE_SEPARATOR.join(page_texts),
+        page_count=len(page_texts),
+        processing_status='completed',
+        **fields
     )
     db.session.add(pdf)
+    db.session.flush()
+    db.session.add_all(PDFPage(**row) for row in PDFPage.rows_for(pdf.id, page_texts))
     db.session.commit()
     return pdf
 
+def create_chat_message(pdf, message, is_user, user_id=1, **fields):
+    """Build a ChatMessage in a user's conversation about a document."""
+    return ChatMessage(
+        pdf_document_id=pdf.id,
+        message_type='user' if is_user else 'assistant',
+        content=message,
+        conversation_id=ChatbotService._conversation_id(user_id, pdf.id),
+        **fields
+    )
+
+@pytest.fixture
+def sample_pdf(db):
+    """Create a sample PDF document for testing."""
+    return create_document(
+        db,
+        ['Sample PDF content for testing.\nThis document contains test data.'],
+        upload_date=datetime.utcnow()
+    )
+
 @pytest.fixture
 def sample_chat_history(db, sample_pdf):
     """Create sample chat history for testing."""
     base_time = datetime.utcnow()
     messages = [
-        ChatMessage(
-            user_id=1,
-            pdf_id=str(sample_pdf.id),
-            message="What is this document about?",
+        create_chat_message(
+            sample_pdf,
+            "What is this document about?",
             is_user=True,
             timestamp=base_time
         ),
-        ChatMessage(
-            user_id=1,
-            pdf_id=str(sample_pdf.id),
-            message="This document contains test data for our application.",
+        create_chat_message(
+            sample_pdf,
+            "This document contains test data for our application.",
             is_user=False,
             timestamp=base_time + timedelta(seconds=1)
         )
@@ -0,0 +1,94 @@
+"""Tests for the chatbot answer cache."""
+import pytest
+from answer_cache import (
+    LocalAnswerCache, RedisAnswerCache, create_answer_cache, normalize_question
+)
+from chatbot import ChatbotService
+from pdf_handler import PDFHandler
+from retrieval import DocumentIndex
+from tests.conftest import create_document
+
+def test_normalize_question():
+    """Test that case, punctuation and stopwords do not change the key."""
+    assert normalize_question("What are the Holidays?") == normalize_question("holidays")
+
+def test_hit_miss_and_lru_eviction():
+    """Test counters and least recently used eviction."""
+    cache = LocalAnswerCache(max_size=2)
+    cache.set("doc", "hash", "first", ("one", 0.9))
+    cache.set("doc", "hash", "second", ("two", 0.8))
+
+    assert cache.get("doc", "hash", "First?") == ("one", 0.9)
+    cache.set("doc", "hash", "third", ("three", 0.7))
+
+    assert cache.get("doc", "hash", "second") is None
+    assert cache.get("doc", "other-hash", "first") is None
+    assert cache.stats() == {
+        'backend': 'local', 'hits': 1, 'misses': 2, 'evictions': 1, 'size': 2
+    }
+
+def test_ttl_expiry(mocker):
+    """Test that entries expire after the TTL."""
+    clock = mocker.patch('answer_cache.time.monotonic', return_value=100.0)
+    cache = LocalAnswerCache(ttl=10)
+    cache.set("doc", "hash", "question", ("answer", 1.0))
+
+    clock.return_value = 109.0
+    assert cache.get("doc", "hash", "question") == ("answer", 1.0)
+    clock.return_value = 111.0
+    assert cache.get("doc", "hash", "question") is None
+    assert cache.stats()['evictions'] == 1
+
+def test_invalidate_document():
+    """Test that invalidation only drops the given document's answers."""
+    cache = LocalAnswerCache()
+    cache.set("doc-a", "hash", "question", ("a", 1.0))
+    cache.set("doc-b", "hash", "question", ("b", 1.0))
+
+    assert cache.invalidate("doc-a") == 1
+    assert cache.get("doc-a", "hash", "question") is None
+    assert cache.get("doc-b", "hash", "question") == ("b", 1.0)
+
+def test_redis_backend(mocker):
+    """Test the shared backend against a mocked Redis client."""
+    client = mocker.Mock()
+    cache = RedisAnswerCache("redis://cache", ttl=60, client=client)
+
+    cache.set("doc", "hash", "question", ("answer", 0.5))
+    key, value = client.set.call_args.args
+    assert key.startswith("pdf-chatbot:answers:doc:")
+    assert client.set.call_args.kwargs == {'ex': 60}
+
+    client.get.return_value = value
+    assert cache.get("doc", "hash", "Question?") == ("answer", 0.5)
+    client.scan_iter.return_value = iter([key])
+    assert cache.invalidate("doc") == 1
+    client.delete.assert_called_once_with(key)
+
+def test_create_answer_cache():
+    """Test backend selection from configuration."""
+    assert isinstance(create_answer_cache({'ANSWER_CACHE_SIZE': 8}), LocalAnswerCache)
+    assert create_answer_cache({'ANSWER_CACHE_SIZE': 0}) is None
+
+def test_repeated_question_skips_retrieval(db, mocker):
+    """Test that a cached answer is returned without searching the index."""
+    pdf = create_document(db, ["Parking permits are issued by the facilities desk."])
+    service = ChatbotService(answer_cache=LocalAnswerCache())
+    first = service.process_message(1, str(pdf.id), "Where are parking permits issued?")
+
+    search = mocker.spy(DocumentIndex, 'search')
+    second = service.process_message(1, str(pdf.id), "where are PARKING permits issued")
+
+    assert second == first
+    search.assert_not_called()
+    assert len(service.get_chat_history(1, str(pdf.id))) == 4
+
+def test_extraction_invalidates_answers(app, db, make_pdf, tmp_path):
+    """Test that re-extracting a document drops its cached answers."""
+    cache = app.extensions['answer_cache']
+    handler = PDFHandler(str(tmp_path))
+    pdf = create_document(db, ["Old text"], file_path=make_pdf(["New text"]))
+    cache.set(pdf.id, pdf.content_hash, "question", ("old answer", 1.0))
+
+    assert handler.extract_text(pdf.id)['status'] == 'success'
+    assert cache.get(pdf.id, pdf.content_hash, "question") is None
@@ -1,20 +1,20 @@
 """Integration tests for the chat API endpoints."""
 import json
+from datetime import datetime, timedelta
 import pytest
 from models import PDFDocument, ChatMessage
+from tests.conftest import create_chat_message, create_document
 
 @pytest.fixture
 def test_pdf(db):
     """Create a test PDF document."""
-    pdf = PDFDocument(
+    return create_document(
+        db,
+        ['This is a test document with some content for testing the chatbot API.'],
         filename='test.pdf',
         file_path='/tmp/test.pdf',
-        file_size=1000,
-        content='This is a test document with some content for testing the chatbot API.'
+        file_size=1000
     )
-    db.session.add(pdf)
-    db.session.commit()
-    return pdf
 
 def test_chat_message_endpoint_success(client, test_pdf):
     """Test successful chat message processing."""
@@ -32,6 +32,7 @@ def test_chat_message_endpoint_success(client, test_pdf):
     assert isinstance(data['confidence'], float)
     assert len(data['response']) > 0
     assert data['confidence'] > 0  # Should have some confidence for relevant query
+    assert data['coverage'] == {'pages_indexed': 1, 'total_pages': 1, 'complete': True}
 
 def test_chat_message_endpoint_no_message(client, test_pdf):
     """Test chat endpoint with missing message."""
@@ -78,18 +79,8 @@ def test_chat_history_endpoint_success(client, test_pdf, db):
     """Test successful retrieval of chat history."""
     # Add some test messages
     messages = [
-        ChatMessage(
-            user_id=1,
-            pdf_id=str(test_pdf.id),
-            message="Test message 1",
-            is_user=True
-        ),
-        ChatMessage(
-            user_id=1,
-            pdf_id=str(test_pdf.id),
-            message="Test response 1",
-            is_user=False
-        )
+        create_chat_message(test_pdf, "Test message 1", is_user=True),
+        create_chat_message(test_pdf, "Test response 1", is_user=False)
     ]
     for msg in messages:
         db.session.add(msg)
@@ -156,4 +147,150 @@ def test_chat_message_sequence(client, test_pdf):
     history_response = client.get(f'/api/chat/{test_pdf.id}/history')
     assert history_response.status_code == 200
     history_data = json.loads(history_response.data)
-    assert len(history_data['history']) == 4  # 2 user messages + 2 bot responses
\ No newline at end of file
+    assert len(history_data['history']) == 4  # 2 user messages + 2 bot responses
+def test_answer_cache_stats_endpoint(client, test_pdf):
+    """Test that repeated questions show up as cache hits."""
+    for _ in range(2):
+        client.post(f'/api/chat/{test_pdf.id}', json={'message': 'What is in the document?'})
+    
+    response = client.get('/api/chat/cache')
+    assert response.status_code == 200
+    cache = json.loads(response.data)['cache']
+    assert cache['backend'] == 'local'
+    assert cache['hits'] == 1
+    assert cache['misses'] == 1
+
+@pytest.fixture
+def long_history(db, test_pdf):
+    """Store five messages one second apart."""
+    start = datetime(2024, 1, 1, 12, 0, 0)
+    db.session.add_all(
+        create_chat_message(test_pdf, f"Message {i}", is_user=i % 2 == 0,
+                            timestamp=start + timedelta(seconds=i))
+        for i in range(5)
+    )
+    db.session.commit()
+
+def history_messages(response):
+    return [msg['message'] for msg in json.loads(response.data)['history']]
+
+def test_chat_history_pagination(client, test_pdf, long_history):
+    """Test paging backwards through history with keyset cursors."""
+    first = client.get(f'/api/chat/{test_pdf.id}/history?limit=2')
+    data = json.loads(first.data)
+    assert history_messages(first) == ["Message 3", "Message 4"]
+    assert data['has_more'] is True
+    
+    second = client.get(
+        f"/api/chat/{test_pdf.id}/history?limit=2&before={data['cursors']['before']}"
+    )
+    assert history_messages(second) == ["Message 1", "Message 2"]
+    
+    last = client.get(
+        f"/api/chat/{test_pdf.id}/history?limit=2"
+        f"&before={json.loads(second.data)['cursors']['before']}"
+    )
+    assert history_messages(last) == ["Message 0"]
+    assert json.loads(last.data)['has_more'] is False
+
+def test_chat_history_since_returns_only_new_messages(client, db, test_pdf, long_history):
+    """Test delta sync with the since cursor."""
+    data = json.loads(client.get(f'/api/chat/{test_pdf.id}/history').data)
+    since = data['cursors']['since']
+    
+    empty = client.get(f'/api/chat/{test_pdf.id}/history?since={since}')
+    assert history_messages(empty) == []
+    assert json.loads(empty.data)['cursors']['since'] == since
+    
+    db.session.add(create_chat_message(test_pdf, "Message 5", is_user=True,
+                                       timestamp=datetime(2024, 1, 1, 12, 1)))
+    db.session.commit()
+    assert history_messages(
+        client.get(f'/api/chat/{test_pdf.id}/history?since={since}')
+    ) == ["Message 5"]
+
+def test_chat_history_not_modified(client, db, test_pdf, long_history):
+    """Test ETag revalidation of an unchanged history page."""
+    url = f'/api/chat/{test_pdf.id}/history'
+    response = client.get(url)
+    etag = response.headers['ETag']
+    
+    cached = client.get(url, headers={'If-None-Match': etag})
+    assert cached.status_code == 304
+    assert cached.data == b''
+    
+    db.session.add(create_chat_message(test_pdf, "Message 5", is_user=True,
+                                       timestamp=datetime(2024, 1, 1, 12, 1)))
+    db.session.commit()
+    changed = client.get(url, headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert history_messages(changed)[-1] == "Message 5"
+
+def test_chat_history_invalid_parameters(client, test_pdf):
+    """Test that malformed cursors and limits are rejected."""
+    assert client.get(f'/api/chat/{test_pdf.id}/history?since=bogus').status_code == 400
+    assert client.get(f'/api/chat/{test_pdf.id}/history?limit=0').status_code == 400
+
+def parse_sse(body):
+    """Split a Server-Sent Events body into (event, data) pairs."""
+    events = []
+    for block in body.decode('utf-8').strip().split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in block.split('\n'))
+        events.append((fields['event'], json.loads(fields['data'])))
+    return events
+
+def test_chat_stream_endpoint(client, db):
+    """Test that the SSE endpoint streams chunks and stores the exchange once."""
+    pdf = create_document(db, ["Parking permits are issued by the facilities desk."])
+    
+    response = client.post(f'/api/chat/{pdf.id}/stream', json={'message': 'parking permits'})
+    
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    events = parse_sse(response.data)
+    chunks = [data['text'] for event, data in events if event == 'chunk']
+    event, done = events[-1]
+    assert event == 'done'
+    # The answer is a single passage, sent as one chunk
+    assert chunks == [done['response']]
+    assert done['response'].endswith('(page 1)')
+    assert done['confidence'] > 0
+    
+    history = json.loads(client.get(f'/api/chat/{pdf.id}/history').data)['history']
+    assert [msg['message'] for msg in history] == ['parking permits', done['response']]
+
+def test_chat_stream_query_parameter(client, test_pdf):
+    """Test EventSource-style requests and the missing message error."""
+    response = client.get(f'/api/chat/{test_pdf.id}/stream?message=document')
+    assert parse_sse(response.data)[-1][0] == 'done'
+    
+    assert client.get(f'/api/chat/{test_pdf.id}/stream').status_code == 400
+
+def test_chat_batch_endpoint(client, db):
+    """Test answering several questions in one request, in input order."""
+    pdf = create_document(db, [
+        "Parking permits are issued by the facilities desk.",
+        "Annual leave requests are approved by your manager."
+    ])
+    questions = ['annual leave approval', 'parking permits', 'quantum chromodynamics']
+    
+    response = client.post(f'/api/chat/{pdf.id}/batch', json={'messages': questions})
+    
+    assert response.status_code == 200
+    results = json.loads(response.data)['results']
+    assert [result['message'] for result in results] == questions
+    assert results[0]['response'].endswith('(page 2)')
+    assert results[1]['response'].endswith('(page 1)')
+    assert results[2]['confidence'] == 0.0
+    
+    history = json.loads(client.get(f'/api/chat/{pdf.id}/history').data)['history']
+    assert [msg['message'] for msg in history if msg['is_user']] == questions
+
+@pytest.mark.parametrize('body', [
+    {}, {'messages': []}, {'messages': 'not a list'}, {'messages': ['ok', '']},
+    {'messages': ['question'] * 101}
+])
+def test_chat_batch_endpoint_invalid_body(client, test_pdf, body):
+    """Test that malformed or oversized batches are rejected."""
+    response = client.post(f'/api/chat/{test_pdf.id}/batch', json=body)
+    assert response.status_code == 400
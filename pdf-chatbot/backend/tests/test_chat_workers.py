@@ -0,0 +1,54 @@
+"""Tests for the Socket.IO chat worker pool."""
+import threading
+import pytest
+from flask import current_app
+from app import socketio
+from chat_workers import ChatQueueFull, ChatWorkerPool
+
+def test_runs_tasks_in_app_context(app):
+    """Test that queued tasks run on workers with an application context."""
+    pool = ChatWorkerPool(app, socketio, workers=2, max_queue=10)
+    seen = []
+    for number in range(5):
+        pool.submit(lambda n: seen.append((n, current_app.name)), number)
+    pool.join()
+
+    assert sorted(n for n, _ in seen) == list(range(5))
+    assert {name for _, name in seen} == {app.name}
+    assert pool.stats()['completed'] == 5
+    assert pool.stats()['queue_depth'] == 0
+
+def test_rejects_when_queue_is_full(app):
+    """Test that submissions beyond the queue bound are rejected and counted."""
+    pool = ChatWorkerPool(app, socketio, workers=1, max_queue=1)
+    started, release = threading.Event(), threading.Event()
+
+    def block():
+        started.set()
+        release.wait(5)
+
+    pool.submit(block)
+    assert started.wait(5)
+    pool.submit(lambda: None)
+    assert pool.queue_depth() == 1
+
+    with pytest.raises(ChatQueueFull):
+        pool.submit(lambda: None)
+
+    stats = pool.stats()
+    assert stats['active'] == 1
+    assert stats['rejected'] == 1
+
+    release.set()
+    pool.join()
+    assert pool.stats()['completed'] == 2
+
+def test_failed_task_is_counted(app):
+    """Test that a crashing task does not stop the pool."""
+    pool = ChatWorkerPool(app, socketio, workers=0)
+    pool.submit(lambda: 1 / 0)
+    pool.submit(lambda: None)
+
+    stats = pool.stats()
+    assert stats['failed'] == 1
+    assert stats['completed'] == 1
@@ -1,9 +1,13 @@
 """Unit tests for the ChatbotService class."""
 import pytest
-import torch
+import numpy as np
+from datetime import datetime, timedelta
 from unittest.mock import Mock, patch
-from chatbot import ChatbotService
-from models import PDFDocument, ChatMessage
+from answer_cache import LocalAnswerCache
+from chatbot import ChatbotService, PageCoverage
+from retrieval import DocumentIndex, HashingEmbedder
+from models import PDFDocument, PDFPage, ChatMessage
+from tests.conftest import create_chat_message, create_document
 
 @pytest.fixture
 def chatbot_service():
@@ -13,38 +17,38 @@ def chatbot_service():
 @pytest.fixture
 def mock_pdf_document(db):
     """Create a mock PDF document for testing."""
-    pdf = PDFDocument(
+    return create_document(
+        db,
+        ['This is a test document.\n\nIt contains multiple paragraphs.\n\n'
+         'The chatbot should be able to find relevant information.'],
         filename='test.pdf',
         file_path='/tmp/test.pdf',
-        file_size=1000,
-        content='This is a test document.\n\nIt contains multiple paragraphs.\n\n'
-                'The chatbot should be able to find relevant information.'
+        file_size=1000
     )
-    db.session.add(pdf)
-    db.session.commit()
-    return pdf
 
-def test_encode_text(chatbot_service):
+def test_encode_text():
     """Test text encoding functionality."""
     text = "Test message"
-    encoding = chatbot_service._encode_text(text)
+    encoding = HashingEmbedder().embed(text)
     
-    assert isinstance(encoding, torch.Tensor)
-    assert encoding.dim() == 1  # Should be a 1D tensor
-    assert encoding.size(0) == 384  # Expected embedding size for all-MiniLM-L6-v2
+    assert isinstance(encoding, np.ndarray)
+    assert encoding.ndim == 1  # Should be a 1D vector
+    assert encoding.shape[0] == 256  # Default embedding width
+    assert encoding.dtype == np.float32
 
-def test_compute_similarity(chatbot_service):
+def test_compute_similarity():
     """Test similarity computation between two text embeddings."""
+    embedder = HashingEmbedder()
     text1 = "This is a test message"
     text2 = "This is also a test message"
     
-    embedding1 = chatbot_service._encode_text(text1)
-    embedding2 = chatbot_service._encode_text(text2)
+    embedding1 = embedder.embed(text1)
+    embedding2 = embedder.embed(text2)
     
-    similarity = chatbot_service._compute_similarity(embedding1, embedding2)
+    similarity = float(embedding1 @ embedding2)
     
     assert isinstance(similarity, float)
-    assert 0 <= similarity <= 1  # Similarity should be between 0 and 1
+    assert 0 <= similarity <= 1.0001  # Similarity should be between 0 and 1
 
 def test_process_message_with_relevant_content(chatbot_service, mock_pdf_document, db):
     """Test processing a message that has relevant content in the PDF."""
@@ -64,15 +68,12 @@ def test_process_message_with_relevant_content(chatbot_service, mock_pdf_documen
     assert "test document" in response.lower()
     
     # Verify chat messages were stored
-    messages = ChatMessage.query.filter_by(
-        user_id=user_id,
-        pdf_id=str(mock_pdf_document.id)
-    ).all()
+    messages = chatbot_service.get_chat_history(user_id, str(mock_pdf_document.id))
     assert len(messages) == 2  # Should have user message and bot response
-    assert messages[0].is_user is True
-    assert messages[0].message == message
-    assert messages[1].is_user is False
-    assert messages[1].message == response
+    assert messages[0]['is_user'] is True
+    assert messages[0]['message'] == message
+    assert messages[1]['is_user'] is False
+    assert messages[1]['message'] == response
 
 def test_process_message_with_irrelevant_content(chatbot_service, mock_pdf_document, db):
     """Test processing a message that has no relevant content in the PDF."""
@@ -92,10 +93,7 @@ def test_process_message_with_irrelevant_content(chatbot_service, mock_pdf_docum
     assert "rephrase" in response.lower()  # Should ask user to rephrase
     
     # Verify chat messages were stored
-    messages = ChatMessage.query.filter_by(
-        user_id=user_id,
-        pdf_id=str(mock_pdf_document.id)
-    ).all()
+    messages = ChatMessage.query.filter_by(pdf_document_id=mock_pdf_document.id).all()
     assert len(messages) == 2  # Should have user message and bot response
 
 def test_process_message_invalid_pdf(chatbot_service, db):
@@ -118,25 +116,14 @@ def test_get_chat_history(chatbot_service, mock_pdf_document, db):
     pdf_id = str(mock_pdf_document.id)
     
     # Add some test messages
+    base_time = datetime.utcnow()
     messages = [
-        ChatMessage(
-            user_id=user_id,
-            pdf_id=pdf_id,
-            message="User message 1",
-            is_user=True
-        ),
-        ChatMessage(
-            user_id=user_id,
-            pdf_id=pdf_id,
-            message="Bot response 1",
-            is_user=False
-        ),
-        ChatMessage(
-            user_id=user_id,
-            pdf_id=pdf_id,
-            message="User message 2",
-            is_user=True
-        )
+        create_chat_message(mock_pdf_document, "User message 1", is_user=True,
+                            user_id=user_id, timestamp=base_time),
+        create_chat_message(mock_pdf_document, "Bot response 1", is_user=False,
+                            user_id=user_id, timestamp=base_time + timedelta(seconds=1)),
+        create_chat_message(mock_pdf_document, "User message 2", is_user=True,
+                            user_id=user_id, timestamp=base_time + timedelta(seconds=2))
     ]
     for msg in messages:
         db.session.add(msg)
@@ -153,4 +140,155 @@ def test_get_chat_history(chatbot_service, mock_pdf_document, db):
         "User message 1",
         "Bot response 1",
         "User message 2"
-    ]
\ No newline at end of file
+    ]
+def test_process_message_cites_page(chatbot_service, db):
+    """Test that answers quote the best passage and cite its page."""
+    pdf = create_document(db, [
+        "Welcome to the staff handbook.",
+        "Parking permits are issued by the facilities desk on the ground floor."
+    ])
+
+    response, confidence = chatbot_service.process_message(
+        user_id=1,
+        pdf_id=str(pdf.id),
+        message="Where do I get a parking permit?"
+    )
+
+    assert "facilities desk" in response
+    assert response.endswith("(page 2)")
+    assert confidence > 0.5
+
+def test_process_message_uses_extraction_index(chatbot_service, db, tmp_path, mocker):
+    """Test that the index written at extraction time is used when present."""
+    from pdf_handler import PDFHandler
+    from tests.conftest import build_pdf
+    from io import BytesIO
+
+    handler = PDFHandler(str(tmp_path / "uploads"))
+    staged, _ = handler.stage_stream(BytesIO(build_pdf(["Refunds take ten working days."])))
+    pdf, _ = handler.save_staged(staged, "refunds.pdf")
+    handler.extract_text(pdf.id)
+    build = mocker.spy(DocumentIndex, 'build')
+
+    response, _ = chatbot_service.process_message(1, str(pdf.id), "How long do refunds take?")
+
+    assert "ten working days" in response
+    assert not build.called
+
+def test_process_message_dense_mode(db):
+    """Test answering with the dense retrieval mode."""
+    pdf = create_document(db, [
+        "Welcome to the staff handbook.",
+        "Parking permits are issued by the facilities desk on the ground floor."
+    ])
+    service = ChatbotService(retrieval_mode='dense')
+
+    response, confidence = service.process_message(1, str(pdf.id), "parking permits")
+
+    assert response.endswith("(page 2)")
+    assert confidence > 0.5
+
+def test_unknown_retrieval_mode():
+    """Test that an unsupported retrieval mode is rejected."""
+    with pytest.raises(ValueError):
+        ChatbotService(retrieval_mode='neural')
+
+@pytest.mark.parametrize('mode', ['bm25', 'dense'])
+def test_process_messages_matches_single_answers(db, mocker, mode):
+    """Test that batched answers equal one-by-one answers, with one index load."""
+    pdf = create_document(db, [
+        "Parking permits are issued by the facilities desk.",
+        "Annual leave requests are approved by your manager."
+    ])
+    questions = ["parking permits", "annual leave", "parking permits"]
+    expected = [
+        ChatbotService(retrieval_mode=mode).process_message(2, str(pdf.id), question)
+        for question in questions
+    ]
+    service = ChatbotService(retrieval_mode=mode)
+    get_index = mocker.spy(service, '_get_index')
+    commit = mocker.spy(db.session, 'commit')
+
+    assert service.process_messages(1, str(pdf.id), questions) == expected
+    assert get_index.call_count == 1
+    assert commit.call_count == 1
+
+def test_process_messages_unknown_document(chatbot_service, db):
+    """Test that every message gets the not-found answer."""
+    answers = chatbot_service.process_messages(1, "not-a-uuid", ["a", "b"])
+    assert answers == [(ChatbotService.NOT_FOUND_RESPONSE, 0.0)] * 2
+
+def test_partial_document_answers_cover_extracted_pages(db):
+    """Test answering while pages are still being stored, batch by batch."""
+    pages = [
+        "Welcome to the staff handbook.",
+        "Annual leave requests are approved by your manager.",
+        "Parking permits are issued by the facilities desk on the ground floor.",
+        "Travel expenses are reimbursed monthly."
+    ]
+    pdf = PDFDocument(filename='handbook.pdf', file_path='/tmp/handbook.pdf', file_size=1,
+                      page_count=4, processing_status='processing')
+    db.session.add(pdf)
+    db.session.commit()
+    service = ChatbotService(answer_cache=LocalAnswerCache())
+
+    response, _ = service.process_message(1, str(pdf.id), "parking permits")
+    assert response == ChatbotService.PROCESSING_RESPONSE
+
+    db.session.execute(db.insert(PDFPage), PDFPage.rows_for(pdf.id, pages[:2]))
+    db.session.commit()
+    response, _, coverage = service.process_message(
+        1, str(pdf.id), "parking permits", with_coverage=True
+    )
+    assert response == ChatbotService.NO_ANSWER_RESPONSE
+    assert coverage == PageCoverage(2, 4, False)
+
+    rows = PDFPage.rows_for(pdf.id, pages[2:], first_page=3)
+    db.session.execute(db.insert(PDFPage), rows)
+    db.session.commit()
+    response, _, coverage = service.process_message(
+        1, str(pdf.id), "parking permits", with_coverage=True
+    )
+    assert response.endswith("(page 3)")
+    assert coverage == PageCoverage(4, 4, False)
+    # Answers from a partial index are not cached
+    assert service.answer_cache.stats()['size'] == 0
+
+def test_indexes_built_from_pages_use_configured_width(db):
+    """Test that partial and rebuilt indexes match the configured embedding width."""
+    pages = ["Parking permits are issued by the facilities desk."]
+    pdf = PDFDocument(filename='handbook.pdf', file_path='/tmp/handbook.pdf', file_size=1,
+                      page_count=1, processing_status='processing')
+    db.session.add(pdf)
+    db.session.commit()
+    db.session.execute(db.insert(PDFPage), PDFPage.rows_for(pdf.id, pages))
+    db.session.commit()
+    service = ChatbotService(retrieval_mode='dense', embedding_dim=64)
+
+    assert service._get_index(pdf).index.dense.matrix.shape == (1, 64)
+    pdf.processing_status = 'completed'
+    pdf.processing_date = datetime.utcnow()
+    db.session.commit()
+    assert service._get_index(pdf).index.dense.matrix.shape == (1, 64)
+    response, _ = service.process_message(1, str(pdf.id), "parking permits")
+    assert response.endswith("(page 1)")
+
+def test_coverage_is_returned_with_every_kind_of_answer(db):
+    """Test that each answering path reports the coverage of the index it searched."""
+    pdf = PDFDocument(filename='handbook.pdf', file_path='/tmp/handbook.pdf', file_size=1,
+                      page_count=3, processing_status='processing')
+    db.session.add(pdf)
+    db.session.commit()
+    service = ChatbotService()
+
+    assert service.process_message(1, str(pdf.id), "parking", with_coverage=True)[2] == \
+        PageCoverage(0, 3, False)
+    db.session.execute(db.insert(PDFPage), PDFPage.rows_for(pdf.id, ["Parking permits."]))
+    db.session.commit()
+
+    _, coverage = service.process_messages(1, str(pdf.id), ["parking"], with_coverage=True)
+    assert coverage == PageCoverage(1, 3, False)
+    chunks = list(service.stream_message(1, str(pdf.id), "parking"))
+    assert {chunk.coverage for chunk in chunks} == {PageCoverage(1, 3, False)}
+    assert service.process_message(1, "not-a-uuid", "parking", with_coverage=True)[2] is None
+
@@ -6,7 +6,7 @@ from flask import Flask
 from sqlalchemy.exc import SQLAlchemyError
 
 from config import TestingConfig
-from models import db, PDFDocument, ChatMessage
+from models import db, PDFDocument, PDFPage, ChatMessage
 from app import create_app
 
 @pytest.fixture
@@ -140,4 +140,38 @@ def test_error_handling(init_database, app):
         with pytest.raises(SQLAlchemyError):
             db.session.add(invalid_msg)
             db.session.commit()
-        db.session.rollback()
\ No newline at end of file
+        db.session.rollback()
+def test_pdf_page_offsets(init_database, app):
+    """Test that page rows record offsets into the joined document text."""
+    with app.app_context():
+        pdf = PDFDocument(filename='test.pdf', file_path='/path/to/test.pdf', file_size=1024)
+        db.session.add(pdf)
+        db.session.flush()
+        
+        texts = ['First page', '', 'Third page']
+        db.session.add_all(PDFPage(**row) for row in PDFPage.rows_for(pdf.id, texts))
+        db.session.commit()
+        
+        full_text = PDFPage.PAGE_SEPARATOR.join(texts)
+        pages = pdf.pages.all()
+        assert [page.page_number for page in pages] == [1, 2, 3]
+        for page in pages:
+            assert full_text[page.char_start:page.char_end] == page.text
+
+def test_extracted_text_is_deferred(init_database, app):
+    """Test that loading a document does not load its extracted text."""
+    with app.app_context():
+        pdf = PDFDocument(
+            filename='test.pdf',
+            file_path='/path/to/test.pdf',
+            file_size=1024,
+            extracted_text='x' * 10000
+        )
+        db.session.add(pdf)
+        db.session.commit()
+        pdf_id = pdf.id
+        db.session.expunge_all()
+        
+        loaded = db.session.get(PDFDocument, pdf_id)
+        assert 'extracted_text' not in loaded.__dict__
+        assert len(loaded.extracted_text) == 10000
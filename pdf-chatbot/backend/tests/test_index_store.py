@@ -0,0 +1,114 @@
+"""Tests for the memory-mapped index file format."""
+import os
+import threading
+import numpy as np
+import pytest
+from index_store import (
+    ALIGNMENT, IndexFormatError, open_index, read_header, write_index
+)
+from retrieval import DocumentIndex, PASSAGE_DTYPE
+
+@pytest.fixture
+def arrays():
+    """Arrays of several dtypes and shapes, including an empty one."""
+    passages = np.zeros(3, dtype=PASSAGE_DTYPE)
+    passages['page'] = [1, 1, 2]
+    return {
+        'passages': passages,
+        'keys': np.array([3, 1, 2], dtype=np.uint64),
+        'matrix': np.arange(12, dtype=np.float32).reshape(3, 4),
+        'empty': np.zeros(0, dtype=np.int32)
+    }
+
+def test_round_trip(arrays, tmp_path):
+    """Test that arrays come back with identical dtypes, shapes and values."""
+    path = str(tmp_path / "doc.index")
+    write_index(path, arrays, content_hash="abc")
+
+    loaded = open_index(path, content_hash="abc")
+
+    assert set(loaded) == set(arrays)
+    for name, array in arrays.items():
+        assert loaded[name].dtype == array.dtype
+        assert np.array_equal(loaded[name], array)
+
+def test_open_is_zero_copy(arrays, tmp_path):
+    """Test that arrays are aligned, read-only views of the mapped file."""
+    path = str(tmp_path / "doc.index")
+    write_index(path, arrays)
+
+    loaded = open_index(path)
+    header = read_header(path)
+
+    assert all(section['offset'] % ALIGNMENT == 0 for section in header['sections'])
+    assert not loaded['matrix'].flags.owndata
+    assert not loaded['matrix'].flags.writeable
+
+def test_open_rejects_stale_hash(arrays, tmp_path):
+    """Test that an index written for other content is not used."""
+    path = str(tmp_path / "doc.index")
+    write_index(path, arrays, content_hash="abc")
+    assert open_index(path, content_hash="def") is None
+
+@pytest.mark.parametrize('damage', ['header', 'magic', 'truncate'])
+def test_open_rejects_corrupt_file(arrays, tmp_path, damage):
+    """Test that damaged headers and truncated files are detected."""
+    path = tmp_path / "doc.index"
+    write_index(str(path), arrays)
+    content = bytearray(path.read_bytes())
+    if damage == 'header':
+        content[30] ^= 0xFF
+    elif damage == 'magic':
+        content[0:8] = b"NOTINDEX"
+    else:
+        content = content[:-8]
+    path.write_bytes(bytes(content))
+
+    with pytest.raises(IndexFormatError):
+        read_header(str(path))
+    assert open_index(str(path)) is None
+
+def test_replacing_file_keeps_open_views_valid(arrays, tmp_path):
+    """Test that rewriting an index does not disturb processes mapping the old one."""
+    path = str(tmp_path / "doc.index")
+    write_index(path, arrays)
+    old = open_index(path)
+
+    write_index(path, {'matrix': np.ones((2, 2), dtype=np.float32)})
+
+    assert np.array_equal(old['matrix'], arrays['matrix'])
+    assert open_index(path)['matrix'].shape == (2, 2)
+
+def test_concurrent_writers_publish_complete_files(tmp_path):
+    """Test that writers racing on one path never publish a partial file."""
+    path = str(tmp_path / "doc.index")
+    errors = []
+
+    def write(fill):
+        try:
+            for _ in range(20):
+                write_index(path, {'matrix': np.full((256, 256), fill, dtype=np.float32)})
+        except Exception as e:
+            errors.append(e)
+    writers = [threading.Thread(target=write, args=(fill,)) for fill in range(4)]
+    for writer in writers:
+        writer.start()
+    for writer in writers:
+        writer.join()
+
+    assert errors == []
+    matrix = open_index(path)['matrix']
+    assert len(np.unique(matrix)) == 1
+    assert os.listdir(tmp_path) == ["doc.index"]
+
+def test_document_index_load_is_memory_mapped(tmp_path):
+    """Test that a loaded document index searches straight from the mapping."""
+    index = DocumentIndex.build(["Parking permits are issued by facilities.", "Cafeteria hours"])
+    path = str(tmp_path / "doc.index")
+    index.save(path, content_hash="abc")
+
+    loaded = DocumentIndex.load(path, content_hash="abc")
+
+    assert not loaded.dense.matrix.flags.writeable
+    assert not loaded.bm25.postings.flags.writeable
+    assert loaded.search("parking permits").passages == index.search("parking permits").passages
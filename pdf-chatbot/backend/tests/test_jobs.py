@@ -0,0 +1,294 @@
+"""Tests for extraction job dispatch."""
+import threading
+import uuid
+import pytest
+from unittest.mock import Mock, PropertyMock
+from io import BytesIO
+from app import create_app
+from config import TestingConfig
+import migrations
+from jobs import CeleryDispatcher, JobQueueFull, LocalDispatcher, create_dispatcher
+from models import db as _db, ExtractionJob, PDFDocument
+from pdf_handler import PDFHandler
+from tests.conftest import build_pdf
+
+@pytest.fixture
+def pdf_handler(tmp_path):
+    """Create a PDFHandler with a temporary upload folder."""
+    return PDFHandler(str(tmp_path / "uploads"))
+
+@pytest.fixture
+def stored_pdf(db, pdf_handler):
+    """Store a generated three-page PDF without extracting it."""
+    content = build_pdf(["Alpha page", "Beta page", "Gamma page"])
+    staged, _ = pdf_handler.stage_stream(BytesIO(content))
+    pdf_doc, _ = pdf_handler.save_staged(staged, "generated.pdf")
+    return pdf_doc
+
+def test_create_dispatcher_without_broker(app):
+    """Test that the local dispatcher is used when no broker is configured."""
+    dispatcher = create_dispatcher(app, PDFHandler(app.config['UPLOAD_FOLDER']))
+    assert isinstance(dispatcher, LocalDispatcher)
+
+def test_upload_starts_extraction(client, db):
+    """Test that uploading a PDF runs extraction and records the job."""
+    content = build_pdf(["Employee handbook", "Holiday policy"])
+    response = client.post(
+        '/api/upload?filename=handbook.pdf',
+        data=content,
+        content_type='application/pdf'
+    )
+
+    assert response.status_code == 201
+    data = response.get_json()
+    assert data['job_id'] is not None
+
+    pdf_doc = PDFDocument.query.filter_by(filename='handbook.pdf').first()
+    assert pdf_doc.processing_status == 'completed'
+    assert pdf_doc.page_count == 2
+    assert "Holiday policy" in pdf_doc.extracted_text
+
+    job = ExtractionJob.query.filter_by(pdf_document_id=pdf_doc.id).one()
+    assert job.backend == 'local'
+    assert job.status == 'completed'
+    assert job.queue_latency >= 0
+
+def test_document_status_endpoint(client, db):
+    """Test the document status endpoint after an upload."""
+    content = build_pdf(["Status page"])
+    upload = client.post(
+        '/api/upload?filename=status.pdf',
+        data=content,
+        content_type='application/pdf'
+    ).get_json()
+
+    response = client.get(f"/api/documents/{upload['file']['id']}/status")
+
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['document']['processing_status'] == 'completed'
+    assert data['job']['id'] == upload['job_id']
+    assert data['job']['status'] == 'completed'
+
+def test_document_status_unknown_document(client, db):
+    """Test the status endpoint with an unknown document ID."""
+    response = client.get('/api/documents/not-a-uuid/status')
+    assert response.status_code == 404
+
+def test_local_dispatcher_worker_threads(app, db, stored_pdf, pdf_handler):
+    """Test that worker threads run queued jobs in the background."""
+    dispatcher = LocalDispatcher(app, pdf_handler, workers=1)
+
+    job = dispatcher.submit(stored_pdf.id)
+    dispatcher.join()
+    dispatcher.shutdown()
+
+    db.session.expire_all()
+    job = db.session.get(ExtractionJob, job.id)
+    assert job.status == 'completed'
+    assert job.started_at is not None
+    assert db.session.get(PDFDocument, stored_pdf.id).page_count == 3
+
+def test_run_job_skips_claimed_jobs(app, stored_pdf, pdf_handler):
+    """Test that a job which is no longer queued is not run twice."""
+    dispatcher = LocalDispatcher(app, pdf_handler, workers=0)
+
+    job = dispatcher.submit(stored_pdf.id)
+
+    assert job.status == 'completed'
+    assert dispatcher.run_job(job.id) is None
+
+def test_recover_requeues_pending_jobs(app, db, stored_pdf, pdf_handler):
+    """Test that queued jobs from a previous process are picked up again."""
+    job = ExtractionJob(pdf_document_id=stored_pdf.id, backend='local', status='queued')
+    db.session.add(job)
+    db.session.commit()
+
+    dispatcher = LocalDispatcher(app, pdf_handler, workers=0)
+
+    assert dispatcher.recover() == 1
+    db.session.refresh(job)
+    assert job.status == 'completed'
+
+def test_upload_records_tenant(client, db):
+    """Test that the X-Tenant-ID header is recorded on the extraction job."""
+    response = client.post(
+        '/api/upload?filename=tenant.pdf',
+        data=build_pdf(["Tenant page"]),
+        content_type='application/pdf',
+        headers={'X-Tenant-ID': 'acme'}
+    )
+
+    job = db.session.get(ExtractionJob, uuid.UUID(response.get_json()['job_id']))
+    assert job.tenant == 'acme'
+
+def test_fast_lane_worker_reservation(app, db, stored_pdf, pdf_handler):
+    """Test that a fast lane worker is reserved and still completes jobs."""
+    dispatcher = LocalDispatcher(app, pdf_handler, workers=2, fast_lane_workers=1)
+
+    job = dispatcher.submit(stored_pdf.id)
+    dispatcher.join()
+    dispatcher.shutdown()
+
+    assert dispatcher.fast_lane_workers == 1
+    assert LocalDispatcher(app, pdf_handler, workers=1, fast_lane_workers=1).fast_lane_workers == 0
+    db.session.expire_all()
+    assert db.session.get(ExtractionJob, job.id).status == 'completed'
+
+def test_recovery_runs_once_and_logs_database_errors(mocker):
+    """Test that first-request recovery runs once and survives a missing schema."""
+    class WorkerConfig(TestingConfig):
+        EXTRACTION_LOCAL_WORKERS = 1
+    recover = mocker.spy(LocalDispatcher, 'recover')
+    app = create_app(WorkerConfig)
+    assert recover.call_count == 0
+    error = mocker.spy(app.logger, 'error')
+    client = app.test_client()
+
+    # No tables were created, so recovery fails on the first request
+    assert client.get('/api/health').status_code == 200
+    assert client.get('/api/health').status_code == 200
+    assert recover.call_count == 1
+    assert "schema upgrade" in error.call_args_list[0].args[0]
+
+def test_upload_survives_unreachable_broker(mocker):
+    """Test that a failed dispatch marks the job and document failed with a warning."""
+    class BrokerConfig(TestingConfig):
+        CELERY_BROKER_URL = 'redis://broker.invalid:6379/0'
+    task = Mock()
+    task.delay.side_effect = ConnectionError("broker unreachable")
+    mocker.patch.object(CeleryDispatcher, 'extract_task', new_callable=PropertyMock,
+                        return_value=task)
+    app = create_app(BrokerConfig)
+
+    with app.app_context():
+        _db.create_all()
+        try:
+            response = app.test_client().post(
+                '/api/upload?filename=handbook.pdf',
+                data=build_pdf(["Employee handbook"]),
+                content_type='application/pdf'
+            )
+
+            assert response.status_code == 201
+            data = response.get_json()
+            assert data['status'] == 'warning'
+            assert data['file']['processing_status'] == 'failed'
+            job = _db.session.get(ExtractionJob, uuid.UUID(data['job_id']))
+            assert job.status == 'failed'
+            assert "broker unreachable" in job.error
+            assert job.pdf_document.processing_error
+        finally:
+            _db.session.close()
+            _db.drop_all()
+
+def test_schema_command_does_not_claim_jobs(tmp_path):
+    """Test that building the app and running the schema CLI leaves jobs queued."""
+    class WorkerConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path / 'jobs.db'}"
+        EXTRACTION_LOCAL_WORKERS = 1
+    app = create_app(WorkerConfig)
+    with app.app_context():
+        migrations.upgrade(_db.engine)
+        pdf_doc = PDFDocument(filename='queued.pdf', file_path='/tmp/queued.pdf', file_size=1)
+        _db.session.add(pdf_doc)
+        _db.session.flush()
+        job = ExtractionJob(pdf_document_id=pdf_doc.id, backend='local', status='queued')
+        _db.session.add(job)
+        _db.session.commit()
+        job_id = job.id
+
+    # As the container does before every start, with a job left queued
+    app = create_app(WorkerConfig)
+    result = app.test_cli_runner().invoke(args=['schema', 'upgrade'])
+
+    assert result.exit_code == 0
+    assert app.extensions['job_dispatcher']._threads == []
+    with app.app_context():
+        job = _db.session.get(ExtractionJob, job_id)
+        assert (job.status, job.started_at) == ('queued', None)
+        _db.session.remove()
+
+def test_deferred_job_runs_when_a_worker_frees_a_slot(app, db, stored_pdf, mocker):
+    """Test that a job rejected by a full queue is picked up without a restart."""
+    started, release = threading.Event(), threading.Event()
+
+    def extract_text(*args, **kwargs):
+        started.set()
+        release.wait(5)
+        return {"status": "success"}
+    handler = Mock()
+    handler.extract_text.side_effect = extract_text
+    dispatcher = LocalDispatcher(app, handler, workers=1, max_queue=1, fast_lane_workers=0)
+
+    running = dispatcher.submit(stored_pdf.id)
+    assert started.wait(5)
+    waiting = dispatcher.submit(stored_pdf.id)
+    with pytest.raises(JobQueueFull) as deferred:
+        dispatcher.submit(stored_pdf.id)
+    release.set()
+    dispatcher.join()
+    dispatcher.shutdown()
+
+    db.session.expire_all()
+    for job in (running, waiting, deferred.value.job):
+        assert db.session.get(ExtractionJob, job.id).status == 'completed'
+    assert handler.extract_text.call_count == 3
+
+def test_upload_warns_when_extraction_is_deferred(client, db, mocker):
+    """Test that an upload deferred by a full queue says so."""
+    mocker.patch.object(LocalDispatcher, 'submit', side_effect=JobQueueFull("queue is full"))
+
+    response = client.post(
+        '/api/upload?filename=deferred.pdf',
+        data=build_pdf(["Deferred page"]),
+        content_type='application/pdf'
+    )
+
+    assert response.status_code == 201
+    data = response.get_json()
+    assert data['status'] == 'warning'
+    assert 'queued' in data['message']
+
+
+def test_jobs_overflowing_the_queue_eventually_run(tmp_path, mocker):
+    """Test that uploads beyond EXTRACTION_QUEUE_SIZE are scheduled once slots free up."""
+    class SmallQueueConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path / 'jobs.db'}"
+        EXTRACTION_LOCAL_WORKERS = 1
+        EXTRACTION_FAST_LANE_WORKERS = 0
+        EXTRACTION_QUEUE_SIZE = 1
+    app = create_app(SmallQueueConfig)
+    dispatcher = app.extensions['job_dispatcher']
+    started, release = threading.Event(), threading.Event()
+    extract_text = dispatcher.pdf_handler.extract_text
+
+    def blocking_extract_text(*args, **kwargs):
+        started.set()
+        release.wait(5)
+        return extract_text(*args, **kwargs)
+    mocker.patch.object(dispatcher.pdf_handler, 'extract_text', side_effect=blocking_extract_text)
+    with app.app_context():
+        migrations.upgrade(_db.engine)
+    client = app.test_client()
+
+    statuses = []
+    for number in range(4):
+        response = client.post(
+            f'/api/upload?filename=overflow-{number}.pdf',
+            data=build_pdf([f"Overflow page {number}"]),
+            content_type='application/pdf'
+        )
+        statuses.append(response.get_json()['status'])
+        if number == 0:
+            assert started.wait(5)
+    release.set()
+    dispatcher.join()
+    dispatcher.shutdown()
+
+    # One job runs, one waits in the scheduler and two overflow to the table
+    assert statuses == ['success', 'success', 'warning', 'warning']
+    with app.app_context():
+        assert {job.status for job in ExtractionJob.query} == {'completed'}
+        assert ExtractionJob.query.count() == 4
+        _db.session.remove()
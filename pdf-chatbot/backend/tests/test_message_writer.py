@@ -0,0 +1,115 @@
+"""Tests for write-behind chat message persistence."""
+import threading
+import uuid
+from datetime import datetime
+import pytest
+from chatbot import ChatbotService
+from message_writer import MessageBufferFull, MessageWriter
+from metrics import MESSAGE_FLUSH_SECONDS
+from models import ChatMessage
+from tests.conftest import create_document
+
+def message_row(pdf, content):
+    """Build the column values of one user message."""
+    return {
+        'id': uuid.uuid4(),
+        'pdf_document_id': pdf.id,
+        'message_type': 'user',
+        'content': content,
+        'timestamp': datetime.utcnow(),
+        'conversation_id': ChatbotService._conversation_id(1, pdf.id),
+        'parent_message_id': None,
+        'response_time': None
+    }
+
+@pytest.fixture
+def pdf(db):
+    """Create a processed document to attach messages to."""
+    return create_document(db, ["Parking permits are issued by the facilities desk."])
+
+def test_flushes_full_batches(app, db, pdf):
+    """Test that rows are inserted in batches and counted."""
+    writer = MessageWriter(app, batch_size=2, flush_interval=60)
+    writer.write([message_row(pdf, "one"), message_row(pdf, "two")])
+    writer.write([message_row(pdf, "three")])
+
+    assert writer.flush(timeout=5)
+    writer.close()
+
+    assert ChatMessage.query.count() == 3
+    stats = writer.stats()
+    assert stats['flushes'] == 2
+    assert stats['rows_written'] == 3
+    assert stats['pending'] == 0
+    assert stats['flush_seconds_max'] >= stats['flush_seconds_avg'] > 0
+
+def test_batches_keep_exchanges_whole(app, db, pdf):
+    """Test that a batch never splits the rows of one write."""
+    writer = MessageWriter(app, batch_size=3, flush_interval=60)
+    batches = []
+    flush_batch = writer._flush_batch
+    writer._flush_batch = lambda batch: (batches.append(batch), flush_batch(batch))
+    flushes_before = sum(MESSAGE_FLUSH_SECONDS.collect().get((), [0])[:-1])
+
+    writer.write([message_row(pdf, "q1"), message_row(pdf, "a1")])
+    writer.write([message_row(pdf, "q2"), message_row(pdf, "a2")])
+    writer.close()
+
+    assert [[len(group) for group in batch] for batch in batches] == [[2], [2]]
+    assert ChatMessage.query.count() == 4
+    # Flush latency is exported as a histogram
+    assert sum(MESSAGE_FLUSH_SECONDS.collect()[()][:-1]) - flushes_before == 2
+
+def test_failed_batch_only_drops_bad_exchanges(app, db, pdf):
+    """Test that one bad row does not take the rest of its batch with it."""
+    writer = MessageWriter(app, batch_size=100, flush_interval=60)
+    writer.write([message_row(pdf, "good")])
+    writer.write([message_row(pdf, "question"), message_row(pdf, None)])
+    writer.write([message_row(pdf, "also good")])
+
+    writer.close()
+
+    assert sorted(msg.content for msg in ChatMessage.query) == ["also good", "good"]
+    stats = writer.stats()
+    assert stats['rows_written'] == 2
+    assert stats['rows_dropped'] == 2
+
+def test_close_flushes_pending_rows(app, db, pdf):
+    """Test that closing the writer persists rows still in the buffer."""
+    writer = MessageWriter(app, batch_size=100, flush_interval=60)
+    writer.write([message_row(pdf, "queued")])
+
+    writer.close()
+
+    assert ChatMessage.query.filter_by(content="queued").count() == 1
+    with pytest.raises(RuntimeError):
+        writer.write([message_row(pdf, "late")])
+
+def test_backpressure_when_full(app, db, pdf):
+    """Test that writers block and then fail while the buffer is full."""
+    writer = MessageWriter(app, batch_size=2, max_pending=2, put_timeout=0.05)
+    release = threading.Event()
+    flush_batch = writer._flush_batch
+    writer._flush_batch = lambda batch: (release.wait(5), flush_batch(batch))
+
+    writer.write([message_row(pdf, "one"), message_row(pdf, "two")])
+    writer.write([message_row(pdf, "three"), message_row(pdf, "four")])
+    with pytest.raises(MessageBufferFull):
+        writer.write([message_row(pdf, "five")])
+
+    release.set()
+    writer.close()
+    assert ChatMessage.query.count() == 4
+
+def test_chatbot_answers_without_committing(app, db, pdf):
+    """Test that process_message hands the exchange to the writer."""
+    writer = MessageWriter(app, batch_size=100, flush_interval=60)
+    service = ChatbotService(message_writer=writer)
+
+    response, _ = service.process_message(1, str(pdf.id), "parking permits")
+    assert service.get_chat_history(1, str(pdf.id)) == []
+
+    writer.close()
+    history = service.get_chat_history(1, str(pdf.id))
+    assert [msg['is_user'] for msg in history] == [True, False]
+    assert history[1]['message'] == response
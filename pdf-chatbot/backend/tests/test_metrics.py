@@ -0,0 +1,60 @@
+"""Tests for the latency histograms and the /metrics endpoint."""
+import threading
+from metrics import Gauge, Histogram
+from tests.conftest import create_document
+
+def test_histogram_renders_cumulative_buckets():
+    """Test that observations land in cumulative buckets per label set."""
+    histogram = Histogram('test_seconds', 'Test latency.', ('phase',), buckets=(0.1, 1.0))
+    histogram.observe(0.05, 'a')
+    histogram.observe(0.5, 'a')
+    histogram.observe(5.0, 'a')
+    histogram.observe(0.1, 'b')
+
+    lines = histogram.render()
+    assert '# TYPE test_seconds histogram' in lines
+    assert 'test_seconds_bucket{phase="a",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{phase="a",le="1.0"} 2' in lines
+    assert 'test_seconds_bucket{phase="a",le="+Inf"} 3' in lines
+    assert 'test_seconds_count{phase="a"} 3' in lines
+    assert 'test_seconds_sum{phase="a"} 5.55' in lines
+    assert 'test_seconds_bucket{phase="b",le="0.1"} 1' in lines
+
+def test_histogram_keeps_counts_of_finished_threads():
+    """Test that per-thread shards are summed and folded when threads end."""
+    histogram = Histogram('test_seconds', 'Test latency.')
+
+    def observe():
+        for _ in range(100):
+            histogram.observe(0.001)
+
+    threads = [threading.Thread(target=observe) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    histogram.observe(0.001)
+
+    assert sum(histogram.collect()[()][:-1]) == 401
+    assert len(histogram._shards) == 1
+
+def test_gauge_skips_unavailable_values():
+    """Test that gauges without a value are left out of the exposition."""
+    assert Gauge('test_depth', 'Depth.', lambda: 3).render()[-1] == 'test_depth 3'
+    assert Gauge('test_depth', 'Depth.', lambda: None).render() == []
+
+def test_metrics_endpoint(client, db):
+    """Test that chat and history latencies and gauges are exposed."""
+    pdf = create_document(db, ["Parking permits are issued by the facilities desk."])
+    client.post(f'/api/chat/{pdf.id}', json={'message': 'parking permits'})
+    client.get(f'/api/chat/{pdf.id}/history')
+
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain; version=0.0.4')
+    body = response.get_data(as_text=True)
+    for phase in ('lookup', 'retrieval', 'persistence'):
+        assert f'chat_message_seconds_count{{phase="{phase}"}}' in body
+    assert 'chat_history_seconds_count{query="page"}' in body
+    assert 'extraction_queue_depth 0' in body
+    assert 'chat_worker_queue_depth 0' in body
@@ -0,0 +1,128 @@
+"""Tests for schema migrations and the chat_messages query plans."""
+import pytest
+from sqlalchemy import create_engine, inspect
+import migrations
+from app import create_app
+from config import TestingConfig
+from models import db as _db, PDFDocument
+from benchmarks.explain_chat_messages import check_plans, seed_chat_messages
+
+CHAT_INDEXES = {
+    'ix_chat_messages_history', 'ix_chat_messages_conversation', 'ix_chat_messages_parent'
+}
+
+# Schema created by db.create_all() before migrations were introduced
+PRE_MIGRATION_SCHEMA = (
+    """CREATE TABLE pdf_documents (
+        id CHAR(32) NOT NULL PRIMARY KEY,
+        filename VARCHAR(255) NOT NULL,
+        file_path VARCHAR(512) NOT NULL,
+        file_size INTEGER NOT NULL,
+        upload_date DATETIME NOT NULL,
+        last_accessed DATETIME,
+        title VARCHAR(255),
+        author VARCHAR(255),
+        page_count INTEGER,
+        extracted_text TEXT,
+        processing_status VARCHAR(20),
+        processing_date DATETIME,
+        processing_error TEXT,
+        processing_progress FLOAT
+    )""",
+    """CREATE TABLE chat_messages (
+        id CHAR(32) NOT NULL PRIMARY KEY,
+        pdf_document_id CHAR(32) NOT NULL REFERENCES pdf_documents (id),
+        message_type VARCHAR(10) NOT NULL,
+        content TEXT NOT NULL,
+        timestamp DATETIME NOT NULL,
+        conversation_id CHAR(32) NOT NULL,
+        parent_message_id CHAR(32) REFERENCES chat_messages (id),
+        response_time FLOAT,
+        tokens_used INTEGER
+    )"""
+)
+
+@pytest.fixture
+def engine(tmp_path):
+    """Create an empty SQLite database."""
+    engine = create_engine(f"sqlite:///{tmp_path / 'schema.db'}")
+    yield engine
+    engine.dispose()
+
+def chat_indexes(engine):
+    return {index['name'] for index in inspect(engine).get_indexes('chat_messages')}
+
+def table_columns(engine):
+    inspector = inspect(engine)
+    return {
+        table: {column['name'] for column in inspector.get_columns(table)}
+        for table in inspector.get_table_names() if table != 'schema_migrations'
+    }
+
+def table_indexes(engine):
+    inspector = inspect(engine)
+    return {
+        (index['name'], tuple(index['column_names']))
+        for table in inspector.get_table_names() for index in inspector.get_indexes(table)
+    }
+
+def test_upgrade_new_database(engine):
+    """Test that all migrations run once and produce the models' schema."""
+    assert migrations.upgrade(engine) == [m.version for m in migrations.MIGRATIONS]
+    assert migrations.current_version(engine) == migrations.MIGRATIONS[-1].version
+    assert CHAT_INDEXES <= chat_indexes(engine)
+    assert table_columns(engine) == {
+        table.name: {column.name for column in table.columns}
+        for table in _db.metadata.sorted_tables
+    }
+    # The frozen index definitions still match the models
+    assert table_indexes(engine) == {
+        (index.name, tuple(column.name for column in index.columns))
+        for table in _db.metadata.sorted_tables for index in table.indexes
+    }
+    assert migrations.upgrade(engine) == []
+
+def test_upgrade_database_created_by_create_all(tmp_path):
+    """Test that a database from before migrations gains new columns and indexes."""
+    url = f"sqlite:///{tmp_path / 'old.db'}"
+    engine = create_engine(url)
+    with engine.begin() as connection:
+        for statement in PRE_MIGRATION_SCHEMA:
+            connection.exec_driver_sql(statement)
+
+    migrations.upgrade(engine)
+
+    assert CHAT_INDEXES <= chat_indexes(engine)
+    assert 'content_hash' in table_columns(engine)['pdf_documents']
+    engine.dispose()
+
+    class OldDatabaseConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = url
+
+    with create_app(OldDatabaseConfig).app_context():
+        assert PDFDocument.query.all() == []
+        assert PDFDocument.query.filter_by(content_hash='0' * 64).first() is None
+
+def test_upgrade_adds_extraction_job_tenant(engine):
+    """Test that the tenant column is added to an existing jobs table."""
+    migrations.upgrade(engine, target=2)
+    columns = {column['name'] for column in inspect(engine).get_columns('extraction_jobs')}
+    assert 'tenant' not in columns
+
+    assert migrations.upgrade(engine, target=3) == [3]
+
+    columns = {column['name'] for column in inspect(engine).get_columns('extraction_jobs')}
+    assert 'tenant' in columns
+
+def test_upgrade_to_target(engine):
+    """Test stopping at an intermediate version."""
+    assert migrations.upgrade(engine, target=1) == [1]
+    assert migrations.current_version(engine) == 1
+
+def test_hot_path_plans_use_indexes(app, db):
+    """Test that history, conversation and thread queries are index range scans."""
+    sample = seed_chat_messages(db.session, 4000, documents=20)
+    report = []
+
+    assert check_plans(app, sample, report=report.append), "\n".join(report)
+    assert any('ix_chat_messages_history' in line for line in report)
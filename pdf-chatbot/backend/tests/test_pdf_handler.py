@@ -1,10 +1,18 @@
 import os
+import hashlib
+import time
+import numpy as np
 import pytest
 from werkzeug.datastructures import FileStorage
 from io import BytesIO
 from datetime import datetime
-from pdf_handler import PDFHandler
-from models import PDFDocument
+from metrics import UPLOAD_SECONDS
+from pdf_handler import (PDFHandler, PDFMetadata, extract_pages, extract_page_range, iter_pages,
+                         prescan_pdf)
+from models import PDFDocument, PDFPage
+from PyPDF2 import PdfReader
+from retrieval import DocumentIndex, index_path
+from tests.conftest import build_pdf
 
 @pytest.fixture
 def pdf_handler(tmp_path):
@@ -16,7 +24,7 @@ def pdf_handler(tmp_path):
 def mock_pdf_file():
     """Create a mock PDF file for testing."""
     # Create a mock PDF file with PDF magic bytes
-    content = b"%PDF-1.4\n%¥±ë\n1 0 obj\n<</Type/Catalog/Pages 2 0 R>>\nendobj"
+    content = b"%PDF-1.4\n%\xa5\xb1\xeb\n1 0 obj\n<</Type/Catalog/Pages 2 0 R>>\nendobj"
     return FileStorage(
         stream=BytesIO(content),
         filename="test.pdf",
@@ -71,6 +79,7 @@ def test_save_file_success(pdf_handler, mock_pdf_file, mocker):
     """Test successful file save operation."""
     # Mock database session
     mock_db = mocker.patch('pdf_handler.db')
+    mocker.patch.object(PDFHandler, 'find_by_hash', return_value=None)
     
     # Test file save
     pdf_doc, error = pdf_handler.save_file(mock_pdf_file)
@@ -87,6 +96,7 @@ def test_save_file_error(pdf_handler, mock_pdf_file, mocker):
     # Mock database session to raise an error
     mock_db = mocker.patch('pdf_handler.db')
     mock_db.session.commit.side_effect = Exception("Database error")
+    mocker.patch.object(PDFHandler, 'find_by_hash', return_value=None)
     
     # Test file save
     pdf_doc, error = pdf_handler.save_file(mock_pdf_file)
@@ -95,6 +105,7 @@ def test_save_file_error(pdf_handler, mock_pdf_file, mocker):
     assert "Error saving file" in error
     # Verify file was cleaned up
     assert not os.path.exists(os.path.join(pdf_handler.upload_folder, mock_pdf_file.filename))
+    assert all(not files for _, _, files in os.walk(pdf_handler.upload_folder))
 
 def test_upload_folder_creation(tmp_path):
     """Test that upload folder is created if it doesn't exist."""
@@ -102,17 +113,295 @@ def test_upload_folder_creation(tmp_path):
     PDFHandler(str(upload_folder))
     assert os.path.exists(upload_folder)
 
-def test_unique_filename_generation(pdf_handler, mock_pdf_file, mocker):
-    """Test that unique filenames are generated for uploads."""
-    # Mock datetime to ensure consistent filename
-    fixed_time = datetime(2024, 1, 1, 12, 0, 0)
-    mocker.patch('pdf_handler.datetime', autospec=True)
-    mocker.patch('pdf_handler.datetime.utcnow', return_value=fixed_time)
-    
-    # Mock database session
+def test_content_addressed_storage(pdf_handler, mock_pdf_file, mocker):
+    """Test that uploads are stored under their SHA-256 digest."""
     mock_db = mocker.patch('pdf_handler.db')
+    mocker.patch.object(PDFHandler, 'find_by_hash', return_value=None)
+    
+    mock_pdf_file.stream.seek(0)
+    digest = hashlib.sha256(mock_pdf_file.stream.read()).hexdigest()
+    mock_pdf_file.stream.seek(0)
     
     pdf_doc, _ = pdf_handler.save_file(mock_pdf_file)
     
-    expected_filename = f"20240101_120000_test.pdf"
-    assert os.path.basename(pdf_doc.file_path) == expected_filename
\ No newline at end of file
+    assert pdf_doc.content_hash == digest
+    assert pdf_doc.file_path == os.path.join(
+        pdf_handler.upload_folder, digest[:2], f"{digest}.pdf"
+    )
+
+class CountingStream(BytesIO):
+    """BytesIO that records how many bytes have been read."""
+    
+    def __init__(self, content):
+        super().__init__(content)
+        self.bytes_read = 0
+    
+    def read(self, size=-1):
+        chunk = super().read(size)
+        self.bytes_read += len(chunk)
+        return chunk
+
+def test_stage_stream_valid_pdf(pdf_handler):
+    """Test streaming a valid PDF into a temporary file."""
+    content = b"%PDF-1.4\n" + b"0" * (PDFHandler.CHUNK_SIZE * 2 + 17)
+    staged, error = pdf_handler.stage_stream(BytesIO(content))
+    
+    assert error is None
+    assert staged.size == len(content)
+    assert staged.sha256 == hashlib.sha256(content).hexdigest()
+    assert os.path.dirname(staged.temp_path) == pdf_handler.upload_folder
+    with open(staged.temp_path, 'rb') as f:
+        assert f.read() == content
+
+def test_stage_stream_stops_at_size_limit(pdf_handler, mocker):
+    """Test that streaming aborts as soon as the size limit is passed."""
+    mocker.patch.object(PDFHandler, 'MAX_FILE_SIZE', PDFHandler.CHUNK_SIZE * 2)
+    stream = CountingStream(b"%PDF-1.4\n" + b"0" * (PDFHandler.CHUNK_SIZE * 10))
+    
+    staged, error = pdf_handler.stage_stream(stream)
+    
+    assert staged is None
+    assert "File too large" in error
+    assert stream.bytes_read == PDFHandler.CHUNK_SIZE * 3
+    assert os.listdir(pdf_handler.upload_folder) == []
+
+def test_stage_stream_invalid_type(pdf_handler):
+    """Test that non-PDF streams are rejected and cleaned up."""
+    staged, error = pdf_handler.stage_stream(BytesIO(b"This is not a PDF file"))
+    
+    assert staged is None
+    assert "Invalid file type" in error
+    assert os.listdir(pdf_handler.upload_folder) == []
+
+def test_save_staged_moves_file(pdf_handler, mocker):
+    """Test that a staged upload is renamed into place and recorded."""
+    mock_db = mocker.patch('pdf_handler.db')
+    mocker.patch.object(PDFHandler, 'find_by_hash', return_value=None)
+    content = b"%PDF-1.4\n1 0 obj\n<</Type/Catalog/Pages 2 0 R>>\nendobj"
+    staged, _ = pdf_handler.stage_stream(BytesIO(content))
+    
+    pdf_doc, error = pdf_handler.save_staged(staged, "test.pdf")
+    
+    assert error is None
+    assert pdf_doc.file_size == len(content)
+    assert not os.path.exists(staged.temp_path)
+    assert os.path.exists(pdf_doc.file_path)
+    assert mock_db.session.commit.called
+
+def test_duplicate_upload_reuses_blob_and_extraction(app, db, pdf_handler):
+    """Test that identical uploads share storage and completed extraction."""
+    content = b"%PDF-1.4\n1 0 obj\n<</Type/Catalog/Pages 2 0 R>>\nendobj"
+    
+    staged, _ = pdf_handler.stage_stream(BytesIO(content))
+    first, error = pdf_handler.save_staged(staged, "handbook.pdf")
+    assert error is None
+    first.extracted_text = "Handbook text"
+    first.page_count = 3
+    first.processing_status = "completed"
+    db.session.add_all(
+        PDFPage(**row) for row in PDFPage.rows_for(first.id, ["Intro", "Leave", "Travel"])
+    )
+    db.session.commit()
+    
+    staged, _ = pdf_handler.stage_stream(BytesIO(content))
+    second, error = pdf_handler.save_staged(staged, "handbook-copy.pdf")
+    
+    assert error is None
+    assert second.id != first.id
+    assert second.file_path == first.file_path
+    assert second.extracted_text == "Handbook text"
+    assert second.page_count == 3
+    assert second.processing_status == "completed"
+    assert [page.text for page in second.pages] == ["Intro", "Leave", "Travel"]
+    assert not os.path.exists(staged.temp_path)
+    assert sum(len(files) for _, _, files in os.walk(pdf_handler.upload_folder)) == 1
+
+def test_prescan_reads_page_count_and_info(make_pdf, mocker):
+    """Test that the pre-scan reads size and metadata without extracting pages."""
+    extract = mocker.patch('pdf_handler._extract_reader_pages')
+    path = make_pdf(["One", "Two", "Three"], info={'Title': 'Staff Handbook', 'Author': 'HR'})
+    
+    metadata, error = prescan_pdf(path)
+    
+    assert error is None
+    assert metadata == (3, 'Staff Handbook', 'HR')
+    assert not extract.called
+
+def test_prescan_unreadable_file(tmp_path):
+    """Test that a file without a readable trailer yields no metadata."""
+    path = tmp_path / "broken.pdf"
+    path.write_bytes(b"%PDF-1.4\n1 0 obj\n<</Type/Catalog/Pages 2 0 R>>\nendobj")
+    
+    metadata, error = prescan_pdf(str(path))
+    
+    assert metadata == (None, None, None)
+    assert "Error reading PDF metadata" in error
+
+def test_save_staged_records_prescan(app, db, pdf_handler):
+    """Test that page count and metadata are stored with the new document."""
+    content = build_pdf(["Intro", "Leave"], info={'Title': 'Handbook'})
+    staged, _ = pdf_handler.stage_stream(BytesIO(content))
+    
+    pdf_doc, error = pdf_handler.save_staged(staged, "handbook.pdf")
+    
+    assert error is None
+    db.session.expire_all()
+    stored = db.session.get(PDFDocument, pdf_doc.id)
+    assert (stored.page_count, stored.title, stored.author) == (2, 'Handbook', None)
+    assert stored.processing_status == 'pending'
+
+def test_save_staged_times_prescan_outside_commit(app, db, pdf_handler, mocker):
+    """Test that the pre-scan is not counted in the commit upload phase."""
+    def slow_prescan(file_path):
+        time.sleep(0.2)
+        return PDFMetadata(1, None, None), None
+    mocker.patch('pdf_handler.prescan_pdf', side_effect=slow_prescan)
+    before = UPLOAD_SECONDS.collect()
+    staged, _ = pdf_handler.stage_stream(BytesIO(build_pdf(["Intro"])))
+    
+    pdf_handler.save_staged(staged, "handbook.pdf")
+    
+    after = UPLOAD_SECONDS.collect()
+    seconds = {
+        phase: after[(phase,)][-1] - before.get((phase,), [0.0])[-1]
+        for phase in ('prescan', 'commit')
+    }
+    assert seconds['prescan'] >= 0.2
+    assert seconds['commit'] < 0.2
+
+def test_extract_pages_sequential(make_pdf):
+    """Test sequential extraction keeps page order and reports progress."""
+    path = make_pdf([f"Page {i} text" for i in range(1, 6)])
+    progress = []
+    
+    texts, total = extract_pages(path, on_progress=lambda c, t: progress.append((c, t)))
+    
+    assert total == 5
+    assert texts == [f"Page {i} text" for i in range(1, 6)]
+    assert progress == [(i, 5) for i in range(1, 6)]
+
+def test_extract_pages_parallel_matches_sequential(make_pdf):
+    """Test that fanned-out extraction merges results in page order."""
+    path = make_pdf([f"Page {i} text" for i in range(1, 41)])
+    progress = []
+    
+    sequential, _ = extract_pages(path)
+    parallel, total = extract_pages(
+        path, workers=3, parallel_min_pages=10,
+        on_progress=lambda c, t: progress.append(c)
+    )
+    
+    assert total == 40
+    assert parallel == sequential
+    assert progress == sorted(progress)
+    assert progress[-1] == 40
+
+def test_extract_page_range_error_placeholder(make_pdf, mocker):
+    """Test that a failing page is replaced by an error placeholder."""
+    path = make_pdf(["first", "second"])
+    original = PdfReader.pages.fget
+    
+    def failing_pages(reader):
+        pages = list(original(reader))
+        broken = mocker.Mock()
+        broken.extract_text.side_effect = ValueError("broken stream")
+        pages[1] = broken
+        return pages
+    mocker.patch.object(PdfReader, 'pages', property(failing_pages))
+    
+    start, texts = extract_page_range(path, 0, 2)
+    
+    assert start == 0
+    assert texts == ["first", "[Error extracting page 2: broken stream]"]
+
+def test_extract_text_stores_pages(app, db, pdf_handler, make_pdf):
+    """Test that extraction stores one row per page."""
+    path = make_pdf(["Opening page", "Closing page"])
+    pdf_doc = PDFDocument(filename='generated.pdf', file_path=path, file_size=1)
+    db.session.add(pdf_doc)
+    db.session.commit()
+    
+    result = pdf_handler.extract_text(pdf_doc.id)
+    
+    assert result['status'] == 'success'
+    pages = pdf_doc.pages.all()
+    assert [page.text for page in pages] == ["Opening page", "Closing page"]
+    assert pages[1].char_start == len("Opening page") + len(PDFPage.PAGE_SEPARATOR)
+
+def test_iter_pages_parallel_bounds_ranges(make_pdf):
+    """Test that streamed parallel extraction yields pages in order."""
+    path = make_pdf([f"Page {i} text" for i in range(1, 31)])
+    
+    pages = list(iter_pages(path, workers=2, parallel_min_pages=10, range_pages=4))
+    
+    assert [number for number, _, _ in pages] == list(range(1, 31))
+    assert {total for _, total, _ in pages} == {30}
+    assert pages[-1][2] == "Page 30 text"
+
+def test_streaming_extraction_matches_in_memory(app, db, pdf_handler, make_pdf):
+    """Test that streamed extraction stores the same pages, text and index."""
+    texts = [f"Section {i} covers topic{i} in detail" for i in range(1, 8)]
+    texts[3] = ""
+    documents = []
+    for name in ('memory.pdf', 'streamed.pdf'):
+        pdf_doc = PDFDocument(
+            filename=name, file_path=make_pdf(texts, name=name), file_size=1, page_count=7
+        )
+        db.session.add(pdf_doc)
+        documents.append(pdf_doc)
+    db.session.commit()
+    
+    app.config.update(EXTRACTION_STREAMING_MIN_PAGES=100)
+    in_memory = pdf_handler.extract_text(documents[0].id)
+    app.config.update(EXTRACTION_STREAMING_MIN_PAGES=1, EXTRACTION_PAGE_BATCH=3)
+    streamed = pdf_handler.extract_text(documents[1].id)
+    
+    assert 'text' not in streamed
+    assert streamed['total_pages'] == 7
+    assert streamed['char_count'] == in_memory['char_count'] == len(in_memory['text'])
+    assert streamed['text_digest'] == in_memory['text_digest'] == hashlib.sha256(
+        in_memory['text'].encode('utf-8')
+    ).hexdigest()
+    
+    db.session.expire_all()
+    memory_doc, streamed_doc = (db.session.get(PDFDocument, d.id) for d in documents)
+    assert streamed_doc.processing_status == 'completed'
+    assert streamed_doc.extracted_text is None
+    assert [(p.page_number, p.text, p.char_start, p.char_end) for p in streamed_doc.pages] == \
+        [(p.page_number, p.text, p.char_start, p.char_end) for p in memory_doc.pages]
+    
+    memory_index = DocumentIndex.load(index_path(memory_doc.file_path))
+    streamed_index = DocumentIndex.load(index_path(streamed_doc.file_path))
+    assert streamed_index.passages.tolist() == memory_index.passages.tolist()
+    assert streamed_index.search("topic6").passages == memory_index.search("topic6").passages
+    assert np.array_equal(streamed_index.dense.matrix, memory_index.dense.matrix)
+    # Index segments spilled during streaming are removed
+    assert not [name for name in os.listdir(os.path.dirname(streamed_doc.file_path))
+                if name.startswith('.segments-')]
+
+def test_pages_are_searchable_during_extraction(app, db, pdf_handler, make_pdf):
+    """Test that committed page batches can be asked about before completion."""
+    from chatbot import ChatbotService, PageCoverage
+    texts = [f"Section {i} covers topic{i} in detail" for i in range(1, 6)]
+    pdf_doc = PDFDocument(filename='generated.pdf', file_path=make_pdf(texts),
+                          file_size=1, page_count=5)
+    db.session.add(pdf_doc)
+    db.session.commit()
+    app.config.update(EXTRACTION_PAGE_BATCH=2)
+    service = ChatbotService()
+    answers = {}
+    
+    def ask(current, total):
+        if current == 4:  # Pages 1-2 are stored, 3-4 are in the current batch
+            answers['early'], _, answers['coverage'] = service.process_message(
+                1, pdf_doc.id, "topic2", with_coverage=True
+            )
+    
+    result = pdf_handler.extract_text(pdf_doc.id, on_progress=ask)
+    
+    assert result['status'] == 'success'
+    assert answers['early'].endswith("(page 2)")
+    assert answers['coverage'] == PageCoverage(2, 5, False)
+    response, _, coverage = service.process_message(1, pdf_doc.id, "topic5", with_coverage=True)
+    assert response.endswith("(page 5)")
+    assert coverage == PageCoverage(5, 5, True)
@@ -0,0 +1,72 @@
+"""Tests for throttled extraction progress reporting."""
+from io import BytesIO
+from app import socketio
+from jobs import LocalDispatcher
+from models import ExtractionJob
+from pdf_handler import PDFHandler
+from progress import ProgressReporter
+from tests.conftest import build_pdf, create_document
+
+class FakeClock:
+    """Clock advanced by hand."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def test_updates_are_throttled_by_step_and_interval(app, db):
+    """Test that per-page reports are coalesced and the last page is published."""
+    pdf = create_document(db, ["Page text"])
+    clock = FakeClock()
+    forwarded = []
+    reporter = ProgressReporter(
+        pdf.id, min_interval=15.0, min_step=10.0,
+        forward=lambda done, total: forwarded.append(done), clock=clock
+    )
+
+    # One page per second: the first update waits for the step, later ones
+    # for the interval, and the last page is always published
+    for page in range(1, 101):
+        clock.now = float(page)
+        reporter(page, 100)
+
+    assert forwarded == [10, 25, 40, 55, 70, 85, 100]
+    assert reporter.published == 7
+    assert reporter.skipped == 93
+    db.session.refresh(pdf)
+    assert pdf.processing_progress == 100.0
+
+def test_step_limits_fast_documents(app, db):
+    """Test that without an interval the percentage step alone throttles."""
+    pdf = create_document(db, ["Page text"])
+    forwarded = []
+    reporter = ProgressReporter(
+        pdf.id, min_interval=0, min_step=25.0,
+        forward=lambda done, total: forwarded.append(done)
+    )
+    for page in range(1, 11):
+        reporter(page, 10)
+    assert forwarded == [3, 6, 9, 10]
+
+def test_extraction_progress_events(app, db, tmp_path):
+    """Test that clients in the document room receive progress and completion."""
+    app.config.update(EXTRACTION_PROGRESS_INTERVAL=0, EXTRACTION_PROGRESS_STEP=50.0)
+    handler = PDFHandler(str(tmp_path / "uploads"))
+    staged, _ = handler.stage_stream(BytesIO(build_pdf(["One", "Two", "Three", "Four"])))
+    pdf_doc, _ = handler.save_staged(staged, "progress.pdf")
+    dispatcher = LocalDispatcher(app, handler, workers=0)
+
+    client = socketio.test_client(app)
+    client.emit('join', {'pdf_id': str(pdf_doc.id)})
+    client.get_received()
+    dispatcher.submit(pdf_doc.id)
+
+    events = [event['args'][0] for event in client.get_received()
+              if event['name'] == 'extraction_progress']
+    client.disconnect()
+    assert [event['progress'] for event in events] == [50.0, 100.0, 100.0]
+    assert events[0]['pages_done'] == 2 and events[0]['total_pages'] == 4
+    assert [event['status'] for event in events][-1] == 'completed'
+    assert ExtractionJob.query.one().status == 'completed'
@@ -0,0 +1,173 @@
+"""Unit tests for passage chunking and the retrieval indexes."""
+import os
+import numpy as np
+import pytest
+from retrieval import (
+    BM25Index, DenseIndex, DocumentIndex, HashingEmbedder, IncrementalIndex,
+    split_passages, tokenize, index_path
+)
+
+PAGES = [
+    "Employees accrue annual leave at two days per month of service.",
+    "Travel expenses must be approved by a manager before booking flights.",
+    "The office is closed on public holidays. Annual leave requests go to HR.",
+]
+
+@pytest.fixture
+def index():
+    """Build a document index over the sample pages."""
+    return DocumentIndex.build(PAGES)
+
+def test_tokenize_normalizes_terms():
+    """Test lowercasing, stopword removal and suffix stripping."""
+    assert tokenize("What are the Holidays and Expenses?") == ["holiday", "expense"]
+
+def test_split_passages_offsets():
+    """Test that passages stay within pages and overlap by the given words."""
+    text = " ".join(f"word{i}" for i in range(25))
+    passages = split_passages([text, "short page"], passage_words=10, overlap_words=2)
+
+    first_page = [text[start:end] for page, start, end in passages if page == 1]
+    assert first_page[0].split() == [f"word{i}" for i in range(10)]
+    assert first_page[1].split()[:2] == ["word8", "word9"]
+    assert first_page[-1].endswith("word24")
+    assert passages[-1]['page'] == 2
+
+def test_search_ranks_relevant_passage_first(index):
+    """Test that the passage sharing rare terms ranks first."""
+    result = index.search("How do I get travel expenses approved?")
+
+    assert index.passages[result.passages[0]]['page'] == 2
+    assert result.scores == sorted(result.scores, reverse=True)
+    assert result.confidence > 0.5
+
+def test_search_confidence_reflects_margin(index):
+    """Test that ambiguous matches get lower confidence than clear ones."""
+    ambiguous = index.search("annual leave")
+    clear = index.search("annual leave accrue month")
+
+    assert len(ambiguous.passages) == 2
+    assert ambiguous.confidence < clear.confidence
+
+def test_search_without_matches(index):
+    """Test that unrelated queries return no passages and zero confidence."""
+    result = index.search("quantum chromodynamics")
+    assert result.passages == []
+    assert result.confidence == 0.0
+
+@pytest.mark.parametrize('mode', ['bm25', 'dense'])
+def test_search_limits_results(mode):
+    """Test that at most k passages are returned."""
+    index = DocumentIndex.build([f"policy number {i}" for i in range(20)])
+    assert len(index.search("policy", k=3, mode=mode).passages) == 3
+
+def test_embedder_is_deterministic_and_normalized():
+    """Test that embeddings are stable unit vectors of the configured width."""
+    embedder = HashingEmbedder(dim=64)
+    first = embedder.embed("Annual leave policy")
+    second = HashingEmbedder(dim=64).embed("Annual leave policy")
+
+    assert first.dtype == np.float32
+    assert first.shape == (64,)
+    assert np.array_equal(first, second)
+    assert np.isclose(np.linalg.norm(first), 1.0)
+    assert not HashingEmbedder(dim=64).embed("the and of").any()
+
+def test_dense_search_ranks_similar_passage_first(index):
+    """Test semantic search over the sample pages."""
+    result = index.search("approval for travel expenses", mode='dense')
+
+    assert index.passages[result.passages[0]]['page'] == 2
+    assert result.scores == sorted(result.scores, reverse=True)
+    assert 0.5 < result.confidence <= 1.0
+
+def test_dense_search_without_matches(index):
+    """Test that queries sharing no terms with the document find nothing."""
+    assert index.search("quantum chromodynamics", mode='dense').passages == []
+
+def test_dense_matrix_shape():
+    """Test that one float32 row is stored per passage."""
+    dense = DenseIndex.build(["alpha beta", "gamma delta", "epsilon"], dim=32)
+    assert dense.matrix.shape == (3, 32)
+    assert dense.matrix.dtype == np.float32
+    assert np.allclose(np.linalg.norm(dense.matrix, axis=1), 1.0)
+
+def test_save_and_load_round_trip(index, tmp_path):
+    """Test that a saved index loads with identical results."""
+    path = str(tmp_path / "doc.index")
+    index.save(path, content_hash="abc")
+
+    loaded = DocumentIndex.load(path, content_hash="abc")
+
+    assert loaded.search("travel").passages == index.search("travel").passages
+    assert loaded.search("travel", mode='dense') == index.search("travel", mode='dense')
+    assert np.array_equal(loaded.passages, index.passages)
+
+def test_load_rejects_stale_or_missing_index(index, tmp_path):
+    """Test that a content hash mismatch or missing file yields None."""
+    path = str(tmp_path / "doc.index")
+    index.save(path, content_hash="abc")
+
+    assert DocumentIndex.load(path, content_hash="def") is None
+    assert DocumentIndex.load(str(tmp_path / "missing.index")) is None
+
+def test_index_path_next_to_file():
+    """Test that the index is stored next to the uploaded PDF."""
+    assert index_path("/uploads/ab/abcdef.pdf") == "/uploads/ab/abcdef.index"
+
+@pytest.mark.parametrize('mode', ['bm25', 'dense'])
+def test_search_many_matches_search(index, mode):
+    """Test that batched search returns the single-query results in order."""
+    queries = ["travel expenses", "quantum chromodynamics", "annual leave"]
+    assert index.search_many(queries, mode=mode) == [
+        index.search(query, mode=mode) for query in queries
+    ]
+
+@pytest.mark.parametrize('batch', [1, 2, 3])
+def test_incremental_index_matches_build(index, batch):
+    """Test that indexing pages in batches gives the same index as one build."""
+    incremental = IncrementalIndex()
+    for start in range(0, len(PAGES), batch):
+        incremental.add_pages(PAGES[start:start + batch])
+        assert len(incremental.index()) == len(split_passages(PAGES[:start + batch]))
+    merged = incremental.index()
+
+    assert incremental.pages == len(PAGES)
+    assert merged.passages.tolist() == index.passages.tolist()
+    for name in ('term_keys', 'term_offsets', 'postings', 'frequencies', 'lengths', 'norms'):
+        assert np.array_equal(getattr(merged.bm25, name), getattr(index.bm25, name))
+    assert np.array_equal(merged.dense.matrix, index.dense.matrix)
+    assert np.array_equal(merged.dense.idf, index.dense.idf)
+
+@pytest.mark.parametrize('batch', [1, 2, 3])
+def test_spilled_incremental_index_saves_build(index, batch, tmp_path, monkeypatch):
+    """Test that segments spilled to disk save the same index as one build."""
+    monkeypatch.setattr(IncrementalIndex, 'MERGE_POSTINGS', 4)
+    with IncrementalIndex(spill_dir=str(tmp_path)) as incremental:
+        for start in range(0, len(PAGES), batch):
+            incremental.add_pages(PAGES[start:start + batch])
+        incremental.save(str(tmp_path / "spilled.index"), content_hash="abc")
+        index.save(str(tmp_path / "built.index"), content_hash="abc")
+        assert len(incremental) == len(index)
+        assert np.array_equal(incremental.index().dense.matrix, index.dense.matrix)
+    spilled = DocumentIndex.load(str(tmp_path / "spilled.index"), content_hash="abc")
+    built = DocumentIndex.load(str(tmp_path / "built.index"), content_hash="abc")
+
+    assert spilled.passages.tolist() == built.passages.tolist()
+    for name in ('term_keys', 'term_offsets', 'postings', 'frequencies', 'lengths', 'norms'):
+        assert np.array_equal(getattr(spilled.bm25, name), getattr(built.bm25, name))
+    assert np.array_equal(spilled.dense.matrix, built.dense.matrix)
+    assert np.array_equal(spilled.dense.idf, built.dense.idf)
+    # Closing the index removes its segment files
+    assert sorted(os.listdir(tmp_path)) == ["built.index", "spilled.index"]
+
+def test_spilled_incremental_index_without_pages(tmp_path):
+    """Test that an empty spilled index saves an empty index."""
+    with IncrementalIndex(dim=16, spill_dir=str(tmp_path)) as incremental:
+        incremental.add_pages([""])
+        incremental.save(str(tmp_path / "empty.index"))
+
+    loaded = DocumentIndex.load(str(tmp_path / "empty.index"))
+    assert len(loaded) == 0
+    assert loaded.dense.matrix.shape == (0, 16)
+    assert loaded.search("anything").passages == []
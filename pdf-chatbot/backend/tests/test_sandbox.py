@@ -0,0 +1,126 @@
+"""Tests for sandboxed page extraction."""
+import multiprocessing
+import os
+import time
+import pytest
+from PyPDF2 import PageObject
+from models import PDFDocument
+from pdf_handler import PDFHandler, extract_pages
+from sandbox import (CRASHED, DOCUMENT_TIMEOUT, MEMORY, TIMEOUT, SandboxError, SandboxLimits,
+                     count_pages, skipped_text)
+
+@pytest.fixture
+def misbehaving_pages(mocker):
+    """Make pages misbehave in sandbox children according to their text.
+
+    Children are forked instead of started from the fork server so that they
+    inherit the patched PyPDF2.
+    """
+    mocker.patch('sandbox.process_context', lambda: multiprocessing.get_context('fork'))
+    original = PageObject.extract_text
+
+    def extract_text(page, *args, **kwargs):
+        text = original(page, *args, **kwargs)
+        if 'stall' in text:
+            time.sleep(60)
+        elif 'slow' in text:
+            time.sleep(0.3)
+        elif 'hog' in text:
+            bytearray(2**31)
+        elif 'crash' in text:
+            os._exit(1)
+        return text
+    mocker.patch.object(PageObject, 'extract_text', extract_text)
+
+def run_sandboxed(path, limits, **kwargs):
+    skipped = []
+    texts, total = extract_pages(
+        path, sandbox=limits, on_skip=lambda page, reason: skipped.append((page, reason)),
+        **kwargs
+    )
+    return texts, total, skipped
+
+def test_sandboxed_extraction_matches_in_process(make_pdf):
+    """Test that children extract the same text, sequentially and in parallel."""
+    path = make_pdf([f"Page {i} text" for i in range(1, 13)])
+    expected, _ = extract_pages(path)
+
+    sequential, total, skipped = run_sandboxed(path, SandboxLimits())
+    parallel, _, _ = run_sandboxed(path, SandboxLimits(), workers=3, parallel_min_pages=4)
+
+    assert total == 12
+    assert sequential == parallel == expected
+    assert skipped == []
+
+def test_stalled_page_is_skipped(make_pdf, misbehaving_pages):
+    """Test that a page over its budget is skipped and extraction carries on."""
+    path = make_pdf(["first", "stall here", "third"])
+
+    texts, total, skipped = run_sandboxed(path, SandboxLimits(page_timeout=0.5))
+
+    assert total == 3
+    assert texts == ["first", skipped_text(2, TIMEOUT), "third"]
+    assert skipped == [(2, TIMEOUT)]
+
+@pytest.mark.parametrize('trigger, reason', [('hog', MEMORY), ('crash', CRASHED)])
+def test_page_exhausting_memory_or_crashing_is_skipped(make_pdf, misbehaving_pages,
+                                                         trigger, reason):
+    """Test that the memory ceiling and child crashes only cost the page."""
+    path = make_pdf(["first", f"{trigger} here", "third"])
+
+    texts, _, skipped = run_sandboxed(path, SandboxLimits(memory_limit=512 * 2**20))
+
+    assert texts == ["first", skipped_text(2, reason), "third"]
+    assert skipped == [(2, reason)]
+
+def test_document_budget_skips_remaining_pages(make_pdf, misbehaving_pages):
+    """Test that pages left when the document budget runs out are skipped."""
+    path = make_pdf([f"slow page {i}" for i in range(1, 11)])
+
+    texts, total, skipped = run_sandboxed(path, SandboxLimits(document_timeout=1.0))
+
+    assert total == 10
+    assert texts[0] == "slow page 1"
+    assert skipped
+    assert {reason for _, reason in skipped} == {DOCUMENT_TIMEOUT}
+    # Everything after the first skipped page is skipped
+    assert [page for page, _ in skipped] == list(range(skipped[0][0], 11))
+
+def test_count_pages_rejects_unreadable_file(tmp_path):
+    """Test that a file that cannot be parsed raises SandboxError."""
+    path = tmp_path / "broken.pdf"
+    path.write_bytes(b"%PDF-1.4 not really")
+
+    with pytest.raises(SandboxError):
+        count_pages(str(path), SandboxLimits())
+
+def test_extract_text_records_skipped_pages(app, db, client, make_pdf, misbehaving_pages,
+                                            tmp_path):
+    """Test that skipped pages are stored on the document and reported."""
+    app.config.update(EXTRACTION_SANDBOX=True, EXTRACTION_PAGE_TIMEOUT=0.5)
+    path = make_pdf(["Opening page", "stall here", "Closing page"])
+    pdf_doc = PDFDocument(filename='generated.pdf', file_path=path, file_size=1)
+    db.session.add(pdf_doc)
+    db.session.commit()
+
+    result = PDFHandler(str(tmp_path / "uploads")).extract_text(pdf_doc.id)
+
+    assert result['status'] == 'success'
+    assert result['skipped_pages'] == [{"page": 2, "reason": TIMEOUT}]
+    assert pdf_doc.pages.all()[1].text == skipped_text(2, TIMEOUT)
+    status = client.get(f'/api/documents/{pdf_doc.id}/status').get_json()
+    assert status['document']['skipped_pages'] == [{"page": 2, "reason": TIMEOUT}]
+
+def test_daemonic_fallback_warns(app, db, make_pdf, mocker, caplog, tmp_path):
+    """Test that extracting without the sandbox in a daemonic process is logged."""
+    app.config.update(EXTRACTION_SANDBOX=True)
+    mocker.patch('pdf_handler.multiprocessing.current_process').return_value.daemon = True
+    pdf_doc = PDFDocument(filename='generated.pdf', file_path=make_pdf(["Only page"]),
+                          file_size=1)
+    db.session.add(pdf_doc)
+    db.session.commit()
+
+    result = PDFHandler(str(tmp_path / "uploads")).extract_text(pdf_doc.id)
+
+    assert result['status'] == 'success'
+    assert 'WITHOUT the sandbox' in caplog.text
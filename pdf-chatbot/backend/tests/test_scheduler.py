@@ -0,0 +1,144 @@
+"""Tests for the extraction job scheduler."""
+import queue
+import threading
+import pytest
+from metrics import EXTRACTION_OVERTAKEN_JOBS
+from scheduler import ExtractionScheduler, estimate_cost
+
+class FakeClock:
+    """Clock advanced by hand."""
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+def drain(scheduler, fast_lane=False):
+    order = []
+    while scheduler.qsize():
+        order.append(scheduler.get(fast_lane=fast_lane).job_id)
+        scheduler.task_done()
+    return order
+
+def test_estimate_cost():
+    """Test that cost is the larger of page count and size in typical pages."""
+    assert estimate_cost(None, None) == 1.0
+    assert estimate_cost(2, 10 * 1024) == 2.0
+    assert estimate_cost(10, 50 * 2**20) == 800.0
+
+def test_smallest_job_first():
+    """Test that small documents overtake a large one queued before them."""
+    scheduler = ExtractionScheduler(clock=FakeClock())
+    scheduler.put('manual', cost=3000)
+    for number in range(3):
+        scheduler.put(f'memo-{number}', cost=2)
+
+    assert drain(scheduler) == ['memo-0', 'memo-1', 'memo-2', 'manual']
+
+def test_aging_prevents_starvation():
+    """Test that a large job that has waited long enough goes first."""
+    clock = FakeClock()
+    scheduler = ExtractionScheduler(aging_seconds=30, clock=clock)
+    scheduler.put('manual', cost=3000)
+    clock.now = 400  # Over ten doublings of size
+    scheduler.put('memo', cost=2)
+
+    assert drain(scheduler) == ['manual', 'memo']
+
+def test_restored_wait_counts_for_aging():
+    """Test that time waited before a restart is kept."""
+    scheduler = ExtractionScheduler(aging_seconds=30, clock=FakeClock())
+    scheduler.put('memo', cost=2)
+    scheduler.put('manual', cost=3000, waited=400)
+
+    assert drain(scheduler) == ['manual', 'memo']
+
+def test_tenants_are_served_fairly():
+    """Test that a tenant with a large batch does not hold up another one."""
+    scheduler = ExtractionScheduler(clock=FakeClock())
+    for number in range(4):
+        scheduler.put(f'batch-{number}', tenant='bulk', cost=5)
+    scheduler.put('single', tenant='interactive', cost=5)
+
+    assert drain(scheduler)[:2] == ['batch-0', 'single']
+
+def test_new_tenant_does_not_bank_credit():
+    """Test that a tenant joining late starts level with the active ones."""
+    scheduler = ExtractionScheduler(clock=FakeClock())
+    for number in range(4):
+        scheduler.put(f'a-{number}', tenant='a', cost=4)
+    assert [scheduler.get().job_id for _ in range(2)] == ['a-0', 'a-1']
+
+    scheduler.put('c-0', tenant='c', cost=4)
+    scheduler.put('c-1', tenant='c', cost=4)
+
+    assert drain(scheduler) == ['a-2', 'c-0', 'a-3', 'c-1']
+
+def test_fast_lane_only_takes_small_documents():
+    """Test that fast lane workers skip large documents."""
+    scheduler = ExtractionScheduler(fast_lane_pages=10, clock=FakeClock())
+    scheduler.put('manual', cost=3000)
+    scheduler.put('memo', cost=2)
+    scheduler.put('report', cost=40)
+
+    assert scheduler.get(fast_lane=True).job_id == 'memo'
+    scheduler.task_done()
+    assert scheduler.qsize() == 2
+
+def test_overtaken_jobs_are_recorded():
+    """Test that reordering is recorded per lane."""
+    before = EXTRACTION_OVERTAKEN_JOBS.collect().get(('fast',), [0] * 10)
+    scheduler = ExtractionScheduler(clock=FakeClock())
+    scheduler.put('manual', cost=3000)
+    scheduler.put('report', cost=40)
+    scheduler.put('memo', cost=2)
+
+    drain(scheduler)
+
+    after = EXTRACTION_OVERTAKEN_JOBS.collect()[('fast',)]
+    # The memo was started ahead of both older jobs (bucket le=2)
+    assert after[2] - before[2] == 1
+
+def test_full_and_closed_scheduler_rejects_jobs():
+    """Test that put raises queue.Full when full or closed."""
+    scheduler = ExtractionScheduler(maxsize=1)
+    scheduler.put('first')
+    with pytest.raises(queue.Full):
+        scheduler.put('second')
+
+    scheduler.close()
+    assert scheduler.get().job_id == 'first'
+    assert scheduler.get() is None
+    with pytest.raises(queue.Full):
+        scheduler.put('third')
+
+def test_get_waits_for_an_eligible_job():
+    """Test that a fast lane worker blocks until a small job arrives."""
+    scheduler = ExtractionScheduler(fast_lane_pages=10)
+    scheduler.put('manual', cost=3000)
+    received = []
+    worker = threading.Thread(
+        target=lambda: received.append(scheduler.get(fast_lane=True).job_id)
+    )
+    worker.start()
+
+    scheduler.put('memo', cost=2)
+    worker.join(5)
+
+    assert received == ['memo']
+
+def test_admission_order_of_deferred_jobs():
+    """Test that jobs waiting outside the scheduler are admitted by priority."""
+    scheduler = ExtractionScheduler(aging_seconds=30, clock=FakeClock())
+    scheduler.put('queued', tenant='acme', cost=50)
+
+    order = scheduler.admission_order([
+        ('acme-manual', 'acme', 3000, 0),
+        ('acme-memo', 'acme', 2, 0),
+        ('globex-memo', 'globex', 2, 0),
+        ('old-manual', None, 3000, 400),
+    ])
+
+    # Tenants new to the scheduler start level with acme, then take turns
+    assert order == ['acme-memo', 'globex-memo', 'old-manual', 'acme-manual']
@@ -0,0 +1,46 @@
+"""Tests for the Socket.IO chat events."""
+import pytest
+from app import socketio
+from tests.conftest import create_document
+
+@pytest.fixture
+def socket_client(app, db):
+    """Connect a Socket.IO test client."""
+    client = socketio.test_client(app)
+    yield client
+    client.disconnect()
+
+def test_chat_message_streams_chunks_to_room(socket_client, db):
+    """Test that replies arrive as chunk events followed by the full response."""
+    pdf = create_document(db, ["Parking permits are issued by the facilities desk."])
+    socket_client.emit('join', {'pdf_id': str(pdf.id)})
+    socket_client.get_received()
+
+    socket_client.emit('chat_message', {'pdf_id': str(pdf.id), 'message': 'parking permits'})
+    received = socket_client.get_received()
+
+    chunks = [event['args'][0] for event in received if event['name'] == 'chat_response_chunk']
+    final = [event['args'][0] for event in received if event['name'] == 'chat_response']
+    assert len(final) == 1
+    # One event per passage, not one per word
+    assert [(chunk['index'], chunk['chunk']) for chunk in chunks] == [(0, final[0]['response'])]
+    assert final[0]['response'].endswith('(page 1)')
+
+def test_chat_message_invalid_data(socket_client):
+    """Test that incomplete messages are rejected."""
+    socket_client.get_received()
+    socket_client.emit('chat_message', {'message': 'no document'})
+    assert socket_client.get_received()[0]['name'] == 'error'
+
+def test_chat_message_reuses_shared_service(app, socket_client, db):
+    """Test that the index built for one message is reused by the next."""
+    pdf = create_document(db, ["Parking permits are issued by the facilities desk."])
+    service = app.extensions['chatbot_service']
+
+    socket_client.emit('chat_message', {'pdf_id': str(pdf.id), 'message': 'parking permits'})
+    cached = dict(service._indexes)
+    socket_client.emit('chat_message', {'pdf_id': str(pdf.id), 'message': 'facilities desk'})
+
+    assert len(cached) == 1
+    assert dict(service._indexes) == cached
+    assert app.extensions['chat_workers'].stats()['completed'] == 2
@@ -2,11 +2,12 @@ import os
 import pytest
 from io import BytesIO
 from models import PDFDocument
+from tests.conftest import build_pdf
 
 def test_upload_endpoint_success(client, tmp_path):
     """Test successful file upload through the API endpoint."""
     # Create a mock PDF file
-    content = b"%PDF-1.4\n%¥±ë\n1 0 obj\n<</Type/Catalog/Pages 2 0 R>>\nendobj"
+    content = b"%PDF-1.4\n%\xa5\xb1\xeb\n1 0 obj\n<</Type/Catalog/Pages 2 0 R>>\nendobj"
     data = {
         'file': (BytesIO(content), 'test.pdf', 'application/pdf')
     }
@@ -56,7 +57,7 @@ def test_upload_endpoint_server_error(client, mocker):
     # Mock PDFHandler to raise an exception
     mocker.patch('app.PDFHandler.save_file', side_effect=Exception("Server error"))
     
-    content = b"%PDF-1.4\n%¥±ë"
+    content = b"%PDF-1.4\n%\xa5\xb1\xeb"
     data = {
         'file': (BytesIO(content), 'test.pdf', 'application/pdf')
     }
@@ -64,4 +65,43 @@ def test_upload_endpoint_server_error(client, mocker):
     response = client.post('/api/upload', data=data, content_type='multipart/form-data')
     
     assert response.status_code == 500
-    assert b'error' in response.data.lower()
\ No newline at end of file
+    assert b'error' in response.data.lower()
+def test_upload_endpoint_raw_stream(client, db):
+    """Test uploading a raw PDF request body."""
+    content = b"%PDF-1.4\n1 0 obj\n<</Type/Catalog/Pages 2 0 R>>\nendobj"
+    
+    response = client.post(
+        '/api/upload?filename=streamed.pdf',
+        data=content,
+        content_type='application/pdf'
+    )
+    
+    assert response.status_code == 201
+    data = response.get_json()
+    assert data['file']['filename'] == 'streamed.pdf'
+    assert data['file']['size'] == len(content)
+    
+    pdf_doc = PDFDocument.query.filter_by(filename='streamed.pdf').first()
+    with open(pdf_doc.file_path, 'rb') as f:
+        assert f.read() == content
+
+def test_upload_endpoint_raw_stream_no_filename(client):
+    """Test raw uploads without a filename are rejected."""
+    response = client.post('/api/upload', data=b"%PDF-1.4\n", content_type='application/pdf')
+    
+    assert response.status_code == 400
+    assert b'no filename' in response.data.lower()
+
+def test_upload_response_includes_prescan(client, db):
+    """Test that the upload response reports page count and metadata."""
+    content = build_pdf(["One", "Two", "Three"], info={'Title': 'Report', 'Author': 'Ops'})
+    
+    response = client.post(
+        '/api/upload?filename=report.pdf',
+        data=content,
+        content_type='application/pdf'
+    )
+    
+    assert response.status_code == 201
+    data = response.get_json()['file']
+    assert (data['page_count'], data['title'], data['author']) == (3, 'Report', 'Ops')